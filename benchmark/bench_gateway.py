@@ -0,0 +1,272 @@
+# End-to-end benchmark for the GPS SMS gateway
+#
+# Run the whole gateway against a modem stand-in on a local pseudo terminal:
+# the gateway opens the pty slave like a real USB modem, the master end is
+# served by the gsm:// modem emulator with its simulated GPS trackers.
+# Every combination of fleet size, poll interval and tracker reply latency
+# is run in its own gateway process, while HTTP clients hammer /gpsinfo.
+#
+# For each run the positions updated per minute, the p50/p95/p99 poll round
+# trip and the /gpsinfo latency are reported, and written as JSON so the
+# results of different releases can be compared.
+#
+# Usage: python benchmark/bench_gateway.py [--fleet 10,100] [--interval 10]
+#        [--latency 1,5] [--duration 60] [--http-clients 4] [--output result.json]
+
+import argparse
+import json
+import os
+import pty
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tty
+
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import serial
+
+# Cell phone no. of the simulated fleet, +60190000000 onward
+FLEET_PREFIX = '+6019'
+
+# Nearest rank percentile of a sorted sample list
+def percentile(sortedList, percent):
+    if len(sortedList) == 0:
+        return None
+
+    rank = int(round(percent / 100.0 * len(sortedList) + 0.5)) - 1
+    return sortedList[max(0, min(rank, len(sortedList) - 1))]
+
+# Summary of latency samples (seconds)
+def latency_summary(sampleList):
+    sortedList = sorted(sampleList)
+    return {
+        'count' : len(sortedList),
+        'p50' : percentile(sortedList, 50),
+        'p95' : percentile(sortedList, 95),
+        'p99' : percentile(sortedList, 99),
+        'max' : sortedList[-1] if len(sortedList) > 0 else None,
+    }
+
+# Modem stand-in on a pseudo terminal, the master end is served by the gsm:// emulator
+class PtyModem(object):
+
+    def __init__(self, emulatorUrl):
+        self.masterFd, slaveFd = pty.openpty()
+        tty.setraw(slaveFd)
+        self.slavePath = os.ttyname(slaveFd)
+        # Keep the slave open, the master read fails once every slave is closed
+        self.slaveFd = slaveFd
+        self.emulator = serial.serial_for_url(emulatorUrl, timeout=0.05)
+
+    # Forward the gateway output to the emulator
+    def to_emulator(self):
+        while True:
+            try:
+                txData = os.read(self.masterFd, 4096)
+            except OSError:
+                return
+            self.emulator.write(txData)
+
+    # Forward the emulator output to the gateway
+    def from_emulator(self):
+        while True:
+            rxData = self.emulator.read(self.emulator.in_waiting or 1)
+            if rxData:
+                os.write(self.masterFd, rxData)
+
+    def start(self):
+        for pumpTarget in (self.to_emulator, self.from_emulator):
+            pumpThread = threading.Thread(target=pumpTarget)
+            pumpThread.daemon = True
+            pumpThread.start()
+
+# HTTP client sending /gpsinfo back-to-back until the stop time
+def http_client(serverPort, stopTime, latencyList, errorList):
+    httpConn = httplib.HTTPConnection('127.0.0.1', serverPort, timeout=10)
+
+    while time.time() < stopTime:
+        reqStart = time.time()
+        try:
+            httpConn.request('GET', '/gpsinfo')
+            httpResp = httpConn.getresponse()
+            httpResp.read()
+            if httpResp.status != 200:
+                errorList.append(httpResp.status)
+                continue
+        except Exception as e:
+            errorList.append(str(e))
+            httpConn.close()
+            httpConn = httplib.HTTPConnection('127.0.0.1', serverPort, timeout=10)
+            continue
+        latencyList.append(time.time() - reqStart)
+
+# One benchmark run inside its own gateway process, return the result dictionary
+def run_worker(runConfig):
+    workDir = tempfile.mkdtemp(prefix='bench_gateway')
+
+    try:
+        listPath = os.path.join(workDir, 'gpstracker.list')
+        with open(listPath, 'w') as listFile:
+            for trackerIndx in range(runConfig['fleet']):
+                listFile.write('%s%07d\n' % (FLEET_PREFIX, trackerIndx))
+
+        ptyModem = PtyModem('gsm://?latency=%s&jitter=%s&seed=1&storage=%d' %
+                            (runConfig['latency'], runConfig['latency'] / 4.0, 255))
+        ptyModem.start()
+
+        # Gateway settings must be in place before the gateway is imported
+        import settings
+        settings.modempool = [{'port' : ptyModem.slavePath, 'baudrate' : 115200}]
+        settings.trackerlistfile = listPath
+        settings.trackerlistwatch = 0
+        settings.historydb = os.path.join(workDir, 'gpshistory.db')
+        settings.minpollinterval = runConfig['interval']
+        settings.maxpollinterval = runConfig['interval']
+        settings.maxoutstandingpoll = runConfig['maxoutstanding']
+
+        # Gateway print every AT command exchange
+        realStdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        sys.argv = [sys.argv[0], 'ENABLEPOLL']
+
+        import metrics
+        import gpsSMStrackServer
+
+        # Keep every poll round trip sample, the histogram bucket are too coarse for percentile
+        rttList = []
+        observeLatency = metrics.POLL_LATENCY.observe
+        def record_latency(labelValues, roundTrip):
+            rttList.append(roundTrip)
+            observeLatency(labelValues, roundTrip)
+        metrics.POLL_LATENCY.observe = record_latency
+
+        # Werkzeug log every request to stderr
+        import logging
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+        from werkzeug.serving import make_server
+        httpServer = make_server('127.0.0.1', 0, gpsSMStrackServer.app, threaded=True)
+        serverThread = threading.Thread(target=httpServer.serve_forever)
+        serverThread.daemon = True
+        serverThread.start()
+
+        gpsSMStrackServer.start_gateway()
+
+        # Measure only after the warm up, the first poll sweep is not steady state
+        time.sleep(runConfig['warmup'])
+        replyStart = metrics.GPS_REPLY.collect().get((), 0)
+        del rttList[:]
+        measureStart = time.time()
+        stopTime = measureStart + runConfig['duration']
+
+        httpLatencyList = []
+        httpErrorList = []
+        clientList = []
+        for clientIndx in range(runConfig['httpclients']):
+            clientThread = threading.Thread(target=http_client, args=(httpServer.server_port, stopTime, httpLatencyList, httpErrorList))
+            clientThread.daemon = True
+            clientThread.start()
+            clientList.append(clientThread)
+
+        time.sleep(max(0, stopTime - time.time()))
+        for clientThread in clientList:
+            clientThread.join(10)
+        measureTime = time.time() - measureStart
+
+        replyCnt = metrics.GPS_REPLY.collect().get((), 0) - replyStart
+        sys.stdout = realStdout
+
+        return {
+            'config' : runConfig,
+            'measure_seconds' : measureTime,
+            'positions_updated' : replyCnt,
+            'positions_per_minute' : replyCnt * 60.0 / measureTime,
+            'poll_round_trip' : latency_summary(rttList),
+            'poll_timeouts' : metrics.POLL_TIMEOUT.collect().get((), 0),
+            'sms_sent' : sum(metrics.SMS_SENT.collect().values()),
+            'emulator' : dict(ptyModem.emulator.stats),
+            'gpsinfo_latency' : latency_summary(httpLatencyList),
+            'gpsinfo_requests_per_second' : len(httpLatencyList) / measureTime,
+            'gpsinfo_errors' : len(httpErrorList),
+        }
+
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+# Run one configuration in a fresh process, the gateway keeps its state in module globals
+def run_config(runConfig):
+    benchProc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker', json.dumps(runConfig)],
+                                 stdout=subprocess.PIPE)
+    workerOutput = benchProc.communicate()[0].decode('utf-8')
+    if benchProc.returncode != 0:
+        return {'config' : runConfig, 'error' : 'worker exit code %d' % (benchProc.returncode)}
+
+    return json.loads(workerOutput.strip().splitlines()[-1])
+
+# Comma separated number list
+def number_list(argValue):
+    return [float(numValue) if '.' in numValue else int(numValue) for numValue in argValue.split(',')]
+
+def main():
+    argParser = argparse.ArgumentParser(description='End-to-end GPS SMS gateway benchmark')
+    argParser.add_argument('--fleet', type=number_list, default=[10, 100], help='fleet size list')
+    argParser.add_argument('--interval', type=number_list, default=[10], help='poll interval list (seconds)')
+    argParser.add_argument('--latency', type=number_list, default=[1, 5], help='tracker reply latency list (seconds)')
+    argParser.add_argument('--duration', type=float, default=30, help='measured time per run (seconds)')
+    argParser.add_argument('--warmup', type=float, default=15, help='warm up time per run (seconds)')
+    argParser.add_argument('--http-clients', type=int, default=4, help='concurrent /gpsinfo clients')
+    argParser.add_argument('--max-outstanding', type=int, default=10, help='maximum outstanding poll request')
+    argParser.add_argument('--output', default=os.path.join(BENCH_DIR, 'bench_gateway.json'), help='JSON result file')
+    argParser.add_argument('--worker', help=argparse.SUPPRESS)
+    benchArgs = argParser.parse_args()
+
+    if benchArgs.worker:
+        print(json.dumps(run_worker(json.loads(benchArgs.worker))))
+        sys.stdout.flush()
+        # Gateway thread never end, do not wait for them
+        os._exit(0)
+
+    resultList = []
+    for fleetSize in benchArgs.fleet:
+        for pollInterval in benchArgs.interval:
+            for replyLatency in benchArgs.latency:
+                runConfig = {
+                    'fleet' : fleetSize,
+                    'interval' : pollInterval,
+                    'latency' : replyLatency,
+                    'duration' : benchArgs.duration,
+                    'warmup' : benchArgs.warmup,
+                    'httpclients' : benchArgs.http_clients,
+                    'maxoutstanding' : benchArgs.max_outstanding,
+                }
+                runResult = run_config(runConfig)
+                resultList.append(runResult)
+
+                if 'error' in runResult:
+                    print("fleet %6d interval %5s latency %5s : %s" % (fleetSize, pollInterval, replyLatency, runResult['error']))
+                    continue
+                print("fleet %6d interval %5s latency %5s : %8.1f pos/min, rtt p50 %6.2f p95 %6.2f p99 %6.2f s, "
+                      "/gpsinfo p50 %6.1f p99 %6.1f ms, %7.1f req/s" % (
+                      fleetSize, pollInterval, replyLatency, runResult['positions_per_minute'],
+                      runResult['poll_round_trip']['p50'] or 0, runResult['poll_round_trip']['p95'] or 0,
+                      runResult['poll_round_trip']['p99'] or 0,
+                      (runResult['gpsinfo_latency']['p50'] or 0) * 1000, (runResult['gpsinfo_latency']['p99'] or 0) * 1000,
+                      runResult['gpsinfo_requests_per_second']))
+
+    with open(benchArgs.output, 'w') as outputFile:
+        json.dump({'python' : sys.version.split()[0], 'time' : time.strftime('%Y-%m-%dT%H:%M:%S'), 'runs' : resultList},
+                  outputFile, indent=2, sort_keys=True)
+    print("results written to %s" % (benchArgs.output))
+
+if __name__ == "__main__":
+    main()
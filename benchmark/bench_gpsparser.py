@@ -0,0 +1,119 @@
+# Micro-benchmark for the GPS tracker reply parser
+#
+# Compare the messages/second decoded by gpsparser.parse_gps_reply against
+# the former character by character loop of serial_sms_comm.
+#
+# Usage: python benchmark/bench_gpsparser.py [message count]
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gpsparser import parse_gps_reply
+
+# Sample of archived tracker reply
+SAMPLE_REPLY = [
+    'Current position!Lat:N3.05834,Lon:E101.58935,Course:0.00,Speed:0.00,DateTime:2019-03-11 13:14:07',
+    'Last position!Lat:N2.91234,Lon:E101.65432,Course:182.50,Speed:45.20,DateTime:2019-03-11 13:20:41',
+    'Current position!Lat:S6.20001,Lon:E106.81666,Course:90.00,Speed:12.75,DateTime:2019-03-12 08:01:59',
+    'Current position!Lat:N3.0583417,Lon:E101.589351,Course:7.5,Speed:0,DateTime:11/03/2019 13:14:07',
+]
+
+# Doing string manipulations
+def mid(s, offset, amount):
+    return s[offset-1:offset+amount-1]
+
+# Former GPS location decoding loop, logging removed
+def legacy_parse(decodedGPSMsg):
+    fndLatitude = False
+    fndLongitude = False
+    fndCourse = False
+    fndSpeed = False
+    timeStamp = False
+    gpsStat = False
+    latValue = ''
+    lonValue = ''
+    courseValue = ''
+    speedValue = ''
+    timeStmpValue = ''
+    gpsStatus = ''
+    decodedLength = len(decodedGPSMsg)
+
+    for a in range(0, (decodedLength + 1)):
+        oneChar = mid(decodedGPSMsg, a, 1)
+        if oneChar == '!' and gpsStat == False:
+            gpsStat = True
+        elif oneChar != '!' and gpsStat == False:
+            gpsStatus += oneChar
+
+        if oneChar == ':' and fndLatitude == False:
+            fndLatitude = True
+        elif fndLatitude == True and fndLongitude == False:
+            if oneChar == ':':
+                fndLongitude = True
+            else:
+                if oneChar != ',' and oneChar != 'L' and oneChar != 'o' and oneChar != 'n':
+                    latValue += oneChar
+        elif fndLongitude == True and fndCourse == False:
+            if oneChar == ':':
+                fndCourse = True
+            else:
+                if oneChar != 'C' and oneChar != 'o' and oneChar != 'u' and oneChar != 'r' and \
+                   oneChar != 's' and oneChar != 'e' and oneChar != ',':
+                    lonValue += oneChar
+        elif fndCourse == True and fndSpeed == False:
+            if oneChar == ':':
+                fndSpeed = True
+            else:
+                if oneChar != 'S' and oneChar != 'p' and oneChar != 'e' and oneChar != 'e' and \
+                   oneChar != 'd' and oneChar != ',':
+                    courseValue += oneChar
+        elif fndSpeed == True and timeStamp == False:
+            if oneChar == ':':
+                timeStamp = True
+            else:
+                if oneChar != 'D' and oneChar != 'a' and oneChar != 't' and oneChar != 'e' and \
+                   oneChar != 'T' and oneChar != 'i' and oneChar != 'm' and \
+                   oneChar != 'e' and oneChar != ',':
+                    speedValue += oneChar
+        elif timeStamp == True:
+            timeStmpValue += oneChar
+
+    return (gpsStatus, latValue, lonValue, courseValue, speedValue, timeStmpValue)
+
+# Decode the message list with the given parser, return messages/second
+def run_bench(parseFunc, replyList, repeatCnt):
+    def parse_all():
+        for decodedGPSMsg in replyList:
+            parseFunc(decodedGPSMsg)
+
+    # Best of the repeated runs
+    runTime = min(timeit.repeat(parse_all, number=1, repeat=repeatCnt))
+    return len(replyList) / runTime
+
+def main():
+    msgCnt = 100000
+    if len(sys.argv) > 1:
+        msgCnt = int(sys.argv[1])
+
+    replyList = [SAMPLE_REPLY[i % len(SAMPLE_REPLY)] for i in range(msgCnt)]
+
+    # Both parser must agree on the decoded fields, formatted back as the tracker text
+    for decodedGPSMsg in SAMPLE_REPLY:
+        gpsFields = parse_gps_reply(decodedGPSMsg).as_json()
+        if tuple(gpsFields[gpsField] for gpsField in ('status', 'latitude', 'longitude', 'course', 'speed', 'datetime')) != \
+           legacy_parse(decodedGPSMsg):
+            sys.exit("Parser mismatch: %s" % (decodedGPSMsg))
+
+    legacyRate = run_bench(legacy_parse, replyList, 3)
+    parserRate = run_bench(parse_gps_reply, replyList, 3)
+
+    print("messages        : %d" % (msgCnt))
+    print("legacy loop     : %12.0f msg/s" % (legacyRate))
+    print("gpsparser       : %12.0f msg/s" % (parserRate))
+    print("speed up        : %12.1fx" % (parserRate / legacyRate))
+
+if __name__ == "__main__":
+    main()
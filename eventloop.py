@@ -0,0 +1,304 @@
+# Modem event loop
+#
+# One thread drives every GSM modem in the pool. Each modem runs as a
+# coroutine written as a generator: it yields a Future (AT command reply,
+# timer or event) and is resumed with the result once the Future completes,
+# so no thread sits in time.sleep while the modem or the trackers are busy.
+# The serial port file descriptors are watched with select, together with a
+# wake up pipe the REST API threads use to hand work over to the loop.
+#
+# Python 2 has no asyncio, the loop follows its shape on top of select:
+# add_reader, call_later, call_soon_threadsafe and generator based tasks.
+# A generator may yield another generator to run it as a sub coroutine, and
+# gives back its value by raising Return (no return value in a generator).
+
+import errno
+import heapq
+import os
+import select
+import sys
+import threading
+import traceback
+import types
+from collections import deque
+
+# Monotonic clock for the timers
+from monoclock import monotonic
+
+# Value given back by a generator coroutine to its caller
+class Return(Exception):
+
+    def __init__(self, value=None):
+        Exception.__init__(self, value)
+        self.value = value
+
+# Result of an operation that completes later, inside the loop thread
+class Future(object):
+
+    def __init__(self):
+        self.done = False
+        self.result = None
+        self.exception = None
+        self.callbacks = []
+
+    # Complete with the given result, only the first completion counts
+    def set_result(self, result):
+        if self.done:
+            return
+
+        self.done = True
+        self.result = result
+        self.run_callbacks()
+
+    # Complete with the given exception, raised inside the waiting coroutine
+    def set_exception(self, exception):
+        if self.done:
+            return
+
+        self.done = True
+        self.exception = exception
+        self.run_callbacks()
+
+    # Call back with the future once completed, at once when already completed
+    def add_done_callback(self, callback):
+        if self.done:
+            callback(self)
+        else:
+            self.callbacks.append(callback)
+
+    def run_callbacks(self):
+        callbackList = self.callbacks
+        self.callbacks = []
+        for callback in callbackList:
+            callback(self)
+
+# Timer scheduled by call_later
+class TimerHandle(object):
+
+    def __init__(self, callback, args):
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+# Run a generator coroutine, resumed each time the future it yields completes
+class Task(Future):
+
+    def __init__(self, loop, coroutine, taskName=''):
+        Future.__init__(self)
+        self.loop = loop
+        self.coroutine = coroutine
+        self.taskName = taskName
+        # Caller of the running sub coroutine, innermost last
+        self.callerStack = []
+
+        loop.call_soon(self.step, None, None)
+
+    # Resume the coroutine with a value or an exception until it yields a pending future
+    def step(self, sendValue, throwExc):
+        while True:
+            try:
+                if throwExc is not None:
+                    yieldValue = self.coroutine.throw(throwExc)
+                else:
+                    yieldValue = self.coroutine.send(sendValue)
+
+            # Coroutine completed, give back its value to the caller
+            except Return as e:
+                sendValue, throwExc = e.value, None
+            except StopIteration:
+                sendValue, throwExc = None, None
+            except Exception as e:
+                sendValue, throwExc = None, e
+                excTrace = traceback.format_exc()
+
+            # Coroutine yielded, wait for the future or run the sub coroutine
+            else:
+                if isinstance(yieldValue, Future):
+                    yieldValue.add_done_callback(self.wakeup)
+                    return
+                if isinstance(yieldValue, types.GeneratorType):
+                    self.callerStack.append(self.coroutine)
+                    self.coroutine = yieldValue
+                    sendValue, throwExc = None, None
+                    continue
+
+                sendValue, throwExc = None, TypeError('coroutine yielded %r, expected a Future or a generator' % (yieldValue,))
+                continue
+
+            # Back to the caller of the completed sub coroutine
+            if len(self.callerStack) > 0:
+                self.coroutine = self.callerStack.pop()
+                continue
+
+            if throwExc is not None:
+                # Nobody waiting for the task, do not lose the error
+                if len(self.callbacks) == 0:
+                    sys.stderr.write('Task %s failed\n%s' % (self.taskName, excTrace))
+                self.set_exception(throwExc)
+            else:
+                self.set_result(sendValue)
+            return
+
+    # Future completed, resume on the next loop iteration
+    def wakeup(self, future):
+        if future.exception is not None:
+            self.loop.call_soon(self.step, None, future.exception)
+        else:
+            self.loop.call_soon(self.step, future.result, None)
+
+# Flag a coroutine can wait for, set by the loop thread
+class Event(object):
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.flag = False
+        self.waiters = []
+
+    # Set the flag, every waiting coroutine is resumed with True
+    def set(self):
+        self.flag = True
+
+        waiterList = self.waiters
+        self.waiters = []
+        for waiter in waiterList:
+            waiter.set_result(True)
+
+    def clear(self):
+        self.flag = False
+
+    def is_set(self):
+        return self.flag
+
+    # Future completed with True once the flag is set, False after timeOut (seconds)
+    def wait(self, timeOut=None):
+        waiter = Future()
+        if self.flag:
+            waiter.set_result(True)
+            return waiter
+
+        self.waiters.append(waiter)
+        if timeOut is not None:
+            waitTimer = self.loop.call_later(timeOut, self.wait_expired, waiter)
+            waiter.add_done_callback(lambda future: waitTimer.cancel())
+
+        return waiter
+
+    def wait_expired(self, waiter):
+        if waiter in self.waiters:
+            self.waiters.remove(waiter)
+        waiter.set_result(False)
+
+# Select based event loop, every callback runs in the loop thread
+class EventLoop(object):
+
+    def __init__(self):
+        # File descriptor -> read ready callback
+        self.readers = {}
+        # (due time, sequence no., timer handle)
+        self.timerHeap = []
+        self.timerSeq = 0
+        # Callback to run on the next iteration, (callback, args)
+        self.readyQueue = deque()
+        # Callback handed over by other threads, moved to readyQueue by the loop thread
+        self.threadQueue = deque()
+        self.threadLock = threading.Lock()
+        # Wake up pipe, a byte written by another thread ends the select at once
+        self.wakeRead, self.wakeWrite = os.pipe()
+        self.wakePending = False
+        self.loopThread = None
+
+    # Call back once the file descriptor is ready to read
+    def add_reader(self, fileNo, callback):
+        self.readers[fileNo] = callback
+
+    def remove_reader(self, fileNo):
+        self.readers.pop(fileNo, None)
+
+    # Call back on the next loop iteration
+    def call_soon(self, callback, *args):
+        self.readyQueue.append((callback, args))
+
+    # Call back after the delay (seconds), return the timer handle to cancel it
+    def call_later(self, delay, callback, *args):
+        timerHandle = TimerHandle(callback, args)
+        self.timerSeq += 1
+        heapq.heappush(self.timerHeap, (monotonic() + delay, self.timerSeq, timerHandle))
+
+        return timerHandle
+
+    # Call back on the next loop iteration, from any thread
+    def call_soon_threadsafe(self, callback, *args):
+        with self.threadLock:
+            self.threadQueue.append((callback, args))
+            if self.wakePending:
+                return
+            self.wakePending = True
+
+        os.write(self.wakeWrite, b'x')
+
+    # Future completed after the delay (seconds)
+    def sleep(self, delay):
+        sleepFuture = Future()
+        self.call_later(delay, sleepFuture.set_result, None)
+
+        return sleepFuture
+
+    # Start running the generator coroutine on the loop
+    def create_task(self, coroutine, taskName=''):
+        return Task(self, coroutine, taskName)
+
+    # Time until the earliest timer, None when no timer (seconds)
+    def select_timeout(self):
+        if len(self.readyQueue) > 0:
+            return 0
+
+        while len(self.timerHeap) > 0 and self.timerHeap[0][2].cancelled:
+            heapq.heappop(self.timerHeap)
+        if len(self.timerHeap) == 0:
+            return None
+
+        return max(0, self.timerHeap[0][0] - monotonic())
+
+    # One loop iteration, wait for a ready file descriptor or the earliest timer
+    def run_once(self):
+        try:
+            readyList = select.select([self.wakeRead] + list(self.readers), [], [], self.select_timeout())[0]
+        except (select.error, OSError) as e:
+            # Interrupted by a signal, try again
+            if e.args[0] != errno.EINTR:
+                raise
+            readyList = []
+
+        for fileNo in readyList:
+            if fileNo == self.wakeRead:
+                os.read(self.wakeRead, 4096)
+                with self.threadLock:
+                    self.wakePending = False
+                    self.readyQueue.extend(self.threadQueue)
+                    self.threadQueue.clear()
+            elif fileNo in self.readers:
+                self.readyQueue.append((self.readers[fileNo], ()))
+
+        now = monotonic()
+        while len(self.timerHeap) > 0 and self.timerHeap[0][0] <= now:
+            timerHandle = heapq.heappop(self.timerHeap)[2]
+            if not timerHandle.cancelled:
+                self.readyQueue.append((timerHandle.callback, timerHandle.args))
+
+        # Only the callback ready now, callback added meanwhile run on the next iteration
+        for a in range(len(self.readyQueue)):
+            callback, args = self.readyQueue.popleft()
+            try:
+                callback(*args)
+            # Keep the loop running for the other modems
+            except Exception:
+                traceback.print_exc()
+
+    # Run the loop in the calling thread, never return
+    def run_forever(self):
+        self.loopThread = threading.current_thread()
+        while True:
+            self.run_once()
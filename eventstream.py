@@ -0,0 +1,93 @@
+# Live GPS location event stream
+#
+# Every decoded GPS location is published once into a single in-process
+# ring buffer with its own sequence number. Each Server-Sent Events (SSE)
+# subscriber only keeps the sequence number of the last event it sent, so
+# any number of subscribers are fanned out from the same buffer, and a
+# reconnecting client resumes from its Last-Event-ID. A new client starts
+# with the live events, it fetches the full GPS information from /gpsinfo.
+
+import collections
+import json
+import threading
+
+# Number of recent event kept for reconnecting subscriber
+EVENT_BACKLOG_SIZE = 1000
+
+# Keep alive comment interval of an idle stream (seconds)
+SSE_KEEPALIVE_INTERVAL = 15
+
+# Client reconnect delay sent with the stream (milliseconds)
+SSE_RETRY_DELAY = 3000
+
+# Format one SSE message
+def sse_message(eventName, eventData, eventSeq=None):
+    sseMsg = ''
+    if eventSeq is not None:
+        sseMsg += 'id: %d\n' % (eventSeq)
+    sseMsg += 'event: %s\n' % (eventName)
+    sseMsg += 'data: %s\n\n' % (eventData)
+
+    return sseMsg
+
+# Single producer queue fanned out to every subscriber
+class EventBroadcaster(object):
+
+    def __init__(self, backlogSize=EVENT_BACKLOG_SIZE):
+        self.cond = threading.Condition()
+        # (sequence, serialized JSON event data), oldest first
+        self.backlog = collections.deque(maxlen=backlogSize)
+        self.lastSeq = 0
+
+    # Publish one event to every subscriber, return its sequence number
+    def publish(self, eventData):
+        eventData = json.dumps(eventData, sort_keys=True, separators=(',', ':'))
+
+        with self.cond:
+            self.lastSeq += 1
+            self.backlog.append((self.lastSeq, eventData))
+            self.cond.notify_all()
+            return self.lastSeq
+
+    # Event published after the given sequence number, wait up to timeOut for a new one
+    # Return (events, missed), missed is True when older event already left the backlog
+    def wait_events(self, lastSeq, timeOut):
+        with self.cond:
+            # Sequence from before the gateway restart
+            if lastSeq > self.lastSeq:
+                lastSeq = 0
+            if lastSeq == self.lastSeq:
+                self.cond.wait(timeOut)
+
+            eventList = [oneEvent for oneEvent in self.backlog if oneEvent[0] > lastSeq]
+            missed = len(eventList) > 0 and eventList[0][0] > lastSeq + 1
+
+            return eventList, missed
+
+    # Sequence number of the last published event
+    def current_seq(self):
+        with self.cond:
+            return self.lastSeq
+
+    # SSE stream for one subscriber, starting after the given sequence number
+    # A new subscriber without sequence number only get the live event
+    def stream(self, lastSeq=None):
+        if lastSeq is None:
+            lastSeq = self.current_seq()
+
+        yield 'retry: %d\n\n' % (SSE_RETRY_DELAY)
+
+        while True:
+            eventList, missed = self.wait_events(lastSeq, SSE_KEEPALIVE_INTERVAL)
+            # Idle, keep the connection open through proxies
+            if len(eventList) == 0:
+                yield ': keepalive\n\n'
+                continue
+
+            # Client have to refetch the full GPS information
+            if missed:
+                yield sse_message('resync', '{}')
+
+            for eventSeq, eventData in eventList:
+                yield sse_message('gpsinfo', eventData, eventSeq)
+            lastSeq = eventList[-1][0]
@@ -1,5 +1,6 @@
 import logging
 import logging.handlers
+import atexit
 import sys
 import os
 import signal
@@ -7,44 +8,185 @@ import time
 import thread
 import serial
 import json
+import sqlite3
 
 # REST API library
 from flask import Flask
 from flask import jsonify
 from flask import request
+from flask import Response
 
 # Retrieve SMS server settings
 from settings import serialport
 from settings import baudrate
-from settings import pollinterval
 from settings import polltimeout
+from settings import smssendtimeout
+from settings import maxoutstandingpoll
+from settings import modempool
+from settings import smspdumode
+from settings import smsbatchdelete
+from settings import historydb
+from settings import gzipresponse
+from settings import minpollinterval
+from settings import maxpollinterval
+from settings import trackerlistfile
+from settings import countrycode
+from settings import trackerlistwatch
+from settings import logqueuesize
+from settings import lograte
+from settings import logburst
+from settings import modemfaillimit
+from settings import modemidleprobe
+from settings import reinitbackoffmin
+from settings import reinitbackoffmax
+from settings import smsqueuesize
+from settings import smssendrate
+from settings import smssendburst
+
+# GSM modem AT command executor
+from gsmmodem import AsyncGsmModem
+from gsmmodem import SERIAL_READ_TIMEOUT
+from gsmmodem import ESCAPE
+from gsmmodem import cmti_index
+from gsmmodem import CMGD_MAX_ATTEMPT
+
+# GPS location poll scheduler
+from pollscheduler import PollScheduler
+
+# Outbound SMS message queue
+from smsqueue import SmsOutbox
+from smsqueue import SendRateLimit
+from smsqueue import SMS_PRIORITY
+from smsqueue import POLL_PRIORITY
+from smsqueue import SMS_MAX_SEPTET
+
+# GSM modem health watchdog
+from modemwatchdog import ModemWatchdog
+from modemwatchdog import creg_registered
+
+# Modem event loop
+from eventloop import EventLoop
+from eventloop import Event
+from eventloop import Return
+
+# GSM modem pool
+from modempool import ModemPool
+
+# GPS tracker data store
+from trackerstore import TrackerStore
+
+# GPS tracker list loader
+from trackerlist import read_tracker_list
+from trackerlist import TrackerListWatcher
+from trackerlist import normalize_number
+
+# Monotonic clock
+from monoclock import monotonic
+
+# Gateway metrics
+from metrics import render_metrics
+from metrics import SMS_SENT
+from metrics import SMS_RECEIVED
+from metrics import CMTI_BACKLOG
+from metrics import GPS_REPLY
+from metrics import POLL_TIMEOUT
+from metrics import DECODE_FAILURE
+from metrics import POLL_LATENCY
+from metrics import POLL_LAST_LATENCY
+from metrics import MODEM_UP
+from metrics import MODEM_REINIT
+from metrics import MODEM_RECOVERY
+from metrics import OUTBOUND_SMS
+from metrics import OUTBOUND_QUEUE
+
+# GPS position history store
+from historystore import HistoryStore
+
+# Non-blocking logging
+from logqueue import LogQueueHandler
+from logqueue import LogQueueListener
+from logqueue import RateLimitFilter
+
+# Pre-serialized REST API response cache
+from responsecache import ResponseCache
+
+# Live GPS location event stream
+from eventstream import EventBroadcaster
+
+# SMS PDU codec and concatenated SMS reassembly
+from smspdu import decode_deliver_pdu
+from smspdu import encode_submit_pdu
+from smspdu import ConcatReassembler
+from smspdu import SmsPduError
+from smspdu import encode_gsm_alphabet
+
+# SMS inbox reader
+from smsinbox import list_unread_command
+from smsinbox import parse_cmgl_reply
+from smsinbox import arrival_order
+
+# GPS tracker reply parser
+from gpsparser import parse_gps_reply
+from gpsparser import GpsParseError
 
 # Global declaration
 backLogger         = False    # Macro for logger
 serialPort         = ''       # Serial communication port name
 baudRate           = 0        # Serial communication baud rate
-pollInterval       = 0        # GPS location poll interval
-pollTimeOut        = 0        
-gsmInitialize      = False    # GSM modem initialization flag
-atCheck            = False    # AT command reply check flag
-atDeleteMsg        = False    # Delete SMS command reply check flag
-atSetTxtMsg        = False    # Set text message SMS command reply check flag
+pollTimeOut        = 0        # GPS location reply deadline after the poll request (seconds)
+minPollInterval    = 0        # Poll interval of a fast moving tracker (seconds)
+maxPollInterval    = 0        # Poll interval of a parked tracker (seconds)
+smsSendTimeOut     = 0        # SMS message submit time out (seconds)
+maxOutstandingPoll = 0        # Maximum poll request waiting for reply at the same time
+smsPduMode         = False    # Receive SMS message in PDU mode (AT+CMGF=0) instead of text mode
+smsBatchDelete     = False    # Chain several AT+CMGD in one command line
+gzipResponse       = False    # gzip the cached REST API response when the client accept it
 atCnmi             = False
 atCpms             = False
 initModem          = False
-waitSendMsg        = False
 enaGPSPoll         = False
 secureInSecure     = False
-cellPhoneNo        = ''
 cellPhoneList      = []       # GPS vehicle tracker cell phone list
 cellPhoneCnt       = 0        # Cell phone no. record count
-cellNoIndx         = 0        # Cell phone no. index counter
+trackerListFile    = ''       # GPS vehicle tracker list file
+countryCode        = ''       # Country code of national cell phone no. in the tracker list
+trackerListWatch   = 0        # Tracker list file change check interval, 0 to disable (seconds)
+logQueueSize       = 0        # Log record waiting to be written to the log file
+logRate            = 0        # Log record per second for each kind of message
+logBurst           = 0        # Log record burst for each kind of message
+modemFailLimit     = 0        # Command in a row without reply before the modem is re-initialized
+modemIdleProbe     = 0        # Serial line quiet time before the modem is probed (seconds)
+reinitBackoffMin   = 0        # First re-initialization backoff, doubled on each failure (seconds)
+reinitBackoffMax   = 0        # Maximum re-initialization backoff (seconds)
+smsSendRate        = 0        # SMS message per minute each modem may send, 0 for no limit
+smsSendBurst       = 0        # SMS message each modem may send back-to-back within its send rate
 
 # Copy serial communication setting to the global variable
 serialPort = serialport
 baudRate = baudrate
-pollInterval = pollinterval
 pollTimeOut = polltimeout
+minPollInterval = minpollinterval
+maxPollInterval = maxpollinterval
+trackerListFile = trackerlistfile
+countryCode = countrycode
+trackerListWatch = trackerlistwatch
+logQueueSize = logqueuesize
+logRate = lograte
+logBurst = logburst
+modemFailLimit = modemfaillimit
+modemIdleProbe = modemidleprobe
+reinitBackoffMin = reinitbackoffmin
+reinitBackoffMax = reinitbackoffmax
+smsSendRate = smssendrate
+smsSendBurst = smssendburst
+smsSendTimeOut = smssendtimeout
+maxOutstandingPoll = maxoutstandingpoll
+smsPduMode = smspdumode
+smsBatchDelete = smsbatchdelete
+gzipResponse = gzipresponse
+
+# GPS location reply are split into this number of SMS message in text mode
+TEXT_MODE_PART_CNT = 2
 
 # Check for macro arguments
 if (len(sys.argv) > 1):
@@ -58,18 +200,36 @@ if (len(sys.argv) > 1):
         elif x == "ENABLEPOLL":
             enaGPSPoll = True      
         
-# GPS tracker list data
-gpsTrackerListData=[
-    {
-        'gpsid' : '+60133517176',
-        'latitude' : 'NA',
-        'longitude' : 'NA',
-        'course' : 'NA',
-        'speed' : 'NA',
-        'status' : 'NA',
-        'datetime' : 'NA'
-    }
-]
+# GPS tracker list data, ordered list with lookup index by gpsid
+trackerStore = TrackerStore()
+
+# GPS location history, kept across restart and GPS information reset
+historyStore = HistoryStore(historydb)
+
+# Live GPS location update, fanned out to every SSE client
+gpsEvents = EventBroadcaster()
+
+# GSM modem pool, tracker fleet are shared among the modems by consistent hash
+modemPool = ModemPool(modempool)
+
+# Outbound SMS message queue per GSM modem, routed like the trackers
+smsOutbox = SmsOutbox(modemPool.modem_count(), smsqueuesize)
+
+# Modem event loop, one thread drives every GSM modem in the pool
+modemLoop = EventLoop()
+
+# Wake up flag per GSM modem, set from the modem event loop thread only
+modemWakeList = [Event(modemLoop) for modemId in range(modemPool.modem_count())]
+
+# Wake up every GSM modem coroutine at once, e.g. after the poll setting changed
+# Safe to call from any thread, the flag are set by the modem event loop thread
+def wake_modems():
+    for modemWake in modemWakeList:
+        modemLoop.call_soon_threadsafe(modemWake.set)
+
+# Wake up one GSM modem coroutine, safe to call from any thread
+def wake_modem(modemId):
+    modemLoop.call_soon_threadsafe(modemWakeList[modemId].set)
 
 # Poll request either ENABLE or DISABLE
 pollConfigData=[
@@ -79,89 +239,6 @@ pollConfigData=[
     }
 ]
 
-# Retrieve GPS vehicle tracker cell phone from stored list
-try:
-    firstDat = False
-
-    # Open GPS vehicle tracker list of data
-    file = open("/sources/common/sourcecode/GSM-Gateway/gpstracker.list", "r")
-
-    # Go through the GPS vehicle tracker cell phone list
-    for i in range(100):
-        tempdata = ''
-        tempdata = file.readline()
-        tempdata = tempdata.strip('\n') # Get rid of new line character
-
-        # Initial state the cell phone array are emptied, add first data
-        if cellPhoneList == '':
-            # Data exist inside stored list
-            if tempdata != '':
-                cellPhoneList = [tempdata]
-                #tempdata = ''
-                # Increment record count
-                cellPhoneCnt += 1
-            # NO data remain inside stored list
-            else:
-                break
-
-        # Subsequent array index, append the data to the array
-        else:
-            # Data exist inside stored list
-            if tempdata != '':
-                cellPhoneList.append(tempdata)
-                #tempdata = ''
-                # Increment record count
-                cellPhoneCnt += 1
-            # NO data remain inside stored list
-            else:
-                break
-            
-        # First data update
-        if firstDat == False:
-            extDB = [ extDBB for extDBB in gpsTrackerListData ]
-            extDB[0]['gpsid'] = tempdata
-            extDB[0]['latitude'] = 'NA'
-            extDB[0]['longitude'] = 'NA'
-            extDB[0]['course'] = 'NA'
-            extDB[0]['speed'] = 'NA'
-            extDB[0]['status'] = 'NA'
-            extDB[0]['datetime'] = 'NA'
-            
-            firstDat = True
-        # New data update
-        else:
-            # Construct the new data
-            newData = {
-                        'gpsid' : tempdata,
-                        'latitude' : 'NA',
-                        'longitude' : 'NA',
-                        'course' : 'NA',
-                        'speed' : 'NA',
-                        'status' : 'NA',
-                        'datetime' : 'NA'
-                        }
-            
-            # Append a NEW extension to the existing record
-            gpsTrackerListData.append(newData)
-
-    # Close the file
-    file.close()
-
-# Error
-except:
-    # Write to logger
-    if backLogger == True:
-        logger.info("DEBUG_GPS_LST: Open gpstracker.list file failed!")
-    # Print statement
-    else:
-        print "DEBUG_GPS_LST: Open gpstracker.list file failed!"    
-
-# For debugging
-#print cellPhoneList
-#print cellPhoneCnt
-#print gpsTrackerListData
-#sys.exit()
-
 # Initialize REST API Flask server 
 app = Flask(__name__)
             
@@ -173,11 +250,15 @@ if backLogger == True:
     logfile = logging.handlers.TimedRotatingFileHandler('/tmp/smsgpsgw.log', when="midnight", backupCount=3)
     formatter = logging.Formatter('%(asctime)s %(levelname)-8s %(message)s')
     logfile.setFormatter(formatter)
-    logger.addHandler(logfile)
-
-# Doing string manipulations
-def mid(s, offset, amount):
-    return s[offset-1:offset+amount-1]
+    # Log file written by the listener thread, the modem event loop only queue the record
+    logListener = LogQueueListener(logfile, logQueueSize)
+    logHandler = LogQueueHandler(logListener.logQueue)
+    # Hot path debug output limited per kind of message
+    logHandler.addFilter(RateLimitFilter(logRate, logBurst))
+    logger.addHandler(logHandler)
+    logListener.start()
+    # Write the queued record before exit
+    atexit.register(logListener.stop)
 
 # Handle Cross-Origin (CORS) problem upon client request
 @app.after_request
@@ -188,12 +269,102 @@ def add_headers(response):
 
     return response
 
+# GPS information response data together with the tracker store version
+def gpsinfo_snapshot():
+    storeVersion, trackerList = trackerStore.snapshot()
+    return storeVersion, {'GPSInfo' : trackerList, 'seq' : storeVersion}
+
+# Serialized GPS information response, rebuilt only after the tracker store changed
+gpsInfoCache = ResponseCache(lambda: trackerStore.version, gpsinfo_snapshot)
+
 # Get current GPS location status
+# Client sending back the ETag with If-None-Match get 304 when nothing changed
+# With since=<seq> only the tracker changed after that sequence number are returned,
+# use the returned seq as the next since value
 # Example command to send:
 # https://voip.scs.my:9000/ricinfo
+# https://voip.scs.my:9000/gpsinfo?since=1520
 @app.route('/gpsinfo', methods=['GET'])
 def getRicInfoDb():
-    return jsonify({'GPSInfo' : gpsTrackerListData})
+    if 'since' in request.args:
+        sinceSeq = request.args.get('since', None, type=int)
+        # Sequence number is not a number
+        if sinceSeq == None:
+            return jsonify({'error' : 'Invalid sequence number'}), 400
+
+        storeVersion, trackerList, fullList = trackerStore.changed_since(sinceSeq)
+        return jsonify({'GPSInfo' : trackerList, 'seq' : storeVersion, 'full' : fullList})
+
+    # Compressed once per tracker store version, shared by every client
+    gzipEncode = gzipResponse == True and 'gzip' in request.accept_encodings
+    if gzipEncode:
+        etag, body = gpsInfoCache.get_gzip()
+    else:
+        etag, body = gpsInfoCache.get()
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+        if gzipEncode:
+            response.headers['Content-Encoding'] = 'gzip'
+
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+# Stream live GPS location update as Server-Sent Events, one event per decoded GPS location
+# Reconnecting client resume after its Last-Event-ID, either header or query parameter, new client get the live event only
+# Example command to send:
+# curl -N https://voip.scs.my:9000/gpsinfo/stream
+@app.route('/gpsinfo/stream', methods=['GET'])
+def getGpsInfoStream():
+    lastSeq = request.headers.get('Last-Event-ID', None, type=int)
+    if lastSeq == None:
+        lastSeq = request.args.get('lastEventId', None, type=int)
+
+    response = Response(gpsEvents.stream(lastSeq), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Disable proxy buffering
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Get gateway metrics in Prometheus text exposition format
+# Example command to send:
+# https://voip.scs.my:9000/metrics
+@app.route('/metrics', methods=['GET'])
+def getMetrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# Get GPS location history of one tracker, optional time range in epoch seconds
+# Example command to send:
+# https://voip.scs.my:9000/gpsinfo/+60123456789/history?from=1552280047&to=1552366447
+@app.route('/gpsinfo/<gpsid>/history', methods=['GET'])
+def getGpsHistoryDb(gpsid):
+    fromTime = request.args.get('from', None, type=float)
+    toTime = request.args.get('to', None, type=float)
+    # Time range value is not a number
+    if ('from' in request.args and fromTime == None) or ('to' in request.args and toTime == None):
+        return jsonify({'error' : 'Invalid time range'}), 400
+
+    # History is kept under the normalised cell phone no., e.g. 60123456789 -> +60123456789
+    cellPhoneNo = normalize_number(gpsid, countryCode)
+    if cellPhoneNo == None:
+        return jsonify({'error' : 'Invalid gpsid %s' % (gpsid)}), 400
+
+    try:
+        historyList = historyStore.query(cellPhoneNo, fromTime, toTime)
+    # History database not available, e.g. failed to open at start up
+    except sqlite3.Error as e:
+        # Write to logger
+        if backLogger == True:
+            logger.info("DEBUG_HISTORY: Query GPS location history failed! %s" % (e))
+        # Print statement
+        else:
+            print "DEBUG_HISTORY: Query GPS location history failed! %s" % (e)
+        return jsonify({'error' : 'GPS location history not available'}), 503
+
+    return jsonify({'GPSHistory' : historyList})
 
 # Get current GPS location status
 # Example command to send:
@@ -202,6 +373,89 @@ def getRicInfoDb():
 def getSmsGwInfoDb():
     return jsonify({'SMSGWInfo' : pollConfigData})
 
+# Queue SMS message to one or many destinations, sent by the GSM modem in between the GPS location poll request
+# priority is high, normal (default) or low, the same text already waiting for a destination is sent once
+# Example command to send:
+# curl -i -k -H "Content-type: application/json" -X POST -d "{\"destination\":[\"+60123456789\",\"0129876543\"],\"text\":\"SPEED#80\",\"priority\":\"high\"}" https://voip.scs.my:9000/sms
+@app.route('/sms', methods=['POST'])
+def sendSms():
+    smsRequest = request.get_json(silent=True)
+    if not isinstance(smsRequest, dict) or 'destination' not in smsRequest or 'text' not in smsRequest:
+        return jsonify({'error' : 'destination and text required'}), 400
+
+    destinationList = smsRequest['destination']
+    if not isinstance(destinationList, list):
+        destinationList = [destinationList]
+    if len(destinationList) == 0:
+        return jsonify({'error' : 'destination required'}), 400
+
+    smsText = smsRequest['text']
+    if not isinstance(smsText, basestring) or smsText == '':
+        return jsonify({'error' : 'Invalid text'}), 400
+
+    priorityName = smsRequest.get('priority', 'normal')
+    if not isinstance(priorityName, basestring) or priorityName not in SMS_PRIORITY:
+        return jsonify({'error' : 'Invalid priority %s' % (priorityName)}), 400
+
+    # Single SMS message in the GSM default alphabet, text mode write the text as it is
+    try:
+        if len(encode_gsm_alphabet(smsText)) > SMS_MAX_SEPTET:
+            return jsonify({'error' : 'Text longer than %d characters' % (SMS_MAX_SEPTET)}), 400
+        if smsPduMode == False:
+            smsText = smsText.encode('ascii')
+    except (SmsPduError, UnicodeError):
+        return jsonify({'error' : 'Text not in GSM default alphabet'}), 400
+
+    # Check every destination before queuing any message
+    numberList = []
+    for destination in destinationList:
+        cellPhoneNo = None
+        if isinstance(destination, basestring):
+            cellPhoneNo = normalize_number(destination, countryCode)
+        if cellPhoneNo == None:
+            return jsonify({'error' : 'Invalid destination %s' % (destination)}), 400
+        numberList.append(str(cellPhoneNo))
+
+    smsList = []
+    queuedCnt = 0
+    for cellPhoneNo in numberList:
+        # Same modem as the tracker poll request
+        modemId = modemPool.assign(cellPhoneNo)
+        if modemId == None:
+            OUTBOUND_SMS.inc(('rejected',))
+            smsList.append({'destination' : cellPhoneNo, 'status' : 'rejected'})
+            continue
+
+        queuedSms = smsOutbox.put(modemId, cellPhoneNo, smsText, SMS_PRIORITY[priorityName])
+        # Queue full
+        if queuedSms == None:
+            OUTBOUND_SMS.inc(('rejected',))
+            smsList.append({'destination' : cellPhoneNo, 'status' : 'rejected'})
+            continue
+
+        outboundSms, coalesced = queuedSms
+        if coalesced == True:
+            OUTBOUND_SMS.inc(('coalesced',))
+            smsList.append({'id' : outboundSms.smsId, 'destination' : cellPhoneNo, 'status' : 'coalesced'})
+        else:
+            OUTBOUND_SMS.inc(('queued',))
+            smsList.append({'id' : outboundSms.smsId, 'destination' : cellPhoneNo, 'status' : 'queued'})
+        queuedCnt += 1
+        wake_modem(modemId)
+
+    # Write to logger
+    if backLogger == True:
+        logger.info("DEBUG_REST_API: Queued SMS message to %d of %d destination, priority %s" % (queuedCnt, len(numberList), priorityName))
+    # Print statement
+    else:
+        print "DEBUG_REST_API: Queued SMS message to %d of %d destination, priority %s" % (queuedCnt, len(numberList), priorityName)
+
+    # Nothing queued, every modem failed or the queue is full
+    if queuedCnt == 0:
+        return jsonify({'sms' : smsList, 'error' : 'SMS queue full or no GSM modem available'}), 503
+
+    return jsonify({'sms' : smsList}), 202
+
 # Activate GPS location poll request - Will enable send SMS process
 # Example command to send:
 # curl -i -k -H "Content-type: application/json" -X PUT -d "{\"poll\":\"ENABLE\"}" https://voip.scs.my:9000/pollgps/000
@@ -220,904 +474,793 @@ def updatePollConfig(cnfgid):
             enaGPSPoll = True
         # Disable GPS poll request
         else:
+            # Start RESET the GPS information, once for every modem thread
+            if enaGPSPoll == True:
+                reset_gpsinfo()
             enaGPSPoll = False
 
+        # Apply the new poll setting without waiting for the modem idle time
+        wake_modems()
+
     return jsonify({'pollconfig': iCnfg})
 
-# Reset GPS info python dictionary data
+# Load GPS vehicle tracker list, every GPS location are cleared
+# Cell phone no. are normalised to E.164, duplicate and invalid line are skipped
 def reset_gpsinfo():
-    global gpsTrackerListData
     global cellPhoneList
     global cellPhoneCnt
 
-    # Reinitialize back GPS information list python dictionary data
-    gpsTrackerListData=[
-        {
-            'gpsid' : '+60133517176',
-            'latitude' : 'NA',
-            'longitude' : 'NA',
-            'course' : 'NA',
-            'speed' : 'NA',
-            'status' : 'NA',
-            'datetime' : 'NA'
-        }
-    ]
-    
+    invalidList = []
+    loadStart = monotonic()
+
     try:
-        firstDat = False
-
-        # Open GPS vehicle tracker list of data
-        file = open("/sources/common/sourcecode/GSM-Gateway/gpstracker.list", "r")
-
-        # Go through the GPS vehicle tracker cell phone list
-        for i in range(100):
-            tempdata = ''
-            tempdata = file.readline()
-            tempdata = tempdata.strip('\n') # Get rid of new line character
-
-            # Initial state the cell phone array are emptied, add first data
-            if cellPhoneList == '':
-                # Data exist inside stored list
-                if tempdata != '':
-                    cellPhoneList = [tempdata]
-                    #tempdata = ''
-                    # Increment record count
-                    cellPhoneCnt += 1
-                # NO data remain inside stored list
-                else:
-                    break
+        # Stream the list straight into the tracker store, list and lookup index are
+        # built in the same pass and replaced at once, shared by every modem thread
+        trackerStore.reset(read_tracker_list(trackerListFile, countryCode, invalidList))
 
-            # Subsequent array index, append the data to the array
-            else:
-                # Data exist inside stored list
-                if tempdata != '':
-                    cellPhoneList.append(tempdata)
-                    #tempdata = ''
-                    # Increment record count
-                    cellPhoneCnt += 1
-                # NO data remain inside stored list
-                else:
-                    break
-                
-            # First data update
-            if firstDat == False:
-                extDB = [ extDBB for extDBB in gpsTrackerListData ]
-                extDB[0]['gpsid'] = tempdata
-                extDB[0]['latitude'] = 'NA'
-                extDB[0]['longitude'] = 'NA'
-                extDB[0]['course'] = 'NA'
-                extDB[0]['speed'] = 'NA'
-                extDB[0]['status'] = 'NA'
-                extDB[0]['datetime'] = 'NA'
-                
-                firstDat = True
-            # New data update
-            else:
-                # Construct the new data
-                newData = {
-                            'gpsid' : tempdata,
-                            'latitude' : 'NA',
-                            'longitude' : 'NA',
-                            'course' : 'NA',
-                            'speed' : 'NA',
-                            'status' : 'NA',
-                            'datetime' : 'NA'
-                            }
-                
-                # Append a NEW extension to the existing record
-                gpsTrackerListData.append(newData)
-
-        # Close the file
-        file.close()
+    # Error
+    except (IOError, OSError):
+        # Write to logger
+        if backLogger == True:
+            logger.info("DEBUG_GPS_LST: Open gpstracker.list file failed!")
+        # Print statement
+        else:
+            print "DEBUG_GPS_LST: Open gpstracker.list file failed!"
+        return
+
+    cellPhoneList = trackerStore.gpsid_list()
+    cellPhoneCnt = len(cellPhoneList)
+
+    # Tracker no longer in the list, stop exporting its poll latency
+    for labelValues in POLL_LAST_LATENCY.collect():
+        if not trackerStore.contains(labelValues[0]):
+            POLL_LAST_LATENCY.remove(labelValues)
+
+    # Write to logger
+    if backLogger == True:
+        logger.info("DEBUG_GPS_LST: Loaded %d GPS tracker in %.3f s, invalid entry: %d %s" % \
+                    (cellPhoneCnt, monotonic() - loadStart, len(invalidList), invalidList[:10]))
+    # Print statement
+    else:
+        print "DEBUG_GPS_LST: Loaded %d GPS tracker in %.3f s, invalid entry: %d %s" % \
+              (cellPhoneCnt, monotonic() - loadStart, len(invalidList), invalidList[:10])
+
+# Reload GPS vehicle tracker list after the file changed
+# Only the added and removed tracker are changed, GPS location of the other tracker are kept
+def reload_gpsinfo():
+    global cellPhoneList
+    global cellPhoneCnt
+
+    invalidList = []
+    loadStart = monotonic()
+
+    try:
+        addedList, removedList = trackerStore.sync(read_tracker_list(trackerListFile, countryCode, invalidList))
 
     # Error
-    except:
+    except (IOError, OSError):
         # Write to logger
         if backLogger == True:
             logger.info("DEBUG_GPS_LST: Open gpstracker.list file failed!")
         # Print statement
         else:
-            print "DEBUG_GPS_LST: Open gpstracker.list file failed!"    
+            print "DEBUG_GPS_LST: Open gpstracker.list file failed!"
+        return
 
-        
-    
-# Thread for GSM modem initialization and poll request for GPS location
-def serial_sms_comm (threadname, delay):
-    global serialPort
-    global baudRate
-    global gsmInitialize
+    cellPhoneList = trackerStore.gpsid_list()
+    cellPhoneCnt = len(cellPhoneList)
+
+    # Removed tracker, stop exporting its poll latency
+    for cellPhoneNo in removedList:
+        POLL_LAST_LATENCY.remove((cellPhoneNo,))
+
+    # New tracker are due for polling at once
+    wake_modems()
+
+    # Write to logger
+    if backLogger == True:
+        logger.info("DEBUG_GPS_LST: Reloaded %d GPS tracker in %.3f s, added: %s, removed: %s, invalid entry: %d %s" % \
+                    (cellPhoneCnt, monotonic() - loadStart, addedList[:10], removedList[:10], len(invalidList), invalidList[:10]))
+    # Print statement
+    else:
+        print "DEBUG_GPS_LST: Reloaded %d GPS tracker in %.3f s, added: %s, removed: %s, invalid entry: %d %s" % \
+              (cellPhoneCnt, monotonic() - loadStart, addedList[:10], removedList[:10], len(invalidList), invalidList[:10])
+
+# Retrieve GPS vehicle tracker cell phone from stored list
+reset_gpsinfo()
+
+# Pick up tracker list change while running
+trackerListWatcher = TrackerListWatcher(trackerListFile, reload_gpsinfo, trackerListWatch)
+
+# For debugging
+#print cellPhoneList
+#print cellPhoneCnt
+#print trackerStore.as_list()
+#sys.exit()
+
+# Collect every new SMS message indication
+# +CMTI gives the storage index to be read, +CMT carries the SMS message PDU itself
+def collect_new_sms(gsmModem, cmtiIndexList, cmtPduList):
+    for urcLine in gsmModem.read_unsolicited():
+        # Write to logger
+        if backLogger == True:
+            logger.info("DEBUG_GSM: Received NEW SMS, Reply AT command: %s" % (urcLine))
+            logger.info("####################################################################")
+        # Print statement
+        else:
+            print "DEBUG_GSM: Received NEW SMS, Reply AT command: %s" % (urcLine)
+            print "####################################################################"
+
+        if urcLine.startswith('+CMTI:'):
+            cmtiIndx = cmti_index(urcLine)
+            if cmtiIndx != None:
+                cmtiIndexList.append(cmtiIndx)
+
+        elif urcLine.startswith('+CMT:'):
+            cmtPduList.append(urcLine.split('\n')[-1])
+
+# Match received SMS message part to its tracker, process the GPS location once every part arrived
+def receive_sms_message(scheduler, smsAssembler, smsDeliver):
+    # Sender in the same format as the tracker list, e.g. national number or without '+'
+    cellPhoneNo = normalize_number(smsDeliver.sender, countryCode)
+
+    # Check the cell phone from the record, whether its exist or not
+    if cellPhoneNo == None or not trackerStore.contains(cellPhoneNo):
+        # Write to logger
+        if backLogger == True:
+            logger.info("DEBUG_GSM: Cell phone number NOT exist!: %s" % (smsDeliver.sender))
+            logger.info("####################################################################")
+        # Print statement
+        else:
+            print "DEBUG_GSM: Cell phone number NOT exist: %s" % (smsDeliver.sender)
+            print "####################################################################"
+        return
+
+    # Write to logger
+    if backLogger == True:
+        logger.info("DEBUG_GSM: Valid cell phone number: %s, message part DECODED: %s" % (cellPhoneNo, smsDeliver.text))
+        logger.info("####################################################################")
+    # Print statement
+    else:
+        print "DEBUG_GSM: Valid cell phone number: %s, message part DECODED: %s" % (cellPhoneNo, smsDeliver.text)
+        print "####################################################################"
+
+    # Text mode, GPS location is truncated into 2 SMS message without user data header
+    if smsPduMode == False:
+        decodedGPSMsg = smsAssembler.add_in_order(cellPhoneNo, TEXT_MODE_PART_CNT, smsDeliver.text)
+    # PDU mode, reassemble by UDH reference and sequence number
+    else:
+        decodedGPSMsg = smsAssembler.add(cellPhoneNo, smsDeliver.concatRef, smsDeliver.concatTotal, \
+                                         smsDeliver.concatSeq, smsDeliver.text)
+
+    # Received complete GPS location, next poll follows the tracker movement
+    if decodedGPSMsg != None:
+        GPS_REPLY.inc()
+        gpsFix = process_gps_message(cellPhoneNo, decodedGPSMsg)
+        roundTrip = scheduler.mark_replied(cellPhoneNo, gpsFix)
+        if roundTrip != None:
+            POLL_LATENCY.observe((), roundTrip)
+            POLL_LAST_LATENCY.set((cellPhoneNo,), roundTrip)
+            # Write to logger
+            if backLogger == True:
+                logger.info("DEBUG_GSM: Reply to GPS location request [%s] message reference %s, round trip %.1f s" % (cellPhoneNo, scheduler.message_reference(cellPhoneNo), roundTrip))
+                logger.info("####################################################################")
+            # Print statement
+            else:
+                print "DEBUG_GSM: Reply to GPS location request [%s] message reference %s, round trip %.1f s" % (cellPhoneNo, scheduler.message_reference(cellPhoneNo), roundTrip)
+                print "####################################################################"
+
+# Process complete GPS location message and update python data dictionary
+# Return the decoded GPS location, None for malformed message
+def process_gps_message(cellPhoneNo, decodedGPSMsg):
+    # Write to logger
+    if backLogger == True:
+        logger.info("DEBUG_GSM: Received GPS location message DECODED: %s" % (decodedGPSMsg))
+        logger.info("####################################################################")
+    # Print statement
+    else:
+        print "DEBUG_GSM: Received GPS location message DECODED: %s" % (decodedGPSMsg)
+        print "####################################################################"
+
+    # Start process the GPS location data
+    try:
+        gpsFix = parse_gps_reply(decodedGPSMsg)
+    # Malformed GPS location message, keep the previous GPS location
+    except GpsParseError:
+        DECODE_FAILURE.inc(('gps_format',))
+        # Write to logger
+        if backLogger == True:
+            logger.info("DEBUG_GSM: Malformed GPS location message from %s!" % (cellPhoneNo))
+            logger.info("####################################################################")
+        # Print statement
+        else:
+            print "DEBUG_GSM: Malformed GPS location message from %s!" % (cellPhoneNo)
+            print "####################################################################"
+        return None
+
+    # GPS location field as the tracker text
+    gpsFields = gpsFix.as_json()
+    latValue = gpsFields['latitude']
+    lonValue = gpsFields['longitude']
+    courseValue = gpsFields['course']
+    speedValue = gpsFields['speed']
+    timeStmpValue = gpsFields['datetime']
+    gpsStatus = gpsFields['status']
+
+    # Write to logger
+    if backLogger == True:
+        logger.info("DEBUG_GSM: GPS Status: %s, Latitude: %s, Longitude: %s, Course: %s, Speed: %s, Time Stamp: %s" % \
+                    (gpsStatus, latValue, lonValue, courseValue, speedValue, timeStmpValue))
+        logger.info("####################################################################")
+    # Print statement
+    else:
+        print "DEBUG_GSM: GPS Status: %s, Latitude: %s, Longitude: %s, Course: %s, Speed: %s, Time Stamp: %s" % \
+              (gpsStatus, latValue, lonValue, courseValue, speedValue, timeStmpValue)
+        print "####################################################################"
+
+    # Update the tracker record with the typed GPS location, found through the gpsid lookup index
+    trackerRecord = trackerStore.update(cellPhoneNo, gpsFix)
+
+    # Push to every live GPS location stream client
+    gpsEvents.publish(trackerRecord)
+
+    # Append to the GPS location history, committed by the history writer thread
+    historyStore.append(cellPhoneNo, gpsFix)
+
+    # Display the current python data dictionary
+    # Write to logger
+    if backLogger == True:
+        logger.info("DEBUG_GSM: GPS JSON Data:")
+        logger.info("####################################################################")
+        # Only the updated tracker, the whole tracker list on every reply is too much for the hot path
+        logger.info("DEBUG_GSM: %s" % (trackerRecord))
+        logger.info("####################################################################")
+    # Print statement
+    else:
+        print "DEBUG_GSM: Time Stamp: %s" % (timeStmpValue)
+        print "####################################################################"
+
+    return gpsFix
+
+# GSM modem failed, move its trackers to the other modems in the pool
+def modem_failed(modemId):
+    if modemPool.mark_failed(modemId):
+        # Queued SMS message follow the trackers to the other modems
+        for toModemId in smsOutbox.reroute(modemId, modemPool.assign):
+            modemWakeList[toModemId].set()
+
+        # Write to logger
+        if backLogger == True:
+            logger.info("DEBUG_GSM: GSM modem %s out of the pool, trackers rebalanced" % (modemPool.modem_setting(modemId)['port']))
+            logger.info("####################################################################")
+        # Print statement
+        else:
+            print "DEBUG_GSM: GSM modem %s out of the pool, trackers rebalanced" % (modemPool.modem_setting(modemId)['port'])
+            print "####################################################################"
+
+# GSM modem recovered, take back its trackers from the other modems in the pool
+def modem_alive(modemId):
+    if modemPool.mark_alive(modemId):
+        # Write to logger
+        if backLogger == True:
+            logger.info("DEBUG_GSM: GSM modem %s back into the pool, trackers rebalanced" % (modemPool.modem_setting(modemId)['port']))
+            logger.info("####################################################################")
+        # Print statement
+        else:
+            print "DEBUG_GSM: GSM modem %s back into the pool, trackers rebalanced" % (modemPool.modem_setting(modemId)['port'])
+            print "####################################################################"
+
+# Coroutine sending one queued SMS message, give back True once the network accepted it
+# A failed message is queued again until it used up its send attempts
+def send_outbound_sms(gsmModem, modemId, outboundSms):
+    if smsPduMode == True:
+        pduMsg, pduLength = encode_submit_pdu(outboundSms.destination, outboundSms.smsText)
+        sendCmdMsg = b'AT+CMGS=%d' % (pduLength)
+        smsBody = pduMsg
+    else:
+        sendCmdMsg = b'AT+CMGS=' + '"' + outboundSms.destination + '"'
+        smsBody = outboundSms.smsText
+    # Send the contents once the '>' SMS editor prompt arrived, wait for the network to accept it
+    try:
+        msgRef, gsmReply = yield gsmModem.submit_sms(sendCmdMsg, smsBody, smsSendTimeOut)
+    # Serial communication lost in the middle of the send, the message goes first once a modem is back
+    except (serial.SerialException, OSError):
+        smsOutbox.put_back(modemId, outboundSms)
+        raise
+
+    # SMS message send failed, queue it again for the next cycle
+    if msgRef == None:
+        if smsOutbox.send_failed(modemId, outboundSms):
+            OUTBOUND_SMS.inc(('retry',))
+        else:
+            OUTBOUND_SMS.inc(('failed',))
+
+        # Write to logger
+        if backLogger == True:
+            logger.info("DEBUG_GSM: Send SMS message %d [%s] failed, attempt %d, Reply AT command: %s" % (outboundSms.smsId, outboundSms.destination, outboundSms.attemptCnt, gsmReply))
+            logger.info("####################################################################")
+        # Print statement
+        else:
+            print "DEBUG_GSM: Send SMS message %d [%s] failed, attempt %d, Reply AT command: %s" % (outboundSms.smsId, outboundSms.destination, outboundSms.attemptCnt, gsmReply)
+            print "####################################################################"
+        raise Return(False)
+
+    OUTBOUND_SMS.inc(('sent',))
+
+    # Write to logger
+    if backLogger == True:
+        logger.info("DEBUG_GSM: Send SMS message %d [%s] successful, message reference %d" % (outboundSms.smsId, outboundSms.destination, msgRef))
+        logger.info("####################################################################")
+    # Print statement
+    else:
+        print "DEBUG_GSM: Send SMS message %d [%s] successful, message reference %d" % (outboundSms.smsId, outboundSms.destination, msgRef)
+        print "####################################################################"
+    raise Return(True)
+
+# Coroutine for GSM modem initialization and poll request for GPS location
+# Each modem in the pool runs its own coroutine on the modem event loop, polling its share of the trackers
+# Wait for a new SMS message, the next poll due or reply deadline, at most delay seconds
+def serial_sms_comm (taskname, delay, modemId):
     global backLogger
-    global atCheck
-    global atDeleteMsg
-    global atSetTxtMsg
-    global cellPhoneNo
-    global waitSendMsg
     global cellPhoneList
-    global cellPhoneCnt
-    global cellNoIndx
-    global atCnmi
     global pollTimeOut
     global enGPSPoll
-    global atCpms
     global enaGPSPoll
-    global gpsTrackerListData
 
     gsmReply = ''
     sendCmdMsg = ''
 
-    hexMsgPrtOne = ''
-    hexMsgPrtTwo = ''
-    decodedGPSMsg = ''
+    gsmInitialize = False     # GSM modem initialization flag
+    atCheck = False           # AT command reply check flag
+    atDeleteMsg = False       # Delete SMS command reply check flag
+    atSetTxtMsg = False       # Set text message SMS command reply check flag
     cellPhoneNo = ''
-    timeOutCnt = 0
-    cmtiCnt = 0
-    gpsComplete = False
-    cmtiFound = False
-    validCellNo = False
-    msgPartOneCorr = False
-    msgPartTwoCorr = False
+    cmtiIndexList = []        # Storage index of received SMS message waiting to be read
+    cmtPduList = []           # SMS message PDU delivered directly, waiting to be processed
+    consumedIndexList = []    # Storage index of SMS message already read, waiting to be deleted
+    deleteAttempt = {}        # Failed delete attempt per storage index
+    smsAssembler = ConcatReassembler() # Received GPS location message part per cell phone no.
     pollDisDelSms = False
-    gpsLocTimeOut = pollTimeOut
 
-    # Initialize serial communication port for GSM modem
-    #serialGSM = serial.Serial(serialPort, baudrate = baudRate, timeout = 5)
-    serialGSM = serial.Serial(serialPort, baudrate = baudRate)
-    serialGSM.flushInput()
-    serialGSM.flushOutput()
-    
+    # Send poll request to many trackers, match the reply by sender number
+    scheduler = PollScheduler(maxOutstandingPoll, pollTimeOut, minPollInterval, maxPollInterval)
+    pollTrackerList = None    # Tracker list the scheduler was last given
+    pollRingVersion = 0       # Modem pool ring the tracker share was taken from
+
+    # Queued SMS message take turn with the poll request, within the modem send rate
+    sendRate = SendRateLimit(smsSendRate, smsSendBurst)
+    outboundTurn = False      # Queued SMS message of the poll priority goes next
+
+    # Set on new SMS message, serial failure or poll setting change
+    modemWake = modemWakeList[modemId]
+    gsmModem = None
+
+    # Serial communication setting for this modem
+    modemSetting = modemPool.modem_setting(modemId)
+    serialGSM = None
+
+    # Modem health, run the init sequence again once the modem stop answering
+    watchdog = ModemWatchdog(modemSetting['port'], modemFailLimit, modemIdleProbe, reinitBackoffMin, reinitBackoffMax)
+
     # Serial communication loop
     while True:
-        # Start initialize GSM modem
-        if gsmInitialize == False:
-            # Send AT command to GSM modem
-            #if atCheck == False:
-            serialGSM.write(b'AT\r')
-            # Delay for send command before process the reply 
-            time.sleep(1)
-            # Start check the reply from GSM modem
-            gsmReply = serialGSM.read(serialGSM.inWaiting())
-            # Previous command send OK 
-            if 'OK' in gsmReply:
+        modemWake.clear()
+
+        # Initialize serial communication port for GSM modem
+        # Port may also be an URL, e.g. gsm://?latency=5 for the GSM modem emulator
+        if serialGSM == None:
+            try:
+                serialGSM = serial.serial_for_url(modemSetting['port'], baudrate = modemSetting['baudrate'], timeout = SERIAL_READ_TIMEOUT)
+                serialGSM.flushInput()
+                serialGSM.flushOutput()
+
+                # AT command executor, the reply are read by the modem event loop
+                gsmModem = AsyncGsmModem(modemLoop, serialGSM, portName = modemSetting['port'], onUnsolicited = modemWake.set, watchdog = watchdog)
+                watchdog.port_opened()
+                gsmInitialize = False
+
+            # Serial port not available, retry on the next cycle
+            except (serial.SerialException, OSError):
                 # Write to logger
                 if backLogger == True:
-                    logger.info("####################################################################")
-                    logger.info("DEBUG_GSM: Wake UP GSM modem successful, Reply Data: %s" % (gsmReply))
+                    logger.info("DEBUG_GSM: Open serial port %s failed!" % (modemSetting['port']))
                     logger.info("####################################################################")
                 # Print statement
                 else:
-                    print "####################################################################"
-                    print "DEBUG_GSM: Wake UP GSM modem successful, Reply Data: %s" % (gsmReply)
+                    print "DEBUG_GSM: Open serial port %s failed!" % (modemSetting['port'])
                     print "####################################################################"
 
-                atCheck = True
-
-            # Previously there is a stuck '>' character during sending SMS message
-            # Complete the sends message by sending to default cell no.
-            elif '>' in gsmReply:
-                sendCmdMsg = 'ERROR'
-                serialGSM.write(sendCmdMsg + chr(26))
-                # Delay for send command before process the reply 
-                time.sleep(1)
-                
-                # Start check the reply from GSM modem
-                gsmReply = serialGSM.read(serialGSM.inWaiting())
+                serialGSM = None
+                modem_failed(modemId)
+                MODEM_UP.set((modemSetting['port'],), 0)
+                # Retry soon after a short outage, back off while the port stays missing
+                yield modemLoop.sleep(watchdog.init_failed())
+                continue
+
+        try:
+            # Start initialize GSM modem
+            if gsmInitialize == False:
+                # Leave the SMS editor in case the modem got stuck at the '>' prompt
+                gsmModem.write(ESCAPE)
+
+                # Send AT command to GSM modem
+                #if atCheck == False:
+                # Send command and wait for the final result code
+                gsmReply = yield gsmModem.send_command(b'AT')
                 # Previous command send OK 
                 if 'OK' in gsmReply:
-                    serialGSM.write(b'AT\r')
-                    # Delay for send command before process the reply 
-                    time.sleep(1)
-                    # Start check the reply from GSM modem
-                    gsmReply = serialGSM.read(serialGSM.inWaiting())
+                    # Write to logger
+                    if backLogger == True:
+                        logger.info("####################################################################")
+                        logger.info("DEBUG_GSM: Wake UP GSM modem successful, Reply Data: %s" % (gsmReply))
+                        logger.info("####################################################################")
+                    # Print statement
+                    else:
+                        print "####################################################################"
+                        print "DEBUG_GSM: Wake UP GSM modem successful, Reply Data: %s" % (gsmReply)
+                        print "####################################################################"
+
+                    atCheck = True
+
+                # Previously there is a stuck '>' character during sending SMS message
+                # Complete the sends message by sending to default cell no.
+                elif '>' in gsmReply:
+                    sendCmdMsg = 'ERROR'
+                    gsmModem.write(sendCmdMsg + chr(26))
+                    # Wait for the final result code of the pending message
+                    gsmReply = yield gsmModem.wait_reply()
                     # Previous command send OK 
                     if 'OK' in gsmReply:
+                        # Send command and wait for the final result code
+                        gsmReply = yield gsmModem.send_command(b'AT')
+                        # Previous command send OK 
+                        if 'OK' in gsmReply:
+                            # Write to logger
+                            if backLogger == True:
+                                logger.info("DEBUG_GSM: Wake UP GSM modem successful, Reply Data: %s" % (gsmReply))
+                                logger.info("####################################################################")
+                            # Print statement
+                            else:
+                                print "DEBUG_GSM: Wake UP GSM modem successful, Reply Data: %s" % (gsmReply)
+                                print "####################################################################"
+
+                # GSM modem NOT responding, retry on the next cycle
+                else:
+                    # Write to logger
+                    if backLogger == True:
+                        logger.info("DEBUG_GSM: GSM modem %s NOT responding!" % (modemSetting['port']))
+                        logger.info("####################################################################")
+                    # Print statement
+                    else:
+                        print "DEBUG_GSM: GSM modem %s NOT responding!" % (modemSetting['port'])
+                        print "####################################################################"
+
+                    modem_failed(modemId)
+                    MODEM_UP.set((modemSetting['port'],), 0)
+                    retryDelay = watchdog.init_failed()
+
+                    # Still no answer after several attempts or the USB modem re-enumerated, open the port again
+                    if watchdog.reopen_due() or watchdog.device_changed():
                         # Write to logger
                         if backLogger == True:
-                            logger.info("DEBUG_GSM: Wake UP GSM modem successful, Reply Data: %s" % (gsmReply))
+                            logger.info("DEBUG_GSM: Reopen serial port %s" % (modemSetting['port']))
                             logger.info("####################################################################")
                         # Print statement
                         else:
-                            print "DEBUG_GSM: Wake UP GSM modem successful, Reply Data: %s" % (gsmReply)
+                            print "DEBUG_GSM: Reopen serial port %s" % (modemSetting['port'])
                             print "####################################################################"
-            
-            # Setting for receiving SMS message behaviour, will receive +CMTI message indicator
-            # AT+CNMI=2,2,0,0,0 - will received +CMT without need to read SMS message index
-            serialGSM.write(b'AT+CNMI=1,1,0,0,0\r')
-            # Delay for send command before process the reply 
-            time.sleep(1)
-            # Start check the reply from GSM modem
-            gsmReply = serialGSM.read(serialGSM.inWaiting())
-            # Previous command send OK 
-            if 'OK' in gsmReply:
-                # Write to logger
-                if backLogger == True:
-                    logger.info("DEBUG_GSM: SMS receiving setting for GSM modem successful, Reply Data: %s" % (gsmReply))
-                    logger.info("####################################################################")
-                # Print statement
-                else:
-                    print "DEBUG_GSM: SMS receiving setting for GSM modem successful, Reply Data: %s" % (gsmReply)
-                    print "####################################################################"
 
-            serialGSM.write(b'AT+CPMS="SM","SM","SM"\r')
-            # Delay for send command before process the reply 
-            time.sleep(1)
-            # Start check the reply from GSM modem
-            gsmReply = serialGSM.read(serialGSM.inWaiting())
-            # Previous command send OK 
-            if 'OK' in gsmReply:
-                # Write to logger
-                if backLogger == True:
-                    logger.info("DEBUG_GSM: SMS memory setting for GSM modem successful, Reply Data: %s" % (gsmReply))
-                    logger.info("####################################################################")
-                # Print statement
-                else:
-                    print "DEBUG_GSM: SMS memory setting for GSM modem successful, Reply Data: %s" % (gsmReply)
-                    print "####################################################################"
+                        try:
+                            gsmModem.close()
+                            serialGSM.close()
+                        except:
+                            pass
+                        serialGSM = None
 
-            serialGSM.write(b'AT+CSAS\r')
-            # Delay for send command before process the reply 
-            time.sleep(1)
-            # Start check the reply from GSM modem
-            gsmReply = serialGSM.read(serialGSM.inWaiting())
-            # Previous command send OK 
-            if 'OK' in gsmReply:
-                # Write to logger
-                if backLogger == True:
-                    logger.info("DEBUG_GSM: Stored setting for GSM modem successful, Reply Data: %s" % (gsmReply))
-                    logger.info("####################################################################")
-                # Print statement
-                else:
-                    print "DEBUG_GSM: Stored setting for GSM modem successful, Reply Data: %s" % (gsmReply)
-                    print "####################################################################"
-                           
-            # Send delete SMS message command at index 1 to 4
-            serialGSM.write(b'AT+CMGDA="DEL ALL"\r')
-            # Delay for send command before process the reply 
-            time.sleep(1)
-            # Start check the reply from GSM modem
-            gsmReply = serialGSM.read(serialGSM.inWaiting())
-            # Previous command send OK 
-            if 'OK' in gsmReply or '>' in gsmReply:
-                # Write to logger
-                if backLogger == True:
-                    logger.info("DEBUG_GSM: Delete ALL SMS message successful, Reply Data: %s" % (gsmReply))
-                    logger.info("####################################################################")
-                # Print statement
-                else:
-                    print "DEBUG_GSM: Delete ALL SMS message successful, Reply Data: %s" % (gsmReply)
-                    print "####################################################################"
+                    # Back off while the modem keep failing
+                    yield modemLoop.sleep(retryDelay)
+                    continue
             
-            serialGSM.write(b'AT+CPMS="SM","SM","SM"\r')
-            # Delay for send command before process the reply 
-            time.sleep(1)
-            # Start check the reply from GSM modem
-            gsmReply = serialGSM.read(serialGSM.inWaiting())
-            # Previous command send OK 
-            if 'OK' in gsmReply:
-                # Write to logger
-                if backLogger == True:
-                    logger.info("DEBUG_GSM: Recheck SMS memory setting for GSM modem successful, Reply Data: %s" % (gsmReply))
-                    logger.info("####################################################################")
-                # Print statement
+                # Setting for receiving SMS message behaviour, will receive +CMTI message indicator
+                # AT+CNMI=2,2,0,0,0 - will received +CMT without need to read SMS message index
+                # Send command and wait for the final result code
+                if smsPduMode == True:
+                    gsmReply = yield gsmModem.send_command(b'AT+CNMI=2,2,0,0,0')
                 else:
-                    print "DEBUG_GSM: Recheck SMS memory setting for GSM modem successful, Reply Data: %s" % (gsmReply)
-                    print "####################################################################"
-                    
-            # Send set SMS text message command
-            elif atDeleteMsg == True and  atSetTxtMsg == False:
-                serialGSM.write(b'AT+CMGF=1\r')
-                # Delay for send command before process the reply 
-                time.sleep(1)
-                # Start check the reply from GSM modem
-                gsmReply = serialGSM.read(serialGSM.inWaiting())
+                    gsmReply = yield gsmModem.send_command(b'AT+CNMI=1,1,0,0,0')
                 # Previous command send OK 
-                if 'OK' in gsmReply or '>' in gsmReply:
+                if 'OK' in gsmReply:
                     # Write to logger
                     if backLogger == True:
-                        logger.info("DEBUG_GSM: Set GSM modem to text mode successful, Reply Data: %s" % (gsmReply))
+                        logger.info("DEBUG_GSM: SMS receiving setting for GSM modem successful, Reply Data: %s" % (gsmReply))
                         logger.info("####################################################################")
                     # Print statement
                     else:
-                        print "DEBUG_GSM: Set GSM modem to text mode successful, Reply Data: %s" % (gsmReply)
+                        print "DEBUG_GSM: SMS receiving setting for GSM modem successful, Reply Data: %s" % (gsmReply)
                         print "####################################################################"
-                    atSetTxtMsg = True
 
-            # Write to logger
-            if backLogger == True:
-                logger.info("DEBUG_GSM: GSM modem initialization completed")
-                logger.info("####################################################################")
-            # Print statement
-            else:
-                print "DEBUG_GSM: GSM modem initialization completed"
-                print "####################################################################"
-                    
-            gsmInitialize = True
-        
-        # Previously GSM modem initialization completed
-        else:
-            # Listen for received SMS message
-            # Start check the reply from GSM modem
-            gsmReply = serialGSM.read(serialGSM.inWaiting())
-            # Received data from GSM modem
-            if gsmReply != '' or cmtiFound == True:
-                cmtiFound = False
-                if '+CMTI' in gsmReply and gpsComplete == False:
+                # Send command and wait for the final result code
+                gsmReply = yield gsmModem.send_command(b'AT+CPMS="SM","SM","SM"')
+                # Previous command send OK 
+                if 'OK' in gsmReply:
                     # Write to logger
                     if backLogger == True:
-                        logger.info("DEBUG_GSM: Received NEW SMS, Reply AT command: %s" % (gsmReply))
+                        logger.info("DEBUG_GSM: SMS memory setting for GSM modem successful, Reply Data: %s" % (gsmReply))
                         logger.info("####################################################################")
                     # Print statement
                     else:
-                        print "DEBUG_GSM: Received NEW SMS, Reply AT command: %s" % (gsmReply)
+                        print "DEBUG_GSM: SMS memory setting for GSM modem successful, Reply Data: %s" % (gsmReply)
                         print "####################################################################"
 
-                    # Counting for the new incoming SMS message 
-                    result = gsmReply.split()
-                    cmtiCount = result.count("+CMTI:")
-
-                    # Execute the logic to verify the counting
-                    # Consider 2 concurrent SMS message that will indicate truncated GPS location message
-                    if cmtiCount == 2 or cmtiCount > 2:
-                        cmtiCnt = 2
-                    elif cmtiCount == 1:
-                        cmtiCnt += 1
-
-                # Received complete GPS location
-                if cmtiCnt == 2:
-                    cmtiCnt = 0
-                    gpsComplete = True
+                # Send command and wait for the final result code
+                gsmReply = yield gsmModem.send_command(b'AT+CSAS')
+                # Previous command send OK 
+                if 'OK' in gsmReply:
+                    # Write to logger
+                    if backLogger == True:
+                        logger.info("DEBUG_GSM: Stored setting for GSM modem successful, Reply Data: %s" % (gsmReply))
+                        logger.info("####################################################################")
+                    # Print statement
+                    else:
+                        print "DEBUG_GSM: Stored setting for GSM modem successful, Reply Data: %s" % (gsmReply)
+                        print "####################################################################"
+                           
+                # Send delete SMS message command at index 1 to 4
+                # Send command and wait for the final result code
+                gsmReply = yield gsmModem.send_command(b'AT+CMGDA="DEL ALL"')
+                # Previous command send OK 
+                if 'OK' in gsmReply or '>' in gsmReply:
+                    # Write to logger
+                    if backLogger == True:
+                        logger.info("DEBUG_GSM: Delete ALL SMS message successful, Reply Data: %s" % (gsmReply))
+                        logger.info("####################################################################")
+                    # Print statement
+                    else:
+                        print "DEBUG_GSM: Delete ALL SMS message successful, Reply Data: %s" % (gsmReply)
+                        print "####################################################################"
+            
+                # Send command and wait for the final result code
+                gsmReply = yield gsmModem.send_command(b'AT+CPMS="SM","SM","SM"')
+                # Previous command send OK 
+                if 'OK' in gsmReply:
+                    # Write to logger
+                    if backLogger == True:
+                        logger.info("DEBUG_GSM: Recheck SMS memory setting for GSM modem successful, Reply Data: %s" % (gsmReply))
+                        logger.info("####################################################################")
+                    # Print statement
+                    else:
+                        print "DEBUG_GSM: Recheck SMS memory setting for GSM modem successful, Reply Data: %s" % (gsmReply)
+                        print "####################################################################"
                     
-                    # Read SMS message at memory location 1 - Hex message part 01
-                    serialGSM.write(b'AT+CMGR=1\r')
-                    # Delay for send command before process the reply 
-                    time.sleep(1)
-                    # Start check the reply from GSM modem
-                    gsmReply = serialGSM.read(serialGSM.inWaiting())
+                # Send set SMS text message command
+                elif atDeleteMsg == True and  atSetTxtMsg == False:
+                    # Send command and wait for the final result code
+                    gsmReply = yield gsmModem.send_command(b'AT+CMGF=1')
                     # Previous command send OK 
-                    if 'OK' in gsmReply and 'REC UNREAD' in gsmReply:
+                    if 'OK' in gsmReply or '>' in gsmReply:
                         # Write to logger
                         if backLogger == True:
-                            logger.info("DEBUG_GSM: Received GPS location message part 01, Reply AT command: %s" % (gsmReply))
+                            logger.info("DEBUG_GSM: Set GSM modem to text mode successful, Reply Data: %s" % (gsmReply))
                             logger.info("####################################################################")
                         # Print statement
                         else:
-                            print "DEBUG_GSM: Received GPS location message part 01, Reply AT command: %s" % (gsmReply)
+                            print "DEBUG_GSM: Set GSM modem to text mode successful, Reply Data: %s" % (gsmReply)
                             print "####################################################################"
+                        atSetTxtMsg = True
 
-                        # Start extract current GPS data
-                        newLine = False
-                        cellPhone = False
-                        getHexMsg = False
-                        plusCnt = 0
-                        uCounter = 0
-                        hexVal = ''
-                        
-                        gsmReplyLen = len(gsmReply)
-                        # Get the sender identification and hex message part 01
-                        for a in range(0, (gsmReplyLen + 1)):
-                            oneChar = mid(gsmReply, a, 1)
-                            # Search for indicator to start extract the cell phone no
-                            if oneChar == '+' and cellPhone == False:
-                                plusCnt += 1
-                                if plusCnt == 3:
-                                    plusCnt = 0
-                                    cellPhone = True
-                                    
-                            # Start retrieve cell phone number
-                            elif cellPhone == True and newLine == False:
-                                # End of the search, find new line 
-                                if oneChar == '"':
-                                    cellPhoneNo = '+' + cellPhoneNo
-
-                                    # Check the cell phone from the record, whether its exist or not
-                                     # Update python data dictionary with GPS location
-                                    try:
-                                        # Check the cell number whether its already exist or not
-                                        # Update the existing data, throw error if record is not exist
-                                        extDB = [ extDBB for extDBB in gpsTrackerListData if (extDBB['gpsid'] == cellPhoneNo) ]
-                                                                                
-                                        # Write to logger
-                                        if backLogger == True:
-                                            logger.info("DEBUG_GSM: Valid cell phone number: %s" % (cellPhoneNo))
-                                            logger.info("####################################################################")
-                                        # Print statement
-                                        else:
-                                            print "DEBUG_GSM: Valid cell phone number: %s" % (cellPhoneNo)
-                                            print "####################################################################"
-
-                                        validCellNo = True
-                                        newLine = True
-                                    
-                                    # Cell number NOT exists!, exit loop
-                                    except:
-                                        # Write to logger
-                                        if backLogger == True:
-                                            logger.info("DEBUG_GSM: Cell phone number NOT exist!: %s" % (cellPhoneNo))
-                                            logger.info("####################################################################")
-                                        # Print statement
-                                        else:
-                                            print "DEBUG_GSM: Cell phone number NOT exist: %s" % (cellPhoneNo)
-                                            print "####################################################################"
-
-                                        validCellNo = False
-                                        break
-
-                                # Append and construct cell phone no.                                    
-                                else:
-                                    cellPhoneNo += oneChar
-
-                            # Start check for the new line char, indicate SMS contents with GPS location
-                            elif newLine == True and getHexMsg == False: 
-                                if oneChar == '\n':
-                                    getHexMsg = True
-
-                            # Get the contents of hex message
-                            elif getHexMsg == True:
-                                if oneChar == '\n':
-                                    # Try to decode, only process the ASCII hex data
-                                    try:
-                                        # Remove any unwanted character before decode
-                                        hexMsgPrtOne = hexMsgPrtOne.strip().decode("hex")
-                                        msgPartOneCorr = True
-                                    # None ASCII hex data, exit loop
-                                    except:
-                                        msgPartOneCorr = False
-                                        break
-                                        
-                                    # Write to logger
-                                    if backLogger == True:
-                                        logger.info("DEBUG_GSM: Received GPS location message part 01 DECODED: %s" % (hexMsgPrtOne))
-                                        logger.info("####################################################################")
-                                    # Print statement
-                                    else:
-                                        print "DEBUG_GSM: Received GPS location message part 01 DECODED: %s" % (hexMsgPrtOne)
-                                        print "####################################################################"
-                                    break
-                                else:
-                                    uCounter += 1
-                                    if uCounter == 2:
-                                        hexVal += oneChar
-                                        if hexVal != '00':
-                                            hexMsgPrtOne += hexVal
-                                        hexVal = ''
-                                        uCounter = 0
-                                    else:
-                                        hexVal += oneChar    
-
-                        # Previously the cell phone no. are valid and message format correct
-                        if validCellNo == True and msgPartOneCorr == True:
-                            # Read SMS message at memory location 1 - Hex message part 01
-                            serialGSM.write(b'AT+CMGR=2\r')
-                            # Delay for send command before process the reply 
-                            time.sleep(1)
-                            # Start check the reply from GSM modem
-                            gsmReply = serialGSM.read(serialGSM.inWaiting())
-                            # Previous command send OK 
-                            if 'OK' in gsmReply and 'REC UNREAD' in gsmReply:
-                                # Write to logger
-                                if backLogger == True:
-                                    logger.info("DEBUG_GSM_RX: Received GPS location message part 02, Reply AT command: %s" % (gsmReply))
-                                    logger.info("####################################################################")
-                                # Print statement
-                                else:
-                                    print "DEBUG_GSM_RX: Received GPS location message part 02, Reply AT command: %s" % (gsmReply)
-                                    print "####################################################################"
-
-                                # Start extract current GPS data
-                                getHexMsg = False
-                                newLineCnt = 0
-                                uCounter = 0
-                                hexVal = ''
-                                gsmReplyLen = len(gsmReply)
-
-                                # Get hex message part 02
-                                for a in range(0, (gsmReplyLen + 1)):
-                                    oneChar = mid(gsmReply, a, 1)
-                                    if oneChar == '\n' and getHexMsg == False:
-                                        newLineCnt += 1
-                                        if newLineCnt == 2:
-                                            getHexMsg = True
-
-                                    elif getHexMsg == True:
-                                        if oneChar == '\n':
-                                            # Try to decode, only process the ASCII hex data
-                                            try:
-                                                # Remove any unwanted character before decode
-                                                hexMsgPrtTwo = hexMsgPrtTwo.strip().decode("hex")
-                                                msgPartTwoCorr = True
-                                            # None ASCII hex data, exit loop
-                                            except:
-                                                msgPartTwoCorr = False
-                                                break
-                                            
-                                            # Write to logger
-                                            if backLogger == True:
-                                                logger.info("DEBUG_GSM: Received GPS location message part 02 DECODED: %s" % (hexMsgPrtTwo))
-                                                logger.info("####################################################################")
-                                            # Print statement
-                                            else:
-                                                print "DEBUG_GSM: Received GPS location message part 02 DECODED: %s" % (hexMsgPrtTwo)
-                                                print "####################################################################"
-                                            break
-                                        else:
-                                            uCounter += 1
-                                            if uCounter == 2:
-                                                hexVal += oneChar
-                                                if hexVal != '00':
-                                                    hexMsgPrtTwo += hexVal
-                                                hexVal = ''
-                                                uCounter = 0
-                                            else:
-                                                hexVal += oneChar 
-
-                    # Previously the cell phone no. and decode message are valid
-                    if validCellNo == True and msgPartOneCorr == True and msgPartTwoCorr == True:            
-                        # Append 2 part into 1 decoded GPS location
-                        decodedGPSMsg = hexMsgPrtOne + hexMsgPrtTwo
-                                                
+                # Send set SMS PDU mode command, the tracker reply are decoded from PDU
+                if smsPduMode == True:
+                    # Send command and wait for the final result code
+                    gsmReply = yield gsmModem.send_command(b'AT+CMGF=0')
+                    # Previous command send OK 
+                    if 'OK' in gsmReply:
                         # Write to logger
                         if backLogger == True:
-                            logger.info("DEBUG_GSM: Received GPS location message DECODED: %s" % (decodedGPSMsg))
+                            logger.info("DEBUG_GSM: Set GSM modem to PDU mode successful, Reply Data: %s" % (gsmReply))
                             logger.info("####################################################################")
                         # Print statement
                         else:
-                            print "DEBUG_GSM: Received GPS location message DECODED: %s" % (decodedGPSMsg)
+                            print "DEBUG_GSM: Set GSM modem to PDU mode successful, Reply Data: %s" % (gsmReply)
                             print "####################################################################"
 
-                        # Start process the GPS location data
-                        fndLatitude = False
-                        fndLongitude = False
-                        fndCourse = False
-                        fndSpeed = False
-                        timeStamp = False
-                        gpsStat = False
-                        latValue = ''
-                        lonValue = ''
-                        courseValue = ''
-                        speedValue = ''
-                        timeStmpValue = ''
-                        gpsStatus = ''
-                        decodedLength = len(decodedGPSMsg)
-                        #
-                        for a in range(0, (decodedLength + 1)):
-                            oneChar = mid(decodedGPSMsg, a, 1)
-                            # Find GPS status: Last Position or Current Position
-                            if oneChar == '!' and gpsStat == False:
-                                # Write to logger
-                                if backLogger == True:
-                                    logger.info("DEBUG_GSM: GPS Status: %s" % (gpsStatus))
-                                    logger.info("####################################################################")
-                                # Print statement
-                                else:
-                                    print "DEBUG_GSM: GPS Status: %s" % (gpsStatus)
-                                    print "####################################################################"
-                                gpsStat = True
-
-                            elif oneChar != '!' and gpsStat == False:
-                                gpsStatus += oneChar
-                            
-                            # Find a start char to get latitude value
-                            if oneChar == ':' and fndLatitude == False:
-                                fndLatitude = True
-                            
-                            # Start retrieve latitude value
-                            elif fndLatitude == True and fndLongitude == False:
-                                # End of the search, find longitude value
-                                if oneChar == ':':
-                                    # Write to logger
-                                    if backLogger == True:
-                                        logger.info("DEBUG_GSM: Latitude: %s" % (latValue))
-                                        logger.info("####################################################################")
-                                    # Print statement
-                                    else:
-                                        print "DEBUG_GSM: Latitude: %s" % (latValue)
-                                        print "####################################################################"
-                                    fndLongitude = True
-                                else:
-                                    # Only take number
-                                    if oneChar != ',' and oneChar != 'L' and oneChar != 'o' and oneChar != 'n':
-                                        latValue += oneChar
-
-                            # Start retrieve longitude value
-                            elif fndLongitude == True and fndCourse == False:
-                                # End of the search, find course value
-                                if oneChar == ':':
-                                    # Write to logger
-                                    if backLogger == True:
-                                        logger.info("DEBUG_GSM: Longitude: %s" % (lonValue))
-                                        logger.info("####################################################################")
-                                    # Print statement
-                                    else:
-                                        print "DEBUG_GSM: Longitude: %s" % (lonValue)
-                                        print "####################################################################"
-                                    fndCourse = True
-                                else:
-                                    # Only take number
-                                    if oneChar != 'C' and oneChar != 'o' and oneChar != 'u' and oneChar != 'r' and \
-                                       oneChar != 's' and oneChar != 'e' and oneChar != ',':
-                                        lonValue += oneChar
-
-                            # Start retrieve course value
-                            elif fndCourse == True and fndSpeed == False:
-                                # End of the search, find course value
-                                if oneChar == ':':
-                                    # Write to logger
-                                    if backLogger == True:
-                                        logger.info("DEBUG_GSM: Course: %s" % (courseValue))
-                                        logger.info("####################################################################")
-                                    # Print statement
-                                    else:
-                                        print "DEBUG_GSM: Course: %s" % (courseValue)
-                                        print "####################################################################"
-                                    fndSpeed = True
-                                else:
-                                    # Only take number
-                                    if oneChar != 'S' and oneChar != 'p' and oneChar != 'e' and oneChar != 'e' and \
-                                       oneChar != 'd' and oneChar != ',':
-                                        courseValue += oneChar
-
-                            # Start retrieve speed value
-                            elif fndSpeed == True and timeStamp == False:
-                                # End of the search, find course value
-                                if oneChar == ':':
-                                    # Write to logger
-                                    if backLogger == True:
-                                        logger.info("DEBUG_GSM: Speed: %s" % (speedValue))
-                                        logger.info("####################################################################")
-                                    # Print statement
-                                    else:
-                                        print "DEBUG_GSM: Speed: %s" % (speedValue)
-                                        print "####################################################################"
-                                    timeStamp = True
-                                else:
-                                    # Only take number
-                                    if oneChar != 'D' and oneChar != 'a' and oneChar != 't' and oneChar != 'e' and \
-                                       oneChar != 'T' and oneChar != 'i' and oneChar != 'm' and \
-                                       oneChar != 'e' and oneChar != ',':
-                                        speedValue += oneChar
+                # Write to logger
+                if backLogger == True:
+                    logger.info("DEBUG_GSM: GSM modem initialization completed")
+                    logger.info("####################################################################")
+                # Print statement
+                else:
+                    print "DEBUG_GSM: GSM modem initialization completed"
+                    print "####################################################################"
+                    
+                gsmInitialize = True
+                modem_alive(modemId)
+                MODEM_UP.set((modemSetting['port'],), 1)
+
+                # Time from the failure found until the modem is back in service
+                recoveryTime = watchdog.init_done()
+                if recoveryTime != None:
+                    MODEM_RECOVERY.observe((modemSetting['port'],), recoveryTime)
+                    # Write to logger
+                    if backLogger == True:
+                        logger.info("DEBUG_GSM: GSM modem %s recovered after %.1f seconds" % (modemSetting['port'], recoveryTime))
+                        logger.info("####################################################################")
+                    # Print statement
+                    else:
+                        print "DEBUG_GSM: GSM modem %s recovered after %.1f seconds" % (modemSetting['port'], recoveryTime)
+                        print "####################################################################"
 
-                            # Start retrieve time stamp
-                            elif timeStamp == True:
-                                timeStmpValue += oneChar
+                # Start polling without waiting for the modem idle time
+                modemWake.set()
+        
+            # Previously GSM modem initialization completed
+            else:
+                # Modem stopped answering, reset or lost its registration, run the init sequence again
+                if watchdog.is_stuck():
+                    # Write to logger
+                    if backLogger == True:
+                        logger.info("DEBUG_GSM: GSM modem %s stuck (%s), initialize again" % (modemSetting['port'], watchdog.stuckReason))
+                        logger.info("####################################################################")
+                    # Print statement
+                    else:
+                        print "DEBUG_GSM: GSM modem %s stuck (%s), initialize again" % (modemSetting['port'], watchdog.stuckReason)
+                        print "####################################################################"
 
+                    MODEM_REINIT.inc((modemSetting['port'], watchdog.stuckReason))
+                    watchdog.mark_down()
+                    modem_failed(modemId)
+                    MODEM_UP.set((modemSetting['port'],), 0)
+                    gsmInitialize = False
+                    continue
+
+                # Serial line quiet for a while, check the modem is still there and registered
+                if watchdog.probe_due():
+                    # USB modem re-enumerated, the old port will never answer again
+                    if watchdog.device_changed():
+                        raise serial.SerialException("Serial device %s changed" % (modemSetting['port']))
+
+                    # Send command and wait for the final result code, no reply is counted by the watchdog
+                    gsmReply = yield gsmModem.send_command(b'AT+CREG?')
+                    if creg_registered(gsmReply) == False:
+                        watchdog.mark_stuck('unregistered')
                         # Write to logger
                         if backLogger == True:
-                            logger.info("DEBUG_GSM: Time Stamp: %s" % (timeStmpValue))
+                            logger.info("DEBUG_GSM: GSM modem %s NOT registered to the network! Reply AT command: %s" % (modemSetting['port'], gsmReply))
                             logger.info("####################################################################")
                         # Print statement
                         else:
-                            print "DEBUG_GSM: Time Stamp: %s" % (timeStmpValue)
+                            print "DEBUG_GSM: GSM modem %s NOT registered to the network! Reply AT command: %s" % (modemSetting['port'], gsmReply)
                             print "####################################################################"
-
-                        # Update python data dictionary with GPS location
-                        try:
-                            # Check the cell number whether its already exist or not
-                            # Update the existing data, throw error if record is not exist, consider its a new data
-                            extDB = [ extDBB for extDBB in gpsTrackerListData if (extDBB['gpsid'] == cellPhoneNo) ]
-
-                            extDB[0]['latitude'] = latValue
-                            extDB[0]['longitude'] = lonValue
-                            extDB[0]['course'] = courseValue
-                            extDB[0]['speed'] = speedValue
-                            extDB[0]['status'] = gpsStatus
-                            extDB[0]['datetime'] = timeStmpValue
-                            
-                        # New cell number
-                        except:
-                            # Construct the new data
-                            newData = {
-                                        'gpsid' : cellPhoneNo,
-                                        'latitude' : latValue,
-                                        'longitude' : lonValue,
-                                        'course' : courseValue,
-                                        'speed' : speedValue,
-                                        'status' : gpsStatus,
-                                        'datetime' : timeStmpValue
-                                        }
-                            # Append a NEW extension to the existing record
-                            gpsTrackerListData.append(newData)
-
-                        # Display the current python data dictionary
+                        continue
+
+                # Listen for received SMS message
+                collect_new_sms(gsmModem, cmtiIndexList, cmtPduList)
+                CMTI_BACKLOG.set((modemSetting['port'],), len(cmtiIndexList))
+
+                # SMS message delivered directly, PDU mode
+                while len(cmtPduList) > 0:
+                    SMS_RECEIVED.inc((modemSetting['port'],))
+                    try:
+                        receive_sms_message(scheduler, smsAssembler, decode_deliver_pdu(cmtPduList.pop(0)))
+                    # Malformed PDU
+                    except SmsPduError:
+                        DECODE_FAILURE.inc(('sms_pdu',))
                         # Write to logger
                         if backLogger == True:
-                            logger.info("DEBUG_GSM: GPS JSON Data:")
-                            logger.info("####################################################################")
-                            logger.info(gpsTrackerListData)
+                            logger.info("DEBUG_GSM: Error in receiving GPS poll request SMS message!")
                             logger.info("####################################################################")
                         # Print statement
                         else:
-                            print "DEBUG_GSM: Time Stamp: %s" % (timeStmpValue)
+                            print "DEBUG_GSM: Error in receiving GPS poll request SMS message!"
                             print "####################################################################"
-                        
-                        # Delete back SMS message at index no. 1
-                        serialGSM.write(b'AT+CMGDA="DEL ALL"\r')
-                        # Delay for send command before process the reply 
-                        time.sleep(1)
-                        # Start check the reply from GSM modem
-                        gsmReply = serialGSM.read(serialGSM.inWaiting())
-                        # Previous command send OK 
-                        if 'OK' in gsmReply or 'ERROR' in gsmReply:
-                            # Poll request for GPS location continue to the next index
-                            if cellPhoneCnt > 1:
-                                # Reset counter after reach the last cell phone number
-                                if cellNoIndx == (cellPhoneCnt - 1):
-                                    cellNoIndx = 0
-                                # Increment index
-                                else:
-                                    cellNoIndx += 1
-                            waitSendMsg = False
-
-                            hexMsgPrtOne = ''
-                            hexMsgPrtTwo = ''
-                            decodedGPSMsg = ''
-                            cellPhoneNo = ''
-                            cmtiCnt = 0
-                            timeOutCnt = 0
-                            gpsComplete = False
-                            validCellNo = False
-                            msgPartOneCorr = False
-                            msgPartTwoCorr = False
-        
-                            # Write to logger
-                            if backLogger == True:
-                                logger.info("DEBUG_GSM: Delete ALL SMS message successful, Reply AT command: %s" % (gsmReply))
-                                logger.info("####################################################################")
-                            # Print statement
-                            else:
-                                print "DEBUG_GSM: Delete ALL SMS message successful, Reply AT command: %s" % (gsmReply)
-                                print "####################################################################"
 
-                    # Previously the cell phone no. and decode message are invalid
-                    else:
+                # Received SMS message, read every unread message in one command
+                if len(cmtiIndexList) > 0:
+                    arrivalIndexList = cmtiIndexList
+                    cmtiIndexList = []
+
+                    # Send command and wait for the final result code
+                    gsmReply = yield gsmModem.send_command(list_unread_command(smsPduMode))
+                    # Further SMS message may arrive during the command reply
+                    collect_new_sms(gsmModem, cmtiIndexList, cmtPduList)
+
+                    # Previous command send OK 
+                    if 'OK' in gsmReply:
                         # Write to logger
                         if backLogger == True:
-                            logger.info("DEBUG_GSM: Error in receiving GPS poll request SMS message!")
+                            logger.info("DEBUG_GSM: Received GPS location message, Reply AT command: %s" % (gsmReply))
                             logger.info("####################################################################")
                         # Print statement
                         else:
-                            print "DEBUG_GSM: Error in receiving GPS poll request SMS message!"
+                            print "DEBUG_GSM: Received GPS location message, Reply AT command: %s" % (gsmReply)
                             print "####################################################################"
 
-                        # Delete back SMS message at index no. 1
-                        serialGSM.write(b'AT+CMGDA="DEL ALL"\r')
-                        # Delay for send command before process the reply 
-                        time.sleep(1)
-                        # Start check the reply from GSM modem
-                        gsmReply = serialGSM.read(serialGSM.inWaiting())
-                        # Previous command send OK 
-                        if 'OK' in gsmReply or 'ERROR' in gsmReply:
-                            # Poll request for GPS location continue to the next index
-                            if cellPhoneCnt > 1:
-                                # Reset counter after reach the last cell phone number
-                                if cellNoIndx == (cellPhoneCnt - 1):
-                                    cellNoIndx = 0
-                                # Increment index
+                        # Hand every message to the decoder in one batch
+                        inboxList = parse_cmgl_reply(gsmReply, smsPduMode)
+                        # Text mode message parts are numbered in order, hand them over in arrival order
+                        if smsPduMode == False:
+                            inboxList = arrival_order(inboxList, arrivalIndexList + cmtiIndexList)
+                        SMS_RECEIVED.inc((modemSetting['port'],), len(inboxList))
+                        for cmglIndx, smsDeliver in inboxList:
+                            # Previously the message format are invalid
+                            if smsDeliver == None:
+                                DECODE_FAILURE.inc(('sms_message',))
+                                # Write to logger
+                                if backLogger == True:
+                                    logger.info("DEBUG_GSM: Error in receiving GPS poll request SMS message!")
+                                    logger.info("####################################################################")
+                                # Print statement
                                 else:
-                                    cellNoIndx += 1
-                            waitSendMsg = False
-
-                            hexMsgPrtOne = ''
-                            hexMsgPrtTwo = ''
-                            decodedGPSMsg = ''
-                            cellPhoneNo = ''
-                            cmtiCnt = 0
-                            timeOutCnt = 0
-                            gpsComplete = False
-                            validCellNo = False
-                            msgPartOneCorr = False
-                            msgPartTwoCorr = False
+                                    print "DEBUG_GSM: Error in receiving GPS poll request SMS message!"
+                                    print "####################################################################"
+                                continue
 
-                            # Write to logger
-                            if backLogger == True:
-                                logger.info("DEBUG_GSM: Delete ALL SMS message successful, Reply AT command: %s" % (gsmReply))
-                                logger.info("####################################################################")
-                            # Print statement
-                            else:
-                                print "DEBUG_GSM: Delete ALL SMS message successful, Reply AT command: %s" % (gsmReply)
-                                print "####################################################################"
-                                
-            # Check time out for waiting
-            else:
-                # Increment time out counting
-                timeOutCnt += 1
-                # Not received GPS location, stop waiting, continue to the next index
-                if timeOutCnt == gpsLocTimeOut:
-##                    # Delete back SMS message at index no. 1
-##                    serialGSM.write('AT+CMGDA="DEL ALL"\r')
-##                    # Delay for send command before process the reply 
-##                    time.sleep(1)
-##                    # Start check the reply from GSM modem
-##                    gsmReply = serialGSM.read(serialGSM.inWaiting())
-##                    # Previous command send OK 
-##                    if 'OK' in gsmReply or 'ERROR' in gsmReply:
-##                        # Write to logger
-##                        if backLogger == True:
-##                            logger.info("DEBUG_GSM: Delete ALL SMS message successful, Reply AT command: %s" % (gsmReply))
-##                            logger.info("####################################################################")
-##                        # Print statement
-##                        else:
-##                            print "DEBUG_GSM: Delete ALL SMS message successful, Reply AT command: %s" % (gsmReply)
-##                            print "####################################################################"
+                            receive_sms_message(scheduler, smsAssembler, smsDeliver)
+
+                        # Processed or rejected, the message are consumed
+                        consumedIndexList.extend([cmglIndx for cmglIndx, smsDeliver in inboxList])
+
+                # Delete back only the consumed SMS message, replies arrived in the meantime are kept
+                if len(consumedIndexList) > 0:
+                    deleteIndexList = sorted(set(consumedIndexList))
+                    consumedIndexList = yield gsmModem.delete_messages(deleteIndexList, smsBatchDelete)
 
                     # Write to logger
                     if backLogger == True:
-                        logger.info("DEBUG_GSM: WAITING for SMS time out!")
+                        logger.info("DEBUG_GSM: Delete SMS message %s, failed: %s" % (deleteIndexList, consumedIndexList))
                         logger.info("####################################################################")
                     # Print statement
                     else:
-                        print "DEBUG_GSM: WAITING for SMS time out!"
+                        print "DEBUG_GSM: Delete SMS message %s, failed: %s" % (deleteIndexList, consumedIndexList)
                         print "####################################################################"
 
-                    # Poll request for GPS location continue to the next index
-                    if cellPhoneCnt > 1:
-                        # Reset counter after reach the last cell phone number
-                        if cellNoIndx == (cellPhoneCnt - 1):
-                            cellNoIndx = 0
-                        # Increment index
+                    # Storage index failing again and again is given up, not retried on every cycle
+                    deleteAttempt = dict([(msgIndx, deleteAttempt.get(msgIndx, 0) + 1) for msgIndx in consumedIndexList])
+                    givenUpList = [msgIndx for msgIndx in consumedIndexList if deleteAttempt[msgIndx] >= CMGD_MAX_ATTEMPT]
+                    if len(givenUpList) > 0:
+                        consumedIndexList = [msgIndx for msgIndx in consumedIndexList if msgIndx not in givenUpList]
+                        # Write to logger
+                        if backLogger == True:
+                            logger.info("DEBUG_GSM: Delete SMS message %s failed %d times, given up" % (givenUpList, CMGD_MAX_ATTEMPT))
+                            logger.info("####################################################################")
+                        # Print statement
                         else:
-                            cellNoIndx += 1
-                    
-                    timeOutCnt = 0
-                    hexMsgPrtOne = ''
-                    hexMsgPrtTwo = ''
-                    decodedGPSMsg = ''
-                    cellPhoneNo = ''
-                    cmtiCnt = 0
-                    gpsComplete = False
-                    
-                    waitSendMsg = False     
-                        
-            # Poll current GPS location by sending SMS message to GPS vehicle tracker
-            if waitSendMsg == False:
-                # Polling request for GPS location are enable by macro
-                if enaGPSPoll == True:
-                    pollDisDelSms = False
-                    
-                    # Start send current GPS location request
-                    sendCmdMsg = b'AT+CMGS=' + '"' + cellPhoneList[cellNoIndx] + '"' + b'\r'
-                    serialGSM.write(str.encode(sendCmdMsg))
-                    # Delay for send command before process the reply 
-                    time.sleep(3)
-
-                    serialGSM.flushOutput()
-
-                    time.sleep(1)
-
-                    # Send the contents of the SMS message
-                    sendCmdMsg = 'WHERE#'
-                    #serialGSM.write(sendCmdMsg)
-                    serialGSM.write(sendCmdMsg)
-                    time.sleep(1)
-                    serialGSM.write(str.encode(chr(26)))
-                    time.sleep(3)
-                    
+                            print "DEBUG_GSM: Delete SMS message %s failed %d times, given up" % (givenUpList, CMGD_MAX_ATTEMPT)
+                            print "####################################################################"
+
+                # Check time out for every outstanding poll request
+                for cellPhoneNo in scheduler.tick():
+                    POLL_TIMEOUT.inc()
                     # Write to logger
                     if backLogger == True:
-                        logger.info("DEBUG_GSM: Send GPS location request [%s] successful" % (cellPhoneList[cellNoIndx]))
+                        logger.info("DEBUG_GSM: WAITING for SMS time out! [%s] message reference %s" % (cellPhoneNo, scheduler.message_reference(cellPhoneNo)))
                         logger.info("####################################################################")
                     # Print statement
                     else:
-                        print "DEBUG_GSM: Send GPS location request [%s] successful" % (cellPhoneList[cellNoIndx])
+                        print "DEBUG_GSM: WAITING for SMS time out! [%s] message reference %s" % (cellPhoneNo, scheduler.message_reference(cellPhoneNo))
                         print "####################################################################"
 
-                    serialGSM.flushOutput()
-                    # Wait for acknowledge with a current GPS location before send another request
-                    waitSendMsg = True
-                    # Clear serial communication buffer
-                    #serialGSM.read(serialGSM.inWaiting())
-                
+                    # Drop incomplete GPS location message
+                    smsAssembler.discard(cellPhoneNo)
+
+                # Drop message part that never complete, e.g. reply without poll request
+                smsAssembler.expire()
+
+                # Polling request for GPS location are enable by macro
+                if enaGPSPoll == True:
+                    pollDisDelSms = False
+                    # Only poll the trackers assigned to this modem, the share change with the list or the pool
+                    if pollTrackerList is not cellPhoneList or pollRingVersion != modemPool.ringVersion:
+                        pollTrackerList = cellPhoneList
+                        pollRingVersion = modemPool.ringVersion
+                        scheduler.set_trackers(modemPool.trackers_for(modemId, pollTrackerList))
+
                 # Polling request for GPS location are disable by macro     
                 else:
                     # Delete ALL SMS message, only once each time after GPS location poll request are disable 
                     if pollDisDelSms == False:
-                        # Start RESET the GPS information
-                        reset_gpsinfo()
-                        
                         # Delete back SMS message at index no. 1
-                        serialGSM.write(b'AT+CMGDA="DEL ALL"\r')
-                        # Delay for send command before process the reply 
-                        time.sleep(1)
-                        # Start check the reply from GSM modem
-                        gsmReply = serialGSM.read(serialGSM.inWaiting())
+                        # Send command and wait for the final result code
+                        gsmReply = yield gsmModem.send_command(b'AT+CMGDA="DEL ALL"')
                         # Previous command send OK 
                         if 'OK' in gsmReply or 'ERROR' in gsmReply:
                             # Write to logger
@@ -1130,14 +1273,18 @@ def serial_sms_comm (threadname, delay):
                                 print "####################################################################"
 
                         serialGSM.flushOutput()
-                        time.sleep(1)
 
                         # Reset necessary variable
-                        waitSendMsg = False
-                        cellNoIndx = 0
-                        
+                        scheduler.reset()
+                        pollTrackerList = None
+                        smsAssembler.reset()
+                        cmtiIndexList = []
+                        cmtPduList = []
+                        consumedIndexList = []
+                        deleteAttempt = {}
+
                         pollDisDelSms = True
-                        
+
                     # Write to logger
                     if backLogger == True:
                         logger.info("DEBUG_GSM: POLL GPS location DISABLE!")
@@ -1146,19 +1293,147 @@ def serial_sms_comm (threadname, delay):
                     else:
                         print "DEBUG_GSM: POLL GPS location DISABLE!"
                         print "####################################################################"
-                    
-        time.sleep(delay)                
+
+                # Send poll request and queued SMS message back-to-back, within the modem send rate
+                # and up to the outstanding poll request limit
+                while sendRate.ready():
+                    outboundPriority = smsOutbox.head_priority(modemId)
+                    cellPhoneNo = None
+                    # Queued SMS message more urgent than the poll request go first, same priority take turn
+                    if outboundPriority == None or outboundPriority > POLL_PRIORITY or \
+                       (outboundPriority == POLL_PRIORITY and outboundTurn == False):
+                        if enaGPSPoll == True:
+                            cellPhoneNo = scheduler.next_tracker()
+
+                    # No poll request due, send the queued SMS message whatever its priority
+                    if cellPhoneNo == None:
+                        outboundSms = smsOutbox.pop(modemId)
+                        if outboundSms == None:
+                            break
+
+                        sendRate.take()
+                        outboundTurn = False
+                        smsSent = yield send_outbound_sms(gsmModem, modemId, outboundSms)
+                        collect_new_sms(gsmModem, cmtiIndexList, cmtPduList)
+                        # Retry on the next cycle
+                        if smsSent == False:
+                            break
+                        continue
+
+                    sendRate.take()
+                    outboundTurn = True
+                    # Start send current GPS location request
+                    if smsPduMode == True:
+                        pduMsg, pduLength = encode_submit_pdu(cellPhoneNo, 'WHERE#')
+                        sendCmdMsg = b'AT+CMGS=%d' % (pduLength)
+                        smsBody = pduMsg
+                    else:
+                        sendCmdMsg = b'AT+CMGS=' + '"' + cellPhoneNo + '"'
+                        smsBody = 'WHERE#'
+                    # Send the contents once the '>' SMS editor prompt arrived, wait for the network to accept it
+                    msgRef, gsmReply = yield gsmModem.submit_sms(sendCmdMsg, smsBody, smsSendTimeOut)
+                    collect_new_sms(gsmModem, cmtiIndexList, cmtPduList)
+
+                    # SMS message send failed, retry on the next cycle
+                    if msgRef == None:
+                        # Write to logger
+                        if backLogger == True:
+                            logger.info("DEBUG_GSM: Send GPS location request [%s] failed, Reply AT command: %s" % (cellPhoneNo, gsmReply))
+                            logger.info("####################################################################")
+                        # Print statement
+                        else:
+                            print "DEBUG_GSM: Send GPS location request [%s] failed, Reply AT command: %s" % (cellPhoneNo, gsmReply)
+                            print "####################################################################"
+                        SMS_SENT.inc((modemSetting['port'], 'failed'))
+                        scheduler.send_failed(cellPhoneNo)
+                        break
+
+                    # Write to logger
+                    if backLogger == True:
+                        logger.info("DEBUG_GSM: Send GPS location request [%s] successful, message reference %d" % (cellPhoneNo, msgRef))
+                        logger.info("####################################################################")
+                    # Print statement
+                    else:
+                        print "DEBUG_GSM: Send GPS location request [%s] successful, message reference %d" % (cellPhoneNo, msgRef)
+                        print "####################################################################"
+
+                    # Wait for acknowledge with a current GPS location, matched by sender number
+                    SMS_SENT.inc((modemSetting['port'], 'ok'))
+                    scheduler.mark_sent(cellPhoneNo, msgRef)
+
+                OUTBOUND_QUEUE.set((modemSetting['port'],), smsOutbox.modem_pending(modemId))
+
+        # Serial communication lost, e.g. USB modem unplugged
+        except (serial.SerialException, OSError):
+            # Write to logger
+            if backLogger == True:
+                logger.info("DEBUG_GSM: Serial communication %s failed!" % (modemSetting['port']))
+                logger.info("####################################################################")
+            # Print statement
+            else:
+                print "DEBUG_GSM: Serial communication %s failed!" % (modemSetting['port'])
+                print "####################################################################"
+
+            try:
+                gsmModem.close()
+                serialGSM.close()
+            except:
+                pass
+            serialGSM = None
+            modem_failed(modemId)
+            MODEM_UP.set((modemSetting['port'],), 0)
+            yield modemLoop.sleep(watchdog.init_failed())
+            continue
+
+        # Sleep until something to do, the next poll due or reply deadline
+        waitTime = delay
+        if gsmInitialize == True and enaGPSPoll == True:
+            eventTime = scheduler.next_event_time()
+            if eventTime != None:
+                waitTime = max(0, min(delay, eventTime - monotonic()))
+        # Nothing can be sent before the next send rate token, a queued SMS message goes as soon as it comes
+        if gsmInitialize == True and sendRate.ready() == False:
+            tokenWait = max(0, min(delay, sendRate.next_time() - monotonic()))
+            if smsOutbox.modem_pending(modemId) > 0:
+                waitTime = tokenWait
+            else:
+                waitTime = max(waitTime, tokenWait)
+        yield modemWake.wait(waitTime)
                         
+# Start the background workers: history writer, tracker list watcher and the modem event loop
+def start_gateway():
+    # Open GPS location history database and start its writer thread
+    try:
+        historyStore.start()
+    # Error
+    except Exception as e:
+        # Write to logger
+        if backLogger == True:
+            logger.info("DEBUG_HISTORY: Open GPS location history database failed! %s" % (e))
+        # Print statement
+        else:
+            print "DEBUG_HISTORY: Open GPS location history database failed! %s" % (e)
+
+    # Start watching the tracker list file
+    if trackerListWatch > 0:
+        trackerListWatcher.start()
+
+    # Create coroutine for serial communication with each GSM modem in the pool
+    for modemId in range(modemPool.modem_count()):
+        modemLoop.create_task(serial_sms_comm("[serial_sms_comm:%d]" % (modemId), 5, modemId), "[serial_sms_comm:%d]" % (modemId))
+
+    # Create thread for the modem event loop, driving every GSM modem coroutine
+    try:
+        thread.start_new_thread(modemLoop.run_forever, ())
+    except:
+        logger.info("Error: Unable to start [modem_event_loop] thread")
+
 # Script entry point
 def main():
     global backLogger
     global secureInSecure
-    
-    # Create thread for serial communication with GSM modem
-    try:
-        thread.start_new_thread(serial_sms_comm, ("[serial_sms_comm]", 5 ))
-    except:
-        logger.info("Error: Unable to start [serial_sms_comm] thread")
+
+    start_gateway()
 
     # Write to logger
     if backLogger == True:
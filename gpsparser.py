@@ -0,0 +1,117 @@
+# GPS tracker reply parser
+#
+# Decode the WHERE# reply text from the GPS vehicle tracker, e.g.
+# Current position!Lat:N3.05834,Lon:E101.58935,Course:0.00,Speed:0.00,DateTime:2019-03-11 13:14:07
+# in a single pass with a precompiled pattern.
+#
+# The record keeps the tracker text of every field, given back as it is by
+# the REST API and the history, so no precision or date time format is lost
+# on the way. Only course and speed, read by the poll scheduler, are also
+# kept as float, and the status text is shared by every record.
+
+import math
+import re
+
+# GPS location field, in the REST API JSON
+GPS_FIELD = ('latitude', 'longitude', 'course', 'speed', 'status', 'datetime')
+
+# GPS location field value not received yet
+NOT_AVAILABLE = 'NA'
+
+# Maximum distinct status text shared, further status text are kept on their own
+STATUS_MAX_CNT = 16
+
+# Status text -> the shared string
+STATUS_TEXT = {}
+
+# Tracker reply does not follow the GPS location message format
+class GpsParseError(ValueError):
+    pass
+
+# Shared string of the status text, registered on first sight
+def shared_status(statusText):
+    sharedText = STATUS_TEXT.get(statusText)
+    if sharedText is not None:
+        return sharedText
+
+    # Garbage reply must not grow the registry without bound
+    if len(STATUS_TEXT) >= STATUS_MAX_CNT:
+        return statusText
+
+    STATUS_TEXT[statusText] = statusText
+    return statusText
+
+# GPS location record decoded from the tracker reply
+# course in degree and speed in km/h, None when not available
+# fieldText holds the tracker text of the GPS_FIELD, in the same order
+class GpsFix(object):
+
+    __slots__ = ('course', 'speed', 'fieldText')
+
+    def __init__(self, course, speed, fieldText):
+        self.course = course
+        self.speed = speed
+        self.fieldText = fieldText
+
+    # GPS location field as the tracker sent it, GPS_FIELD -> text
+    def as_json(self):
+        return dict(zip(GPS_FIELD, self.fieldText))
+
+    def __repr__(self):
+        return 'GpsFix(%r, %r, %r)' % (self.course, self.speed, self.fieldText)
+
+# GPS location field of a tracker without any GPS location yet
+def empty_json():
+    return dict.fromkeys(GPS_FIELD, NOT_AVAILABLE)
+
+# Signed degree from hemisphere coordinate, e.g. S6.20001 -> -6.20001, None when not a number
+def parse_coord(coordText, negHemisphere):
+    coordText = coordText.strip()
+    coordSign = 1.0
+    if coordText[:1].upper() in ('N', 'S', 'E', 'W'):
+        if coordText[0].upper() == negHemisphere:
+            coordSign = -1.0
+        coordText = coordText[1:]
+
+    coordValue = parse_number(coordText)
+    if coordValue is None:
+        return None
+
+    return coordSign * coordValue
+
+# Float value of the field, None when empty, not a number or not finite, e.g. nan or inf
+def parse_number(fieldText):
+    try:
+        fieldValue = float(fieldText)
+    except ValueError:
+        return None
+
+    if math.isnan(fieldValue) or math.isinf(fieldValue):
+        return None
+
+    return fieldValue
+
+# GPS status before '!', then the labelled fields separated by ','
+GPS_REPLY_PATTERN = re.compile(
+    r'\s*(?P<status>[^!:]*?)\s*!\s*'
+    r'Lat\s*:\s*(?P<latitude>[^,:]+?)\s*,\s*'
+    r'Lon\s*:\s*(?P<longitude>[^,:]+?)\s*,\s*'
+    r'Course\s*:\s*(?P<course>[^,:]*?)\s*,\s*'
+    r'Speed\s*:\s*(?P<speed>[^,:]*?)\s*,\s*'
+    r'DateTime\s*:\s*(?P<datetime>.*?)\s*$',
+    re.IGNORECASE | re.DOTALL)
+
+# Decode GPS location message, raise GpsParseError for malformed message
+# A coordinate that is not a number make the message malformed, course and
+# speed that can not be read are left not available
+def parse_gps_reply(decodedGPSMsg):
+    gpsMatch = GPS_REPLY_PATTERN.match(decodedGPSMsg)
+    if gpsMatch is None:
+        raise GpsParseError("Malformed GPS location message: %r" % (decodedGPSMsg))
+
+    latText, lonText, courseText, speedText, statusText, datetimeText = gpsMatch.group(*GPS_FIELD)
+    if parse_coord(latText, 'S') is None or parse_coord(lonText, 'W') is None:
+        raise GpsParseError("Malformed GPS location coordinate: %r" % (decodedGPSMsg))
+
+    return GpsFix(parse_number(courseText), parse_number(speedText),
+                  (latText, lonText, courseText, speedText, shared_status(statusText), datetimeText))
@@ -0,0 +1,414 @@
+# GSM modem AT command executor
+#
+# Every AT command is written to the modem and the reply is collected until
+# the final result code arrives (OK, ERROR, +CMS ERROR, +CME ERROR) or, for
+# commands that open the SMS editor, until the '>' prompt arrives. Each
+# command carries its own deadline, so the caller waits only as long as the
+# modem really needs instead of a fixed sleep.
+#
+# An SMS message is submitted in step with the modem: AT+CMGS, the '>'
+# prompt, then the contents and ctrl-Z in a single write, completed by
+# +CMGS: <mr> or an error. The message reference is given back to the caller
+# to match the poll request with its reply and delivery report.
+#
+# AsyncGsmModem runs the exchange on the modem event loop, the reply is
+# collected as the serial data arrives and handed back through a Future.
+
+# Monotonic clock for the command deadline
+from monoclock import monotonic
+
+# Modem event loop
+from eventloop import Future
+from eventloop import Return
+
+# Gateway metrics
+from metrics import AT_COMMAND_LATENCY
+from metrics import SERIAL_BYTES
+
+# Retrieve SMS server settings
+from settings import atcmdtimeout
+from settings import smssendtimeout
+
+# Final result codes that complete an AT command exchange
+FINAL_RESULT_CODES = ('OK', 'ERROR', 'NO CARRIER')
+FINAL_RESULT_PREFIX = ('+CMS ERROR', '+CME ERROR')
+
+# Unsolicited result codes raised by the modem on its own
+UNSOLICITED_PREFIX = ('+CMTI:', '+CMT:')
+
+# SMS message delivered directly, PDU follows on the next line
+CMT_PREFIX = '+CMT:'
+
+# Modem start up indication, the modem reset and lost its settings
+MODEM_READY_URC = ('RDY', 'START', '+CFUN: 1')
+
+# SMS editor control characters, ctrl-Z send the message and ESC abandons it
+CTRL_Z = b'\x1a'
+ESCAPE = b'\x1b'
+
+# Maximum AT+CMGD chained in one command line, keep within the modem command line buffer
+CMGD_BATCH_SIZE = 20
+
+# Failed AT+CMGD in a row before the storage index is given up
+CMGD_MAX_ATTEMPT = 3
+
+# Nothing stored at the storage index, the message is already gone
+CMS_INVALID_INDEX = '+CMS ERROR: 321'
+
+# Serial read timeout the modem port is opened with (seconds)
+SERIAL_READ_TIMEOUT = 0.05
+
+# Read interval of a port without file descriptor, e.g. gsm:// emulator (seconds)
+SERIAL_POLL_INTERVAL = 0.05
+
+# Position just after the final result code line or the SMS editor prompt, -1 when not complete yet
+# Scanning start at scanStart, a line boundary already checked by an earlier call
+# Unsolicited result codes following the final result code are left outside the reply
+def reply_end(gsmReply, expectPrompt=False, scanStart=0):
+    lineStart = scanStart
+    while True:
+        lineEnd = gsmReply.find('\n', lineStart)
+        if lineEnd == -1:
+            break
+
+        replyLine = gsmReply[lineStart:lineEnd].strip()
+        if replyLine in FINAL_RESULT_CODES or replyLine.startswith(FINAL_RESULT_PREFIX):
+            return lineEnd + 1
+        # Modem reset in the middle of the command, the final result code will never come
+        if replyLine in MODEM_READY_URC:
+            return lineEnd + 1
+        # SMS editor prompt followed by unsolicited result codes
+        if expectPrompt == True and replyLine == '>':
+            return lineEnd
+        lineStart = lineEnd + 1
+
+    # Waiting for the SMS editor prompt, e.g. after AT+CMGS
+    if expectPrompt == True and gsmReply[lineStart:].strip() == '>':
+        return len(gsmReply)
+
+    return -1
+
+# Last line boundary of the reply, scanning for reply_end can restart from there
+def reply_scan_start(gsmReply):
+    return gsmReply.rfind('\n') + 1
+
+# Check whether the command completed with OK
+def reply_ok(gsmReply):
+    for replyLine in reversed(gsmReply.splitlines()):
+        replyLine = replyLine.strip()
+        if replyLine != '':
+            return replyLine == 'OK'
+
+    return False
+
+# Check whether the SMS message is gone, deleted now or already before
+def reply_deleted(gsmReply):
+    return reply_ok(gsmReply) or CMS_INVALID_INDEX in gsmReply
+
+# Check whether the reply ended at the SMS editor prompt
+def reply_prompt(gsmReply):
+    return gsmReply.rstrip().endswith('>')
+
+# Get the message reference from the submit reply, e.g. +CMGS: 12, None when the submit failed
+def cmgs_reference(gsmReply):
+    for replyLine in gsmReply.splitlines():
+        replyLine = replyLine.strip()
+        if replyLine.startswith('+CMGS:'):
+            try:
+                return int(replyLine[6:].split(',')[0].strip())
+            # Malformed submit reply
+            except ValueError:
+                return None
+
+    return None
+
+# Command name used as the metric label, e.g. AT+CMGS="+60123456789" -> AT+CMGS
+def command_name(atCmd):
+    for sepChar in '=?;':
+        atCmd = atCmd.split(sepChar, 1)[0]
+
+    return atCmd.strip()
+
+# Get the SMS storage index from +CMTI indication, e.g. +CMTI: "SM",3
+def cmti_index(urcLine):
+    try:
+        return int(urcLine.split(',')[-1].strip())
+    # Malformed indication
+    except ValueError:
+        return None
+
+# Serial I/O and unsolicited result code handling shared by the AT command executor
+class GsmModem(object):
+
+    def __init__(self, serialGSM, cmdTimeOut=atcmdtimeout, portName=None):
+        self.serialGSM = serialGSM
+        self.cmdTimeOut = cmdTimeOut
+        self.rxBuffer = ''
+        self.unsolicited = []
+        # Modem health watchdog, told about every command result and serial data
+        self.watchdog = None
+        # Modem label of the metrics
+        if portName is None:
+            portName = getattr(serialGSM, 'port', '')
+        self.portName = portName
+
+    # Write data to the modem
+    def write(self, txData):
+        self.serialGSM.write(txData)
+        SERIAL_BYTES.inc((self.portName, 'out'), len(txData))
+
+    # Read data from the modem
+    def read(self, rxSize):
+        rxData = self.serialGSM.read(rxSize)
+        if rxData:
+            SERIAL_BYTES.inc((self.portName, 'in'), len(rxData))
+
+        return rxData
+
+    # Keep unsolicited result codes found inside a reply for the caller
+    # +CMT is kept together with its PDU line, separated by a new line
+    def collect_unsolicited(self, gsmReply):
+        replyLines = [replyLine.strip() for replyLine in gsmReply.splitlines()]
+        replyLines = [replyLine for replyLine in replyLines if replyLine != '']
+
+        for a in range(0, len(replyLines)):
+            if replyLines[a].startswith(CMT_PREFIX):
+                if a + 1 < len(replyLines):
+                    self.unsolicited.append(replyLines[a] + '\n' + replyLines[a + 1])
+            elif replyLines[a].startswith(UNSOLICITED_PREFIX):
+                self.unsolicited.append(replyLines[a])
+            elif replyLines[a] in MODEM_READY_URC:
+                self.modem_reset()
+
+    # Modem reset on its own, the init sequence must run again
+    def modem_reset(self):
+        if self.watchdog is not None:
+            self.watchdog.modem_reset()
+
+    # Collect unsolicited result codes from the complete lines received outside any command
+    def collect_lines(self):
+        # Only process complete lines, keep the remaining partial line
+        lineEnd = self.rxBuffer.rfind('\n')
+        if lineEnd != -1:
+            completeData = self.rxBuffer[:lineEnd + 1]
+
+            # +CMT received without its PDU line yet, wait for the rest
+            cmtStart = completeData.rfind(CMT_PREFIX)
+            if cmtStart != -1 and completeData[cmtStart:].strip().find('\n') == -1:
+                lineEnd = cmtStart - 1
+                completeData = self.rxBuffer[:lineEnd + 1]
+
+            self.collect_unsolicited(completeData)
+            self.rxBuffer = self.rxBuffer[lineEnd + 1:]
+
+# AT command executor driven by the modem event loop
+# The serial port is read by the loop once data arrived, send_command and
+# wait_reply give back a Future instead of blocking the calling thread
+class AsyncGsmModem(GsmModem):
+
+    # onUnsolicited is called from the loop thread once an unsolicited result code arrived
+    def __init__(self, eventLoop, serialGSM, cmdTimeOut=atcmdtimeout, portName=None, onUnsolicited=None, watchdog=None):
+        GsmModem.__init__(self, serialGSM, cmdTimeOut, portName)
+        self.eventLoop = eventLoop
+        self.onUnsolicited = onUnsolicited
+        self.watchdog = watchdog
+        # Pending command reply
+        self.replyFuture = None
+        self.replyData = ''
+        self.replyScan = 0
+        self.replyPrompt = False
+        self.replyTimer = None
+        # Serial error raised while reading, given back to the coroutine
+        self.failure = None
+        self.pollTimer = None
+
+        # Only read what already arrived, never block the loop
+        self.serialGSM.timeout = 0
+
+        # Real serial port, read once select report data, otherwise read periodically
+        try:
+            self.fileNo = self.serialGSM.fileno()
+        except (AttributeError, IOError):
+            self.fileNo = None
+
+        if self.fileNo is not None:
+            self.eventLoop.add_reader(self.fileNo, self.read_ready)
+        else:
+            self.pollTimer = self.eventLoop.call_later(SERIAL_POLL_INTERVAL, self.poll_ready)
+
+    # Read timer of a port without file descriptor
+    def poll_ready(self):
+        self.read_ready()
+        if self.failure is None and self.pollTimer is not None:
+            self.pollTimer = self.eventLoop.call_later(SERIAL_POLL_INTERVAL, self.poll_ready)
+
+    # Serial data arrived, complete the pending command or collect unsolicited result codes
+    def read_ready(self):
+        try:
+            # Ready without any data waiting means the device is gone, the read raise the error
+            rxData = self.read(self.serialGSM.inWaiting() or (1 if self.fileNo is not None else 0))
+        except (IOError, OSError) as e:
+            self.fail(e)
+            return
+
+        if not rxData:
+            return
+
+        if self.watchdog is not None:
+            self.watchdog.data_received()
+
+        if self.replyFuture is not None:
+            self.replyData += rxData
+            if not self.check_reply():
+                return
+        else:
+            self.rxBuffer += rxData
+
+        self.collect_lines()
+        if len(self.unsolicited) > 0 and self.onUnsolicited is not None:
+            self.onUnsolicited()
+
+    # Serial communication lost, stop reading and fail the pending command
+    def fail(self, failure):
+        self.failure = failure
+        self.close()
+
+        if self.replyFuture is not None:
+            replyFuture = self.replyFuture
+            self.replyFuture = None
+            self.replyTimer.cancel()
+            replyFuture.set_exception(failure)
+
+        # Let the waiting coroutine find out
+        if self.onUnsolicited is not None:
+            self.onUnsolicited()
+
+    # Modem reset on its own, wake the coroutine to run the init sequence again
+    def modem_reset(self):
+        GsmModem.modem_reset(self)
+        if self.onUnsolicited is not None:
+            self.onUnsolicited()
+
+    # Stop reading the serial port
+    def close(self):
+        if self.fileNo is not None:
+            self.eventLoop.remove_reader(self.fileNo)
+        if self.pollTimer is not None:
+            self.pollTimer.cancel()
+            self.pollTimer = None
+
+    # Give back the unsolicited result codes received so far, the loop already read the port
+    def read_unsolicited(self):
+        if self.failure is not None:
+            raise self.failure
+
+        urcLines = self.unsolicited
+        self.unsolicited = []
+
+        return urcLines
+
+    # Future completed with the modem reply once completed or the deadline expired
+    def wait_reply(self, timeOut=None, expectPrompt=False):
+        replyFuture = Future()
+        if self.failure is not None:
+            replyFuture.set_exception(self.failure)
+            return replyFuture
+
+        # Partial line received earlier belongs to this reply
+        self.replyFuture = replyFuture
+        self.replyData = self.rxBuffer
+        self.replyPrompt = expectPrompt
+        self.replyScan = 0
+        self.rxBuffer = ''
+
+        if timeOut is None:
+            timeOut = self.cmdTimeOut
+        # Command deadline expired, give back whatever has been received
+        self.replyTimer = self.eventLoop.call_later(timeOut, self.finish_reply)
+
+        self.check_reply()
+
+        return replyFuture
+
+    # Complete the pending command once its final result code arrived, return True when completed
+    # Data after the final result code, e.g. +CMTI, goes back to the receive buffer
+    def check_reply(self):
+        replyEnd = reply_end(self.replyData, self.replyPrompt, self.replyScan)
+        if replyEnd == -1:
+            self.replyScan = reply_scan_start(self.replyData)
+            return False
+
+        self.rxBuffer = self.replyData[replyEnd:]
+        self.replyData = self.replyData[:replyEnd]
+        self.finish_reply(True)
+        return True
+
+    # Complete the pending command with the reply received so far
+    # Not completed when the deadline expired before the final result code
+    def finish_reply(self, completed=False):
+        replyFuture = self.replyFuture
+        gsmReply = self.replyData
+        self.replyFuture = None
+        self.replyData = ''
+        self.replyTimer.cancel()
+
+        if self.watchdog is not None:
+            self.watchdog.command_done(completed)
+
+        # SMS indication may arrive in between the command reply
+        self.collect_unsolicited(gsmReply)
+
+        replyFuture.set_result(gsmReply)
+        if len(self.unsolicited) > 0 and self.onUnsolicited is not None:
+            self.onUnsolicited()
+
+    # Send AT command, Future completed with the reply once the final result code arrived
+    def send_command(self, atCmd, timeOut=None, expectPrompt=False):
+        cmdStart = monotonic()
+        self.write(atCmd + b'\r')
+
+        replyFuture = self.wait_reply(timeOut, expectPrompt)
+        replyFuture.add_done_callback(lambda future: AT_COMMAND_LATENCY.observe((self.portName, command_name(atCmd)), monotonic() - cmdStart))
+
+        return replyFuture
+
+    # Coroutine submitting SMS message, the contents are sent once the '>' prompt arrived
+    # Give back (message reference, reply), the message reference is None when the submit failed
+    def submit_sms(self, cmgsCmd, smsBody, timeOut=smssendtimeout):
+        gsmReply = yield self.send_command(cmgsCmd, expectPrompt=True)
+        if not reply_prompt(gsmReply):
+            # Prompt may still come late, leave the SMS editor
+            self.write(ESCAPE)
+            raise Return((None, gsmReply))
+
+        submitStart = monotonic()
+        self.write(smsBody + CTRL_Z)
+        gsmReply = yield self.wait_reply(timeOut)
+        AT_COMMAND_LATENCY.observe((self.portName, 'AT+CMGS submit'), monotonic() - submitStart)
+
+        msgRef = cmgs_reference(gsmReply)
+        # No answer from the network, leave the SMS editor in case the modem is still in it
+        if msgRef is None:
+            self.write(ESCAPE)
+
+        raise Return((msgRef, gsmReply))
+
+    # Coroutine deleting SMS message at the given storage indices, give back the indices failed to delete
+    def delete_messages(self, msgIndexList, batchDelete=True):
+        failedList = []
+
+        for a in range(0, len(msgIndexList), CMGD_BATCH_SIZE):
+            batchList = msgIndexList[a:a + CMGD_BATCH_SIZE]
+
+            if batchDelete == True and len(batchList) > 1:
+                gsmReply = yield self.send_command(b'AT' + b';'.join([b'+CMGD=%d' % (msgIndx) for msgIndx in batchList]))
+                if reply_ok(gsmReply):
+                    continue
+
+            # Single delete, or the modem rejected the chained command line
+            for msgIndx in batchList:
+                gsmReply = yield self.send_command(b'AT+CMGD=%d' % (msgIndx))
+                if not reply_deleted(gsmReply):
+                    failedList.append(msgIndx)
+
+        raise Return(failedList)
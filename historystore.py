@@ -0,0 +1,161 @@
+# GPS position history store
+#
+# Every decoded GPS location is appended to an SQLite database indexed on
+# (gpsid, recvtime), so the history of one tracker within a time range is
+# answered from the index. The modem threads only queue the record, a single
+# writer thread commits the queue in batched transactions, so the serial
+# loop never waits on the disk.
+#
+# The queue is bounded: a record is dropped, and counted in the metrics,
+# when the queue is full, when the writer thread is not running, or when its
+# batch keeps failing to commit, instead of growing the memory without limit.
+
+import sqlite3
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# Gateway metrics
+from metrics import HISTORY_DROPPED
+
+# Maximum GPS location record committed in one transaction
+HISTORY_BATCH_SIZE = 500
+
+# Queued GPS location record are committed at least this often (seconds)
+HISTORY_FLUSH_INTERVAL = 1.0
+
+# GPS location record waiting for the writer thread
+HISTORY_QUEUE_SIZE = 10000
+
+# Failed commit of one batch before its record are dropped
+HISTORY_MAX_ATTEMPT = 3
+
+# Maximum GPS location record returned by one history query
+HISTORY_QUERY_LIMIT = 10000
+
+# GPS location history field, in table column order
+HISTORY_FIELD = ('gpsid', 'recvtime', 'status', 'latitude', 'longitude', 'course', 'speed', 'datetime')
+
+HISTORY_SCHEMA = ('CREATE TABLE IF NOT EXISTS gpshistory ('
+                  'gpsid TEXT NOT NULL, recvtime REAL NOT NULL, status TEXT, latitude TEXT, '
+                  'longitude TEXT, course TEXT, speed TEXT, datetime TEXT)',
+                  'CREATE INDEX IF NOT EXISTS gpshistory_gpsid_recvtime ON gpshistory (gpsid, recvtime)')
+
+HISTORY_INSERT = 'INSERT INTO gpshistory (%s) VALUES (%s)' % (', '.join(HISTORY_FIELD), ', '.join(['?'] * len(HISTORY_FIELD)))
+
+HISTORY_SELECT = ('SELECT %s FROM gpshistory WHERE gpsid = ? AND recvtime >= ? AND recvtime <= ? '
+                  'ORDER BY recvtime LIMIT ?' % (', '.join(HISTORY_FIELD)))
+
+# Append only GPS location history with batched writer thread
+class HistoryStore(object):
+
+    def __init__(self, dbPath, batchSize=HISTORY_BATCH_SIZE, flushInterval=HISTORY_FLUSH_INTERVAL,
+                 queueSize=HISTORY_QUEUE_SIZE, maxAttempt=HISTORY_MAX_ATTEMPT):
+        self.dbPath = dbPath
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.maxAttempt = maxAttempt
+        self.recordQueue = queue.Queue(queueSize)
+        self.writerThread = None
+
+    # Open new database connection, every thread use its own connection
+    def connect(self):
+        dbConn = sqlite3.connect(self.dbPath, timeout=10)
+        # Reader does not block the writer and the other way round
+        dbConn.execute('PRAGMA journal_mode=WAL')
+        return dbConn
+
+    # Create the table and index, then start the writer thread
+    def start(self):
+        dbConn = self.connect()
+        try:
+            for sqlCmd in HISTORY_SCHEMA:
+                dbConn.execute(sqlCmd)
+            dbConn.commit()
+        finally:
+            dbConn.close()
+
+        self.writerThread = threading.Thread(target=self.write_loop, name='historystore')
+        self.writerThread.daemon = True
+        self.writerThread.start()
+
+    # Check whether the writer thread is committing the queued record
+    def running(self):
+        return self.writerThread is not None and self.writerThread.is_alive()
+
+    # Queue one GPS location record, never block the caller
+    # Dropped when no writer thread would ever take it or the queue is full
+    def append(self, gpsid, gpsFix, recvTime=None):
+        if not self.running():
+            HISTORY_DROPPED.inc(('not_running',))
+            return
+
+        if recvTime is None:
+            recvTime = time.time()
+
+        # Kept as the tracker text, the history API give back the same JSON shape as /gpsinfo
+        gpsFields = gpsFix.as_json()
+        try:
+            self.recordQueue.put_nowait((gpsid, recvTime, gpsFields['status'], gpsFields['latitude'], gpsFields['longitude'],
+                                         gpsFields['course'], gpsFields['speed'], gpsFields['datetime']))
+        # Writer thread behind, e.g. database locked
+        except queue.Full:
+            HISTORY_DROPPED.inc(('queue',))
+
+    # Take the queued record, wait up to the flush interval for the first one
+    def next_batch(self):
+        try:
+            batchList = [self.recordQueue.get(True, self.flushInterval)]
+        except queue.Empty:
+            return []
+
+        while len(batchList) < self.batchSize:
+            try:
+                batchList.append(self.recordQueue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batchList
+
+    # Writer thread, commit the queued record one transaction per batch
+    def write_loop(self):
+        dbConn = self.connect()
+
+        while True:
+            batchList = self.next_batch()
+            if len(batchList) == 0:
+                continue
+
+            # Database busy or disk error, retry the same batch, then give it up
+            for attemptCnt in range(1, self.maxAttempt + 1):
+                try:
+                    with dbConn:
+                        dbConn.executemany(HISTORY_INSERT, batchList)
+                    break
+                except sqlite3.Error:
+                    if attemptCnt == self.maxAttempt:
+                        HISTORY_DROPPED.inc(('db_error',), len(batchList))
+                    else:
+                        time.sleep(self.flushInterval)
+
+    # GPS location history of one tracker within the time range (epoch seconds), oldest first
+    def query(self, gpsid, fromTime=None, toTime=None, limit=HISTORY_QUERY_LIMIT):
+        if fromTime is None:
+            fromTime = 0
+        if toTime is None:
+            toTime = float('inf')
+
+        dbConn = self.connect()
+        try:
+            dbCursor = dbConn.execute(HISTORY_SELECT, (gpsid, fromTime, toTime, limit))
+            return [dict(zip(HISTORY_FIELD, historyRow)) for historyRow in dbCursor.fetchall()]
+        finally:
+            dbConn.close()
+
+    # Number of GPS location record waiting to be committed
+    def pending(self):
+        return self.recordQueue.qsize()
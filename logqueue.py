@@ -0,0 +1,159 @@
+# Non-blocking gateway logging
+#
+# The modem event loop only puts the log record on a bounded queue, a
+# listener thread writes it to the real handler, e.g. the rotating log file,
+# so disk I/O and the midnight rollover never delay an AT command. The hot
+# path debug output is rate limited per kind of message, and a full queue
+# drops the record instead of blocking; both are counted in the metrics and
+# reported in the next record of the same kind.
+#
+# Python 2 has no logging.handlers.QueueHandler and QueueListener, these
+# follow the same shape.
+
+import logging
+import re
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# Gateway metrics
+from metrics import LOG_DROPPED
+
+# Log record waiting for the listener thread
+LOG_QUEUE_SIZE = 10000
+
+# Log record per second and burst allowed for each kind of message
+LOG_RATE = 20
+LOG_BURST = 100
+
+# Separator line written after each gateway message, follow the fate of its message
+LOG_SEPARATOR = '####'
+
+# Digits and cell phone no. are left out of the message kind
+MESSAGE_KIND_PATTERN = re.compile(r'[+\d]+')
+
+# Message kind length, long enough to tell the message apart
+MESSAGE_KIND_LENGTH = 48
+
+# Maximum message kind tracked, forget every bucket beyond that
+MESSAGE_KIND_MAX_CNT = 1000
+
+# Kind of the log message, e.g. 'DEBUG_GSM: Send GPS location request [] successful'
+def message_kind(logMessage):
+    return MESSAGE_KIND_PATTERN.sub('', logMessage[:MESSAGE_KIND_LENGTH * 2])[:MESSAGE_KIND_LENGTH]
+
+# Token bucket rate limit per kind of message, warning and above always pass
+class RateLimitFilter(logging.Filter):
+
+    def __init__(self, logRate=LOG_RATE, logBurst=LOG_BURST):
+        logging.Filter.__init__(self)
+        self.logRate = float(logRate)
+        self.logBurst = float(logBurst)
+        self.lock = threading.Lock()
+        # Message kind -> [token, last refill time, dropped count]
+        self.buckets = {}
+        # Whether the last message of the calling thread was dropped
+        self.localState = threading.local()
+
+    def filter(self, record):
+        logMessage = str(record.msg)
+
+        # Separator line goes with the message before it
+        if logMessage.startswith(LOG_SEPARATOR):
+            return not getattr(self.localState, 'dropped', False)
+
+        if record.levelno >= logging.WARNING:
+            self.localState.dropped = False
+            return True
+
+        msgKind = message_kind(logMessage)
+        now = time.time()
+        with self.lock:
+            bucket = self.buckets.get(msgKind)
+            if bucket is None:
+                if len(self.buckets) >= MESSAGE_KIND_MAX_CNT:
+                    self.buckets.clear()
+                bucket = [self.logBurst, now, 0]
+                self.buckets[msgKind] = bucket
+
+            bucket[0] = min(self.logBurst, bucket[0] + (now - bucket[1]) * self.logRate)
+            bucket[1] = now
+            if bucket[0] < 1.0:
+                bucket[2] += 1
+                self.localState.dropped = True
+                LOG_DROPPED.inc(('rate',))
+                return False
+
+            bucket[0] -= 1.0
+            droppedCnt = bucket[2]
+            bucket[2] = 0
+
+        self.localState.dropped = False
+        if droppedCnt > 0:
+            record.msg = '%s [%d similar log record dropped]' % (record.getMessage(), droppedCnt)
+            record.args = None
+
+        return True
+
+# Put the log record on the queue, never block the caller
+class LogQueueHandler(logging.Handler):
+
+    def __init__(self, logQueue):
+        logging.Handler.__init__(self)
+        self.logQueue = logQueue
+
+    # Format the message now, the arguments may change before the listener get to it
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+    def emit(self, record):
+        try:
+            self.logQueue.put_nowait(self.prepare(record))
+        # Listener behind, drop instead of stalling the modem
+        except queue.Full:
+            LOG_DROPPED.inc(('queue',))
+        except Exception:
+            self.handleError(record)
+
+# Listener thread writing the queued log record to the real handler
+class LogQueueListener(object):
+
+    def __init__(self, logHandler, queueSize=LOG_QUEUE_SIZE):
+        self.logHandler = logHandler
+        self.logQueue = queue.Queue(queueSize)
+        self.listenThread = None
+
+    # Start the listener thread
+    def start(self):
+        self.listenThread = threading.Thread(target=self.listen_loop, name='logqueuelistener')
+        self.listenThread.daemon = True
+        self.listenThread.start()
+
+    # Listener thread, None on the queue end it
+    def listen_loop(self):
+        while True:
+            record = self.logQueue.get()
+            if record is None:
+                break
+
+            self.logHandler.handle(record)
+
+    # Write every queued record and end the listener thread, waiting at most timeOut seconds
+    def stop(self, timeOut=5.0):
+        try:
+            self.logQueue.put(None, True, timeOut)
+        except queue.Full:
+            return
+
+        self.listenThread.join(timeOut)
+        self.logHandler.flush()
@@ -0,0 +1,225 @@
+# Gateway metrics
+#
+# Counters and histograms for the modem and poll pipeline, rendered in the
+# Prometheus text exposition format by /metrics. Each thread updates its own
+# shard of a metric without taking any lock, the shards are only added up
+# when the metrics are rendered. The REST API runs every request on a new
+# thread, the shard of an ended thread is folded into the base value of the
+# metric so the shards do not pile up.
+
+import bisect
+import threading
+
+# AT command latency histogram bucket (seconds)
+AT_LATENCY_BUCKET = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Poll round trip latency histogram bucket (seconds)
+POLL_LATENCY_BUCKET = (1, 2.5, 5, 10, 15, 20, 30, 45, 60, 90, 120, 300)
+
+# Modem recovery time histogram bucket (seconds)
+RECOVERY_BUCKET = (1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# Format label set, e.g. {modem="/dev/ttyUSB0"}
+def format_labels(labelNames, labelValues, extraLabel=''):
+    labelList = ['%s="%s"' % (labelName, str(labelValue).replace('\\', '\\\\').replace('"', '\\"'))
+                 for labelName, labelValue in zip(labelNames, labelValues)]
+    if extraLabel != '':
+        labelList.append(extraLabel)
+    if len(labelList) == 0:
+        return ''
+
+    return '{' + ','.join(labelList) + '}'
+
+# Format metric value, integer value without the decimal point
+def format_value(metricValue):
+    if metricValue == int(metricValue):
+        return '%d' % (metricValue)
+
+    return repr(float(metricValue))
+
+# Metric with per thread shard
+class Metric(object):
+
+    metricType = 'untyped'
+
+    def __init__(self, metricName, metricHelp, labelNames=()):
+        self.metricName = metricName
+        self.metricHelp = metricHelp
+        self.labelNames = tuple(labelNames)
+        self.shardLock = threading.Lock()
+        # (thread, shard) of every thread still running
+        self.shardList = []
+        # Shards of the ended threads added up, label values -> value
+        self.baseValues = {}
+        self.localShard = threading.local()
+
+    # Shard of the calling thread, label values -> value
+    def shard(self):
+        try:
+            return self.localShard.values
+        except AttributeError:
+            self.localShard.values = {}
+            # Only once per thread
+            with self.shardLock:
+                self.fold_ended()
+                self.shardList.append((threading.current_thread(), self.localShard.values))
+            return self.localShard.values
+
+    # Add the shards of the ended threads to the base value, called with the lock held
+    # An ended thread never update its shard again
+    def fold_ended(self):
+        liveList = []
+        for shardThread, shardValues in self.shardList:
+            if shardThread.is_alive():
+                liveList.append((shardThread, shardValues))
+                continue
+
+            for labelValues, metricValue in shardValues.items():
+                self.baseValues[labelValues] = self.merge(self.baseValues.get(labelValues), metricValue)
+        self.shardList = liveList
+
+    # Every shard added up, label values -> value
+    def collect(self):
+        with self.shardLock:
+            self.fold_ended()
+            shardList = [shardValues for shardThread, shardValues in self.shardList]
+            totalValues = {}
+            for labelValues, metricValue in self.baseValues.items():
+                totalValues[labelValues] = self.merge(None, metricValue)
+
+        for shardValues in shardList:
+            for labelValues, metricValue in shardValues.copy().items():
+                totalValues[labelValues] = self.merge(totalValues.get(labelValues), metricValue)
+
+        return totalValues
+
+    # Text exposition format lines of the metric
+    def render(self):
+        renderLines = ['# HELP %s %s' % (self.metricName, self.metricHelp),
+                       '# TYPE %s %s' % (self.metricName, self.metricType)]
+        totalValues = self.collect()
+        for labelValues in sorted(totalValues):
+            renderLines.extend(self.render_value(labelValues, totalValues[labelValues]))
+
+        return renderLines
+
+# Monotonically increasing count
+class Counter(Metric):
+
+    metricType = 'counter'
+
+    # Add to the count of the given label values
+    def inc(self, labelValues=(), incValue=1):
+        shardValues = self.shard()
+        shardValues[labelValues] = shardValues.get(labelValues, 0) + incValue
+
+    def merge(self, totalValue, metricValue):
+        return (totalValue or 0) + metricValue
+
+    def render_value(self, labelValues, metricValue):
+        return ['%s%s %s' % (self.metricName, format_labels(self.labelNames, labelValues), format_value(metricValue))]
+
+# Current value, the last value set by any thread
+class Gauge(Metric):
+
+    metricType = 'gauge'
+
+    def __init__(self, metricName, metricHelp, labelNames=()):
+        Metric.__init__(self, metricName, metricHelp, labelNames)
+        # Shared by every thread, setting one dictionary item is atomic
+        self.values = {}
+
+    # Set the value of the given label values
+    def set(self, labelValues, metricValue):
+        self.values[labelValues] = metricValue
+
+    # Forget the value of the given label values
+    def remove(self, labelValues):
+        self.values.pop(labelValues, None)
+
+    def collect(self):
+        return self.values.copy()
+
+    def render_value(self, labelValues, metricValue):
+        return ['%s%s %s' % (self.metricName, format_labels(self.labelNames, labelValues), format_value(metricValue))]
+
+# Distribution of observed value in cumulative bucket
+class Histogram(Metric):
+
+    metricType = 'histogram'
+
+    def __init__(self, metricName, metricHelp, labelNames=(), bucketList=AT_LATENCY_BUCKET):
+        Metric.__init__(self, metricName, metricHelp, labelNames)
+        self.bucketList = tuple(sorted(bucketList))
+
+    # Add one observed value of the given label values
+    def observe(self, labelValues, metricValue):
+        shardValues = self.shard()
+        histValue = shardValues.get(labelValues)
+        if histValue is None:
+            # Count per bucket plus +Inf, then sum and count
+            histValue = [[0] * (len(self.bucketList) + 1), 0.0, 0]
+            shardValues[labelValues] = histValue
+
+        histValue[0][bisect.bisect_left(self.bucketList, metricValue)] += 1
+        histValue[1] += metricValue
+        histValue[2] += 1
+
+    def merge(self, totalValue, metricValue):
+        if totalValue is None:
+            return [list(metricValue[0]), metricValue[1], metricValue[2]]
+
+        for a in range(len(metricValue[0])):
+            totalValue[0][a] += metricValue[0][a]
+        totalValue[1] += metricValue[1]
+        totalValue[2] += metricValue[2]
+        return totalValue
+
+    def render_value(self, labelValues, metricValue):
+        renderLines = []
+        bucketCnt = 0
+
+        for bucketBound, bucketValue in zip(self.bucketList + (float('inf'),), metricValue[0]):
+            bucketCnt += bucketValue
+            if bucketBound == float('inf'):
+                bucketLabel = 'le="+Inf"'
+            else:
+                bucketLabel = 'le="%s"' % (format_value(bucketBound))
+            renderLines.append('%s_bucket%s %d' % (self.metricName, format_labels(self.labelNames, labelValues, bucketLabel), bucketCnt))
+
+        renderLines.append('%s_sum%s %s' % (self.metricName, format_labels(self.labelNames, labelValues), format_value(metricValue[1])))
+        renderLines.append('%s_count%s %d' % (self.metricName, format_labels(self.labelNames, labelValues), metricValue[2]))
+        return renderLines
+
+# Gateway metrics, rendered in this order
+AT_COMMAND_LATENCY = Histogram('gsm_at_command_duration_seconds', 'AT command latency until the final result code or prompt',
+                               ('modem', 'command'), AT_LATENCY_BUCKET)
+SERIAL_BYTES = Counter('gsm_serial_bytes_total', 'Bytes transferred over the modem serial port', ('modem', 'direction'))
+SMS_SENT = Counter('gsm_sms_sent_total', 'GPS location poll request SMS submitted', ('modem', 'result'))
+SMS_RECEIVED = Counter('gsm_sms_received_total', 'SMS message received', ('modem',))
+CMTI_BACKLOG = Gauge('gsm_cmti_backlog', 'New SMS message indication waiting to be read', ('modem',))
+GPS_REPLY = Counter('gps_reply_total', 'Complete GPS location reply received')
+POLL_TIMEOUT = Counter('gps_poll_timeout_total', 'GPS location poll request without reply before the deadline')
+DECODE_FAILURE = Counter('gps_decode_failure_total', 'SMS message or GPS location reply that could not be decoded', ('reason',))
+POLL_LATENCY = Histogram('gps_poll_round_trip_seconds', 'GPS location poll request to complete reply latency', (), POLL_LATENCY_BUCKET)
+POLL_LAST_LATENCY = Gauge('gps_poll_last_round_trip_seconds', 'Last GPS location poll round trip latency per tracker', ('gpsid',))
+LOG_DROPPED = Counter('gateway_log_dropped_total', 'Log record dropped by the rate limit or a full log queue', ('reason',))
+MODEM_UP = Gauge('gsm_modem_up', 'GSM modem initialized and answering (1) or down (0)', ('modem',))
+MODEM_REINIT = Counter('gsm_modem_reinit_total', 'GSM modem re-initialization started by the watchdog', ('modem', 'reason'))
+MODEM_RECOVERY = Histogram('gsm_modem_recovery_seconds', 'GSM modem failure detected to initialization completed',
+                           ('modem',), RECOVERY_BUCKET)
+OUTBOUND_SMS = Counter('gsm_outbound_sms_total', 'Outbound SMS message pushed through the REST API by result', ('result',))
+OUTBOUND_QUEUE = Gauge('gsm_outbound_queue_depth', 'Outbound SMS message waiting to be sent', ('modem',))
+HISTORY_DROPPED = Counter('gps_history_dropped_total', 'GPS location history record dropped before commit', ('reason',))
+
+METRIC_LIST = (AT_COMMAND_LATENCY, SERIAL_BYTES, SMS_SENT, SMS_RECEIVED, CMTI_BACKLOG, GPS_REPLY,
+               POLL_TIMEOUT, DECODE_FAILURE, POLL_LATENCY, POLL_LAST_LATENCY, LOG_DROPPED,
+               MODEM_UP, MODEM_REINIT, MODEM_RECOVERY, OUTBOUND_SMS, OUTBOUND_QUEUE, HISTORY_DROPPED)
+
+# Every gateway metric in text exposition format
+def render_metrics():
+    renderLines = []
+    for gatewayMetric in METRIC_LIST:
+        renderLines.extend(gatewayMetric.render())
+
+    return '\n'.join(renderLines) + '\n'
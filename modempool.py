@@ -0,0 +1,92 @@
+# GSM modem pool
+#
+# Each modem in the pool has its own serial port, baud rate and worker. The
+# tracker fleet is sharded across the modems with a consistent hash ring, so
+# when a modem fails only its own trackers move to the remaining modems, and
+# they move back once the modem recovers.
+
+import bisect
+import hashlib
+import threading
+
+# Virtual node count per modem on the hash ring, smooth out the tracker share
+VIRTUAL_NODE_CNT = 100
+
+# Hash value on the ring for the given key
+def ring_hash(ringKey):
+    return int(hashlib.md5(ringKey.encode('utf-8')).hexdigest()[:8], 16)
+
+# Consistent hash modem pool
+class ModemPool(object):
+
+    def __init__(self, modemList, virtualNodeCnt=VIRTUAL_NODE_CNT):
+        self.modemList = modemList
+        self.virtualNodeCnt = virtualNodeCnt
+        self.failedModem = set()
+        self.lock = threading.Lock()
+        self.ringKeys = []
+        self.ringModem = []
+        # Bumped on every ring rebuild, the tracker share only change with it
+        self.ringVersion = 0
+
+        self.build_ring()
+
+    # Rebuild the hash ring from the modems currently alive
+    def build_ring(self):
+        ringNode = []
+
+        for modemId in range(len(self.modemList)):
+            if modemId in self.failedModem:
+                continue
+            for vNode in range(self.virtualNodeCnt):
+                ringKey = '%s#%d' % (self.modemList[modemId]['port'], vNode)
+                ringNode.append((ring_hash(ringKey), modemId))
+
+        ringNode.sort()
+        self.ringKeys = [node[0] for node in ringNode]
+        self.ringModem = [node[1] for node in ringNode]
+        self.ringVersion += 1
+
+    # Number of modem in the pool
+    def modem_count(self):
+        return len(self.modemList)
+
+    # Serial setting of the given modem
+    def modem_setting(self, modemId):
+        return self.modemList[modemId]
+
+    # Modem responsible for the given tracker, None when every modem failed
+    def assign(self, gpsid):
+        with self.lock:
+            if len(self.ringKeys) == 0:
+                return None
+
+            ringIndx = bisect.bisect(self.ringKeys, ring_hash(gpsid))
+            if ringIndx == len(self.ringKeys):
+                ringIndx = 0
+
+            return self.ringModem[ringIndx]
+
+    # Trackers from the list that belong to the given modem
+    def trackers_for(self, modemId, trackerList):
+        return [gpsid for gpsid in trackerList if self.assign(gpsid) == modemId]
+
+    # Take modem out of the ring, its trackers move to the other modems
+    def mark_failed(self, modemId):
+        with self.lock:
+            if modemId in self.failedModem:
+                return False
+
+            self.failedModem.add(modemId)
+            self.build_ring()
+            return True
+
+    # Put modem back into the ring, its trackers move back to it
+    def mark_alive(self, modemId):
+        with self.lock:
+            if modemId not in self.failedModem:
+                return False
+
+            self.failedModem.discard(modemId)
+            self.build_ring()
+            return True
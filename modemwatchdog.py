@@ -0,0 +1,154 @@
+# GSM modem health watchdog
+#
+# The modem is initialised once, and a modem that reset, lost its network
+# registration or got stuck at the '>' SMS editor prompt would otherwise stop
+# every GPS location update without a trace. The watchdog follows the command
+# results and the serial traffic of one modem: several commands in a row
+# without their final result code, a modem start up indication or a failed
+# registration check mark the modem stuck, and the init sequence is run again
+# with an exponential backoff while the modem keeps failing.
+#
+# The registration check is only sent once the serial line has been quiet for
+# a while, a busy modem already proves it is alive. A USB modem that
+# re-enumerates comes back as a new device node, the serial port is then
+# opened again instead of talking to the stale one.
+
+import os
+import re
+
+# Monotonic clock for the silence and recovery time
+from monoclock import monotonic
+
+# Command in a row without final result code before the modem is taken as stuck
+FAIL_LIMIT = 3
+
+# Serial line quiet time before the modem is probed (seconds)
+IDLE_PROBE = 60
+
+# Re-initialization backoff, doubled on every failed attempt (seconds)
+BACKOFF_MIN = 1
+BACKOFF_MAX = 60
+
+# Failed re-initialization in a row before the serial port is opened again
+REOPEN_LIMIT = 3
+
+# Network registration status of the AT+CREG? reply, home network or roaming
+CREG_PATTERN = re.compile(r'\+CREG:\s*(?:\d+\s*,\s*)?(\d+)')
+CREG_REGISTERED = ('1', '5')
+
+# Registration status in the AT+CREG? reply, None when the reply has no +CREG
+def creg_registered(gsmReply):
+    cregMatch = CREG_PATTERN.search(gsmReply)
+    if cregMatch is None:
+        return None
+
+    return cregMatch.group(1) in CREG_REGISTERED
+
+# Device node identity of the serial port, change when the USB modem re-enumerates
+# None for an URL port, e.g. gsm://, or a device node that is gone
+def device_identity(portName):
+    if '://' in portName:
+        return None
+
+    try:
+        portStat = os.stat(portName)
+    except OSError:
+        return None
+
+    return (portStat.st_rdev, portStat.st_ino)
+
+# Health state of one GSM modem, used from the modem event loop thread only
+class ModemWatchdog(object):
+
+    def __init__(self, portName, failLimit=FAIL_LIMIT, idleProbe=IDLE_PROBE, backoffMin=BACKOFF_MIN,
+                 backoffMax=BACKOFF_MAX, reopenLimit=REOPEN_LIMIT, clock=monotonic):
+        self.portName = portName
+        self.failLimit = failLimit
+        self.idleProbe = idleProbe
+        self.backoffMin = backoffMin
+        self.backoffMax = backoffMax
+        self.reopenLimit = reopenLimit
+        self.clock = clock
+
+        # Command in a row without final result code
+        self.failCnt = 0
+        # Why the modem is taken as stuck, the metrics label, kept until initialized again
+        self.stuckReason = None
+        self.lastRxTime = clock()
+        # Failed initialization in a row
+        self.initFailCnt = 0
+        # Modem found down, the recovery time is measured from here
+        self.downTime = None
+        # Device node the serial port was opened on
+        self.deviceId = None
+
+    # Serial port opened, remember its device node
+    def port_opened(self):
+        self.deviceId = device_identity(self.portName)
+        self.lastRxTime = self.clock()
+
+    # Device node gone or replaced since the serial port was opened
+    def device_changed(self):
+        if self.deviceId is None:
+            return False
+
+        return device_identity(self.portName) != self.deviceId
+
+    # Serial data received from the modem
+    def data_received(self):
+        self.lastRxTime = self.clock()
+
+    # Command completed with its final result code or the deadline expired
+    def command_done(self, completed):
+        if completed:
+            self.failCnt = 0
+            return
+
+        self.failCnt += 1
+        if self.failCnt >= self.failLimit and self.stuckReason is None:
+            self.stuckReason = 'no_reply'
+
+    # Modem answer but can not work, e.g. reset or not registered, re-initialize at once
+    def mark_stuck(self, stuckReason):
+        if self.stuckReason is None:
+            self.stuckReason = stuckReason
+
+    # Modem start up indication, its settings are lost
+    def modem_reset(self):
+        self.mark_stuck('reset')
+
+    def is_stuck(self):
+        return self.stuckReason is not None
+
+    # Serial line quiet long enough to probe the modem
+    def probe_due(self):
+        return self.clock() - self.lastRxTime >= self.idleProbe
+
+    def mark_down(self):
+        if self.downTime is None:
+            self.downTime = self.clock()
+
+    # Initialization failed, return the backoff before the next attempt (seconds)
+    def init_failed(self):
+        self.mark_down()
+        self.initFailCnt += 1
+
+        return min(self.backoffMax, self.backoffMin * 2 ** (self.initFailCnt - 1))
+
+    # Initialization keep failing, open the serial port again
+    def reopen_due(self):
+        return self.initFailCnt > 0 and self.initFailCnt % self.reopenLimit == 0
+
+    # Initialization completed, return the recovery time (seconds), None when the modem was not down
+    def init_done(self):
+        recoveryTime = None
+        if self.downTime is not None:
+            recoveryTime = self.clock() - self.downTime
+
+        self.downTime = None
+        self.failCnt = 0
+        self.stuckReason = None
+        self.initFailCnt = 0
+        self.lastRxTime = self.clock()
+
+        return recoveryTime
@@ -0,0 +1,36 @@
+# Monotonic clock
+#
+# Deadlines and intervals are measured with a clock not affected by system
+# clock adjustment. Python 3.3 and above use time.monotonic(), Python 2 read
+# CLOCK_MONOTONIC through clock_gettime() on Linux, and time.time() is used
+# in all other cases, same as serial.serialutil.Timeout.
+
+import time
+
+if hasattr(time, 'monotonic'):
+    monotonic = time.monotonic
+else:
+    try:
+        import ctypes
+        import ctypes.util
+
+        CLOCK_MONOTONIC = 1
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1', use_errno=True)
+        clock_gettime = librt.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+        # Seconds from an arbitrary start point, never go backward
+        def monotonic():
+            timeSpec = timespec()
+            if clock_gettime(CLOCK_MONOTONIC, ctypes.pointer(timeSpec)) != 0:
+                raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+            return timeSpec.tv_sec + timeSpec.tv_nsec * 1e-9
+
+        monotonic()
+    # No clock_gettime() on this platform
+    except (ImportError, OSError, AttributeError):
+        monotonic = time.time
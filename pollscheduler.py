@@ -0,0 +1,200 @@
+# GPS location poll scheduler
+#
+# WHERE# requests are sent to many trackers back-to-back, up to a limit of
+# outstanding polls. Replies are matched by the sender number as they arrive,
+# so the poll sweep is limited by the modem send rate instead of the reply
+# latency of the slowest tracker.
+#
+# Each tracker is kept in a heap ordered by the time its next poll is due.
+# The poll interval follows the tracker movement from its last GPS location,
+# a fast moving or turning tracker is polled at the minimum interval and a
+# parked tracker at the maximum interval. A tracker that does not reply is
+# retried at the minimum interval, backing off up to the maximum interval.
+#
+# Every outstanding poll carries an absolute reply deadline on the monotonic
+# clock, kept in a second heap, so a time out is found by looking at the
+# earliest deadline only.
+
+import heapq
+
+# Monotonic clock for the poll due time and reply deadline
+from monoclock import monotonic
+
+# Speed polled at the minimum interval, slower tracker are polled less often (km/h)
+FAST_SPEED = 80.0
+
+# Course change polled at the minimum interval, smaller turn are polled less often (degree)
+SHARP_TURN = 90.0
+
+# Poll interval between the minimum and maximum interval from the tracker movement
+def movement_interval(minInterval, maxInterval, speed, courseChange):
+    urgency = max(min(speed / FAST_SPEED, 1.0), min(courseChange / SHARP_TURN, 1.0))
+
+    return maxInterval - (maxInterval - minInterval) * urgency
+
+# Poll scheduler for one tracker list
+class PollScheduler(object):
+
+    # pollTimeOut, minInterval and maxInterval in seconds
+    def __init__(self, maxOutstanding, pollTimeOut, minInterval, maxInterval, clock=monotonic):
+        self.maxOutstanding = maxOutstanding
+        self.pollTimeOut = pollTimeOut
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.clock = clock
+        # (due time, cell phone no.), entry not matching dueTime are stale
+        self.dueHeap = []
+        # Tracker waiting for its next poll, cell phone no. -> due time
+        self.dueTime = {}
+        # Outstanding poll request, cell phone no. -> reply deadline
+        self.outstanding = {}
+        # (reply deadline, cell phone no.), entry not matching outstanding are stale
+        self.deadlineHeap = []
+        # Last known course, cell phone no. -> degree
+        self.lastCourse = {}
+        # Poll request without reply in a row, cell phone no. -> count
+        self.missCnt = {}
+        # Message reference of the last poll request sent, cell phone no. -> +CMGS reference
+        self.msgRef = {}
+
+    # Schedule the next poll of the tracker after the given delay
+    def schedule(self, cellPhoneNo, pollDelay):
+        dueTime = self.clock() + pollDelay
+        self.dueTime[cellPhoneNo] = dueTime
+        heapq.heappush(self.dueHeap, (dueTime, cellPhoneNo))
+
+    # Replace the list of trackers to be polled, new tracker are due at once
+    def set_trackers(self, trackerList):
+        trackerSet = set(trackerList)
+
+        for cellPhoneNo in trackerList:
+            if cellPhoneNo not in self.dueTime and cellPhoneNo not in self.outstanding:
+                self.schedule(cellPhoneNo, 0)
+
+        # Forget tracker no longer in the list, its heap entry become stale
+        for trackerDict in (self.dueTime, self.outstanding, self.lastCourse, self.missCnt, self.msgRef):
+            for cellPhoneNo in list(trackerDict):
+                if cellPhoneNo not in trackerSet:
+                    del trackerDict[cellPhoneNo]
+
+        # Drop the stale heap entries once they outnumber the scheduled trackers
+        if len(self.dueHeap) > 2 * len(self.dueTime) + 16:
+            self.dueHeap = [(dueTime, cellPhoneNo) for cellPhoneNo, dueTime in self.dueTime.items()]
+            heapq.heapify(self.dueHeap)
+        if len(self.deadlineHeap) > 2 * len(self.outstanding) + 16:
+            self.deadlineHeap = [(deadline, cellPhoneNo) for cellPhoneNo, deadline in self.outstanding.items()]
+            heapq.heapify(self.deadlineHeap)
+
+    # Get the next tracker due for polling, None when nothing due or no more poll request allowed
+    def next_tracker(self):
+        if len(self.outstanding) >= self.maxOutstanding:
+            return None
+
+        now = self.clock()
+        while len(self.dueHeap) > 0:
+            dueTime, cellPhoneNo = self.dueHeap[0]
+            # Stale entry, tracker rescheduled or removed
+            if self.dueTime.get(cellPhoneNo) != dueTime:
+                heapq.heappop(self.dueHeap)
+                continue
+            # Earliest tracker not due yet
+            if dueTime > now:
+                return None
+
+            heapq.heappop(self.dueHeap)
+            del self.dueTime[cellPhoneNo]
+            return cellPhoneNo
+
+        return None
+
+    # Poll request sent, start waiting for the reply until the deadline
+    # msgRef is the +CMGS message reference, to match the poll with its reply and delivery report
+    def mark_sent(self, cellPhoneNo, msgRef=None):
+        deadline = self.clock() + self.pollTimeOut
+        self.outstanding[cellPhoneNo] = deadline
+        heapq.heappush(self.deadlineHeap, (deadline, cellPhoneNo))
+        self.msgRef[cellPhoneNo] = msgRef
+
+    # Message reference of the last poll request sent to the tracker, None when unknown
+    def message_reference(self, cellPhoneNo):
+        return self.msgRef.get(cellPhoneNo)
+
+    # Poll request could not be sent, retry at the minimum interval
+    def send_failed(self, cellPhoneNo):
+        self.schedule(cellPhoneNo, self.minInterval)
+
+    # Reply received, schedule the next poll from the tracker movement
+    # Return the poll round trip (seconds), None for reply without any poll request
+    def mark_replied(self, cellPhoneNo, gpsFix=None):
+        if cellPhoneNo not in self.outstanding:
+            return None
+
+        roundTrip = self.clock() - (self.outstanding.pop(cellPhoneNo) - self.pollTimeOut)
+        self.missCnt.pop(cellPhoneNo, None)
+        self.schedule(cellPhoneNo, self.fix_interval(cellPhoneNo, gpsFix))
+        return roundTrip
+
+    # Poll interval from the tracker speed and course change
+    def fix_interval(self, cellPhoneNo, gpsFix):
+        if gpsFix is None:
+            return self.minInterval
+
+        speed = gpsFix.speed
+        course = gpsFix.course
+        lastCourse = self.lastCourse.get(cellPhoneNo)
+        if course is not None:
+            self.lastCourse[cellPhoneNo] = course
+
+        # Movement unknown, keep a close watch
+        if speed is None:
+            return self.minInterval
+
+        courseChange = 0.0
+        if course is not None and lastCourse is not None:
+            courseChange = abs(course - lastCourse) % 360.0
+            if courseChange > 180.0:
+                courseChange = 360.0 - courseChange
+
+        return movement_interval(self.minInterval, self.maxInterval, speed, courseChange)
+
+    # Return the trackers whose reply deadline expired
+    def tick(self):
+        timeOutList = []
+
+        now = self.clock()
+        while len(self.deadlineHeap) > 0 and self.deadlineHeap[0][0] <= now:
+            deadline, cellPhoneNo = heapq.heappop(self.deadlineHeap)
+            # Stale entry, tracker replied or removed
+            if self.outstanding.get(cellPhoneNo) != deadline:
+                continue
+
+            del self.outstanding[cellPhoneNo]
+            timeOutList.append(cellPhoneNo)
+
+            # Stale GPS location, retry soon and back off while the tracker stay silent
+            self.missCnt[cellPhoneNo] = self.missCnt.get(cellPhoneNo, 0) + 1
+            self.schedule(cellPhoneNo, min(self.minInterval * (2 ** (self.missCnt[cellPhoneNo] - 1)), self.maxInterval))
+
+        return timeOutList
+
+    # Earliest time a poll become due or a reply deadline expire, None when nothing scheduled
+    # The due time is left out while no more poll request allowed, only a reply or time out free a slot
+    def next_event_time(self):
+        eventTime = None
+
+        if len(self.outstanding) < self.maxOutstanding and len(self.dueHeap) > 0:
+            eventTime = self.dueHeap[0][0]
+        if len(self.deadlineHeap) > 0 and (eventTime is None or self.deadlineHeap[0][0] < eventTime):
+            eventTime = self.deadlineHeap[0][0]
+
+        return eventTime
+
+    # Drop every outstanding poll request, every tracker are due again
+    def reset(self):
+        self.dueHeap = []
+        self.dueTime = {}
+        self.outstanding = {}
+        self.deadlineHeap = []
+        self.lastCourse = {}
+        self.missCnt = {}
+        self.msgRef = {}
@@ -0,0 +1,60 @@
+# Pre-serialized REST API response cache
+#
+# Keep the JSON body of a response together with the data version it was
+# built from. The body, its ETag and its gzip copy are built once per data
+# version, every request in between is served from the cached bytes.
+
+import hashlib
+import json
+import threading
+import zlib
+
+# gzip compression level of the cached body
+GZIP_LEVEL = 6
+
+# Compress data in gzip format
+def gzip_data(rawData):
+    # wbits 16 + 15, gzip header and trailer
+    gzipComp = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return gzipComp.compress(rawData) + gzipComp.flush()
+
+# Serialize JSON body the same way as Flask jsonify
+def serialize_json(jsonData):
+    return (json.dumps(jsonData, sort_keys=True, separators=(',', ':')) + '\n').encode('utf-8')
+
+# Cached response body of versioned data
+class ResponseCache(object):
+
+    # versionFunc return the current data version
+    # snapshotFunc return the data version together with the response JSON data
+    def __init__(self, versionFunc, snapshotFunc):
+        self.versionFunc = versionFunc
+        self.snapshotFunc = snapshotFunc
+        self.lock = threading.Lock()
+        self.version = None
+        self.body = None
+        self.etag = None
+        self.gzipBody = None
+
+    # Rebuild the body after the data changed, called with the lock held
+    def refresh(self):
+        if self.version != self.versionFunc():
+            self.version, jsonData = self.snapshotFunc()
+            self.body = serialize_json(jsonData)
+            self.etag = hashlib.md5(self.body).hexdigest()
+            self.gzipBody = None
+
+    # ETag and body of the current data version
+    def get(self):
+        with self.lock:
+            self.refresh()
+            return self.etag, self.body
+
+    # ETag and gzip body of the current data version, compressed once per version
+    # The gzip body is a different representation, so it has its own ETag
+    def get_gzip(self):
+        with self.lock:
+            self.refresh()
+            if self.gzipBody is None:
+                self.gzipBody = gzip_data(self.body)
+            return self.etag + '-gzip', self.gzipBody
@@ -0,0 +1,606 @@
+#! python
+#
+# This module implements a GSM modem emulator with simulated GPS vehicle
+# trackers behind it, for testing and load testing the GPS SMS gateway
+# without a physical modem.
+#
+# The emulator understands the AT command set used by the gateway: AT, CNMI,
+# CPMS, CSAS, CREG, CMGF, CMGS, CMGR, CMGL, CMGD and CMGDA, in text mode and
+# PDU mode. Every number an SMS message is sent to is a simulated tracker, which
+# answers WHERE# with its GPS location after the configured latency. The
+# reply is split into several SMS messages, delivered with +CMTI (stored)
+# or +CMT (direct, PDU mode) depending on AT+CNMI. The modem may reset
+# periodically: it stops answering for a while, then comes back with RDY and
+# its power on settings, to exercise the gateway modem watchdog.
+#
+# This file is part of pySerial. https://github.com/pyserial/pyserial
+#
+# SPDX-License-Identifier:    BSD-3-Clause
+#
+# URL format:    gsm://[?option[=value][&option[=value]]]
+# options:
+# - "latency=2.0"     mean tracker reply latency in seconds
+# - "jitter=0.5"      reply latency varies uniformly by +/- this many seconds
+# - "loss=0.0"        probability that a tracker does not reply at all
+# - "split=2"         minimum number of SMS message per reply
+# - "reorder=0.0"     probability that the reply parts arrive in reverse order
+# - "moving=0.5"      fraction of trackers driving, the others are parked
+# - "storage=255"     SIM card SMS storage capacity, messages are lost when full
+# - "sendtime=0.0"    time the network takes to accept a submitted SMS message
+# - "reset=0"         seconds between modem resets, 0 never resets
+# - "resettime=5.0"   seconds the modem does not answer during a reset
+# - "seed=N"          random seed, for repeatable runs
+# - "logging={debug|info|warning|error}"
+#
+# example:
+#   gsm://?latency=5&jitter=2&loss=0.01
+
+from __future__ import absolute_import
+
+import binascii
+import heapq
+import logging
+import math
+import numbers
+import random
+import threading
+import time
+try:
+    import urlparse
+except ImportError:
+    import urllib.parse as urlparse
+
+from serial.serialutil import SerialBase, SerialException, to_bytes, PortNotOpenError
+
+# map log level names to constants. used in from_url()
+LOGGER_LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+}
+
+# option name -> (type, default value)
+OPTIONS = {
+    'latency': (float, 2.0),
+    'jitter': (float, 0.5),
+    'loss': (float, 0.0),
+    'split': (int, 2),
+    'reorder': (float, 0.0),
+    'moving': (float, 0.5),
+    'storage': (int, 255),
+    'sendtime': (float, 0.0),
+    'reset': (float, 0.0),
+    'resettime': (float, 5.0),
+    'seed': (int, None),
+}
+
+CTRL_Z = b'\x1a'
+ESCAPE = b'\x1b'
+
+# UCS2 characters per concatenated SMS message part
+UCS2_PART_CHARS = 67
+
+# delay between the parts of one tracker reply
+PART_GAP = 0.1
+
+
+def ucs2_hex(text):
+    """Text as UCS2 hex digits, as shown by a modem in text mode"""
+    return binascii.hexlify(text.encode('utf-16-be')).decode('ascii').upper()
+
+
+def semi_octets(digits):
+    """Digits in swapped nibble order, padded with F"""
+    if len(digits) % 2:
+        digits += 'F'
+    return ''.join(digits[i + 1] + digits[i] for i in range(0, len(digits), 2))
+
+
+def unpack_septets(data, count):
+    """Unpack GSM 7 bit packed septets"""
+    septets = []
+    bits = 0
+    bit_count = 0
+    for octet in bytearray(data):
+        bits |= octet << bit_count
+        bit_count += 8
+        while bit_count >= 7:
+            septets.append(bits & 0x7f)
+            bits >>= 7
+            bit_count -= 7
+    return septets[:count]
+
+
+def decode_submit_pdu(pdu_hex):
+    """\
+    Extract destination number and text from an SMS-SUBMIT PDU. Only the
+    GSM 7 bit characters shared with ASCII are decoded, enough for WHERE#.
+    """
+    pdu = bytearray(binascii.unhexlify(pdu_hex.strip()))
+    i = pdu[0] + 1                      # skip service center address
+    first_octet = pdu[i]
+    i += 2                              # first octet, message reference
+    addr_len = pdu[i]
+    addr_type = pdu[i + 1]
+    addr = binascii.hexlify(bytes(pdu[i + 2:i + 2 + (addr_len + 1) // 2])).decode('ascii').upper()
+    number = ''.join(addr[j + 1] + addr[j] for j in range(0, len(addr), 2)).rstrip('F')
+    if addr_type & 0x70 == 0x10:
+        number = '+' + number
+    i += 2 + (addr_len + 1) // 2
+    dcs = pdu[i + 1]
+    i += 2                              # protocol identifier, data coding scheme
+    vp_format = (first_octet >> 3) & 0x03
+    i += {0: 0, 2: 1}.get(vp_format, 7)
+    udl = pdu[i]
+    user_data = bytes(pdu[i + 1:])
+    if dcs & 0x0c == 0x08:
+        text = user_data[:udl].decode('utf-16-be', 'replace')
+    elif dcs & 0x0c == 0x04:
+        text = user_data[:udl].decode('latin-1')
+    else:
+        text = ''.join(chr(s) for s in unpack_septets(user_data, udl))
+    return number, text
+
+
+def encode_deliver_pdu(sender, text, timestamp, concat=None):
+    """\
+    SMS-DELIVER PDU in UCS2, without service center address. concat is
+    (reference, total, sequence) for a part of a concatenated message.
+    """
+    digits = sender.lstrip('+')
+    addr_type = '91' if sender.startswith('+') else '81'
+    user_data = ucs2_hex(text)
+    first_octet = 0x04
+    if concat is not None:
+        first_octet |= 0x40
+        user_data = '050003{:02X}{:02X}{:02X}'.format(concat[0] & 0xff, concat[1], concat[2]) + user_data
+    stamp = time.strftime('%y%m%d%H%M%S', time.gmtime(timestamp)) + '00'
+    tpdu = '{:02X}{:02X}{}{}0008{}{:02X}{}'.format(
+        first_octet, len(digits), addr_type, semi_octets(digits),
+        semi_octets(stamp), len(user_data) // 2, user_data)
+    return '00' + tpdu
+
+
+class Tracker(object):
+    """Simulated GPS vehicle tracker, drives around at a constant speed or stays parked"""
+
+    def __init__(self, rng, moving):
+        self.latitude = 3.0 + rng.uniform(-0.5, 0.5)
+        self.longitude = 101.5 + rng.uniform(-0.5, 0.5)
+        self.course = rng.uniform(0, 360)
+        self.speed = rng.uniform(20, 110) if rng.random() < moving else 0.0
+        self.last_update = time.time()
+
+    def position(self, rng):
+        """Advance the position to now and return the WHERE# reply text"""
+        now = time.time()
+        if self.speed > 0:
+            self.course = (self.course + rng.uniform(-30, 30)) % 360
+            distance = self.speed * (now - self.last_update) / 3600.0 / 111.0    # degree
+            self.latitude += distance * math.cos(math.radians(self.course))
+            self.longitude += distance * math.sin(math.radians(self.course))
+        self.last_update = now
+        return 'Current position!Lat:{}{:.5f},Lon:{}{:.5f},Course:{:.2f},Speed:{:.2f},DateTime:{}'.format(
+            'N' if self.latitude >= 0 else 'S', abs(self.latitude),
+            'E' if self.longitude >= 0 else 'W', abs(self.longitude),
+            self.course, self.speed, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now)))
+
+
+class Serial(SerialBase):
+    """Serial port implementation that emulates a GSM modem with GPS trackers behind it."""
+
+    BAUDRATES = (50, 75, 110, 134, 150, 200, 300, 600, 1200, 1800, 2400, 4800,
+                 9600, 19200, 38400, 57600, 115200)
+
+    def __init__(self, *args, **kwargs):
+        self.logger = None
+        self.options = {}
+        self.rng = None
+        self._lock = threading.Condition()
+        self._rx_buffer = bytearray()       # modem -> application
+        self._line = bytearray()            # application -> modem, current command line
+        self._sms_editor = None             # pending AT+CMGS destination or PDU length
+        self._events = []                   # (due time, sequence, callback, arguments)
+        self._event_seq = 0
+        self._event_thread = None
+        self.trackers = {}
+        self.storage = {}                   # index -> [status, sender, timestamp, text, concat]
+        self.pdu_mode = False
+        self.cnmi_mt = 0
+        self.message_reference = 0
+        self.concat_reference = 0
+        self._down_until = 0                # modem does not answer until this time, during a reset
+        # counters for load testing
+        self.stats = {'sent': 0, 'replied': 0, 'lost': 0, 'delivered': 0, 'overflow': 0, 'reset': 0}
+        super(Serial, self).__init__(*args, **kwargs)
+
+    def open(self):
+        """\
+        Open port with current settings. This may throw a SerialException
+        if the port cannot be opened.
+        """
+        if self.is_open:
+            raise SerialException("Port is already open.")
+        if self._port is None:
+            raise SerialException("Port must be configured before it can be used.")
+        self.from_url(self.port)
+        self.rng = random.Random(self.options['seed'])
+        self._reconfigure_port()
+        self.is_open = True
+        if self.options['reset'] > 0:
+            with self._lock:
+                self._schedule(self.options['reset'], self._reset)
+        self._event_thread = threading.Thread(target=self._event_loop, name='gsm-emulator')
+        self._event_thread.daemon = True
+        self._event_thread.start()
+
+    def close(self):
+        if self.is_open:
+            with self._lock:
+                self.is_open = False
+                self._lock.notify_all()
+        super(Serial, self).close()
+
+    def _reconfigure_port(self):
+        """Set communication parameters on opened port, all settings are ignored"""
+        if not isinstance(self._baudrate, numbers.Integral) or not 0 < self._baudrate < 2 ** 32:
+            raise ValueError("invalid baudrate: {!r}".format(self._baudrate))
+
+    def from_url(self, url):
+        """extract the emulator options from an URL string"""
+        parts = urlparse.urlsplit(url)
+        if parts.scheme != "gsm":
+            raise SerialException(
+                'expected a string in the form "gsm://[?option[=value][&option[=value]]]": '
+                'not starting with gsm:// ({!r})'.format(parts.scheme))
+        self.options = dict((name, default) for name, (kind, default) in OPTIONS.items())
+        try:
+            for option, values in urlparse.parse_qs(parts.query, True).items():
+                if option == 'logging':
+                    logging.basicConfig()
+                    self.logger = logging.getLogger('pySerial.gsm')
+                    self.logger.setLevel(LOGGER_LEVELS[values[0]])
+                    self.logger.debug('enabled logging')
+                elif option in OPTIONS:
+                    self.options[option] = OPTIONS[option][0](values[0])
+                else:
+                    raise ValueError('unknown option: {!r}'.format(option))
+        except (KeyError, ValueError) as e:
+            raise SerialException(
+                'expected a string in the form "gsm://[?option[=value][&option[=value]]]": {}'.format(e))
+
+    #  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -
+
+    @property
+    def in_waiting(self):
+        """Return the number of bytes currently in the input buffer."""
+        if not self.is_open:
+            raise PortNotOpenError()
+        return len(self._rx_buffer)
+
+    def read(self, size=1):
+        """\
+        Read size bytes from the emulated modem. If a timeout is set it may
+        return less characters as requested. With no timeout it will block
+        until the requested number of bytes is read.
+        """
+        if not self.is_open:
+            raise PortNotOpenError()
+        deadline = None if self._timeout is None else time.time() + self._timeout
+        with self._lock:
+            while len(self._rx_buffer) < size and self.is_open:
+                if deadline is None:
+                    self._lock.wait()
+                    continue
+                time_left = deadline - time.time()
+                if time_left <= 0:
+                    break
+                self._lock.wait(time_left)
+            data = bytes(self._rx_buffer[:size])
+            del self._rx_buffer[:size]
+        return data
+
+    def write(self, data):
+        """Feed the given byte string to the emulated modem command interpreter."""
+        if not self.is_open:
+            raise PortNotOpenError()
+        data = to_bytes(data)
+        with self._lock:
+            for byte in bytearray(data):
+                self._feed(byte)
+        return len(data)
+
+    def reset_input_buffer(self):
+        """Clear input buffer, discarding all that is in the buffer."""
+        if not self.is_open:
+            raise PortNotOpenError()
+        with self._lock:
+            del self._rx_buffer[:]
+
+    def reset_output_buffer(self):
+        """Nothing is buffered on the way to the emulated modem."""
+        if not self.is_open:
+            raise PortNotOpenError()
+
+    @property
+    def out_waiting(self):
+        """Return how many bytes the in the outgoing buffer"""
+        return 0
+
+    def _update_break_state(self):
+        pass
+
+    def _update_rts_state(self):
+        pass
+
+    def _update_dtr_state(self):
+        pass
+
+    @property
+    def cts(self):
+        return True
+
+    @property
+    def dsr(self):
+        return True
+
+    @property
+    def ri(self):
+        return False
+
+    @property
+    def cd(self):
+        return True
+
+    # - - - modem emulation, called with the lock held - - -
+
+    def _emit(self, text):
+        """Queue modem output for the application"""
+        self._rx_buffer += text.encode('latin-1')
+        self._lock.notify_all()
+
+    def _schedule(self, delay, callback, *args):
+        """Run callback after delay seconds in the event thread"""
+        self._event_seq += 1
+        heapq.heappush(self._events, (time.time() + delay, self._event_seq, callback, args))
+        self._lock.notify_all()
+
+    def _event_loop(self):
+        """Deliver the delayed modem output and tracker replies when due"""
+        with self._lock:
+            while self.is_open:
+                now = time.time()
+                if self._events and self._events[0][0] <= now:
+                    due, seq, callback, args = heapq.heappop(self._events)
+                    callback(*args)
+                elif self._events:
+                    self._lock.wait(self._events[0][0] - now)
+                else:
+                    self._lock.wait(1.0)
+
+    def _feed(self, byte):
+        """Process one byte written by the application"""
+        if time.time() < self._down_until:
+            return
+        char = bytes(bytearray([byte]))
+        if self._sms_editor is not None:
+            if char == CTRL_Z:
+                self._submit(self._line.decode('latin-1'))
+                self._line = bytearray()
+            elif char == ESCAPE:
+                self._sms_editor = None
+                self._line = bytearray()
+                self._emit('\r\nOK\r\n')
+            else:
+                self._line += char
+            return
+        if char == b'\r':
+            line = self._line.decode('latin-1').strip()
+            self._line = bytearray()
+            if line:
+                self._command_line(line)
+        elif char == ESCAPE:
+            # no SMS editor open, the command line is abandoned
+            self._line = bytearray()
+        elif char != b'\n':
+            self._line += char
+
+    def _command_line(self, line):
+        """Execute one AT command line, commands may be chained with ';'"""
+        if self.logger:
+            self.logger.debug('command {!r}'.format(line))
+        if not line.upper().startswith('AT'):
+            self._emit('\r\nERROR\r\n')
+            return
+        commands = line[2:].split(';')
+        replies = []
+        for command in commands:
+            command = command.strip()
+            if command.startswith('+CMGS='):
+                # opens the SMS editor, only allowed as the last command
+                self._sms_editor = command[6:].strip('"')
+                self._emit(''.join(replies) + '\r\n> ')
+                return
+            reply = self._command(command)
+            if reply is None:
+                self._emit(''.join(replies) + '\r\nERROR\r\n')
+                return
+            replies.append(reply)
+        self._emit(''.join(replies) + '\r\nOK\r\n')
+
+    def _command(self, command):
+        """Execute one command, return the information text or None for ERROR"""
+        name, _, value = command.partition('=')
+        name = name.upper()
+        if name in ('', 'E0', 'E1', '+CSAS', '+CSCS', '+CREG'):
+            return ''
+        if name == '+CREG?':
+            # registered, home network
+            return '\r\n+CREG: 0,1\r\n'
+        if name == '+CMGF':
+            if value not in ('0', '1'):
+                return None
+            self.pdu_mode = value == '0'
+            return ''
+        if name == '+CNMI':
+            try:
+                self.cnmi_mt = int(value.split(',')[1])
+            except (IndexError, ValueError):
+                return None
+            return ''
+        if name == '+CPMS':
+            used = len(self.storage)
+            total = self.options['storage']
+            return '\r\n+CPMS: {0},{1},{0},{1},{0},{1}\r\n'.format(used, total)
+        if name == '+CMGR':
+            return self._read_message(value)
+        if name == '+CMGL':
+            return self._list_messages(value)
+        if name == '+CMGD':
+            try:
+                index = int(value.split(',')[0])
+            except ValueError:
+                return None
+            self.storage.pop(index, None)
+            return ''
+        if name == '+CMGDA':
+            self.storage.clear()
+            return ''
+        return None
+
+    def _stored_entry(self, index, entry):
+        """Header and contents line of a stored message for AT+CMGR/AT+CMGL"""
+        status, sender, timestamp, text, concat = entry
+        if self.pdu_mode:
+            pdu = encode_deliver_pdu(sender, text, timestamp, concat)
+            header = '{},,{}'.format(0 if status == 'REC UNREAD' else 1, len(pdu) // 2 - 1)
+            return header, pdu
+        stamp = time.strftime('%y/%m/%d,%H:%M:%S+00', time.gmtime(timestamp))
+        return '"{}","{}","","{}"'.format(status, sender, stamp), ucs2_hex(text)
+
+    def _read_message(self, value):
+        try:
+            index = int(value)
+        except ValueError:
+            return None
+        entry = self.storage.get(index)
+        if entry is None:
+            return None
+        header, contents = self._stored_entry(index, entry)
+        entry[0] = 'REC READ'
+        return '\r\n+CMGR: {}\r\n{}\r\n'.format(header, contents)
+
+    def _list_messages(self, value):
+        value = value.strip('"').upper()
+        if value in ('0', 'REC UNREAD'):
+            wanted = ('REC UNREAD',)
+        elif value in ('4', 'ALL'):
+            wanted = ('REC UNREAD', 'REC READ')
+        elif value in ('1', 'REC READ'):
+            wanted = ('REC READ',)
+        else:
+            return None
+        lines = []
+        for index in sorted(self.storage):
+            entry = self.storage[index]
+            if entry[0] in wanted:
+                header, contents = self._stored_entry(index, entry)
+                lines.append('\r\n+CMGL: {},{}\r\n{}'.format(index, header, contents))
+                entry[0] = 'REC READ'
+        return ''.join(lines) + ('\r\n' if lines else '')
+
+    def _submit(self, body):
+        """SMS message text (text mode) or PDU (PDU mode) completed with ctrl-Z"""
+        destination = self._sms_editor
+        self._sms_editor = None
+        try:
+            if self.pdu_mode:
+                destination, text = decode_submit_pdu(body)
+            else:
+                text = body
+        except (ValueError, TypeError, IndexError, binascii.Error):
+            self._emit('\r\n+CMS ERROR: 304\r\n')
+            return
+        self.message_reference = (self.message_reference + 1) % 256
+        self._schedule(self.options['sendtime'], self._emit,
+                       '\r\n+CMGS: {}\r\n\r\nOK\r\n'.format(self.message_reference))
+        self.stats['sent'] += 1
+        if 'WHERE#' in text.upper():
+            self._tracker_reply(destination)
+
+    def _reset(self):
+        """Modem reset: no answer for a while, then RDY and the power on settings"""
+        self._sms_editor = None
+        self._line = bytearray()
+        del self._rx_buffer[:]
+        self.pdu_mode = False
+        self.cnmi_mt = 0
+        self._down_until = time.time() + self.options['resettime']
+        self.stats['reset'] += 1
+        if self.logger:
+            self.logger.info('modem reset')
+        self._schedule(self.options['resettime'], self._emit, '\r\nRDY\r\n')
+        self._schedule(self.options['resettime'] + self.options['reset'], self._reset)
+
+    def _tracker_reply(self, number):
+        """Schedule the GPS location reply of the simulated tracker"""
+        if self.rng.random() < self.options['loss']:
+            self.stats['lost'] += 1
+            return
+        tracker = self.trackers.get(number)
+        if tracker is None:
+            tracker = self.trackers[number] = Tracker(self.rng, self.options['moving'])
+        text = tracker.position(self.rng)
+        count = max(self.options['split'], int(math.ceil(len(text) / float(UCS2_PART_CHARS))), 1)
+        size = int(math.ceil(len(text) / float(count)))
+        parts = [text[i * size:(i + 1) * size] for i in range(count)]
+        self.concat_reference = (self.concat_reference + 1) % 256
+        order = list(range(count))
+        if self.rng.random() < self.options['reorder']:
+            order.reverse()
+        delay = max(0.0, self.options['latency'] + self.rng.uniform(-self.options['jitter'], self.options['jitter']))
+        for n, seq in enumerate(order):
+            concat = (self.concat_reference, count, seq + 1) if count > 1 else None
+            self._schedule(delay + n * PART_GAP, self._deliver, number, parts[seq], concat)
+        self.stats['replied'] += 1
+
+    def _deliver(self, sender, text, concat):
+        """Incoming SMS message from a tracker, store it or deliver it directly"""
+        timestamp = time.time()
+        if self.cnmi_mt == 2:
+            if self.pdu_mode:
+                pdu = encode_deliver_pdu(sender, text, timestamp, concat)
+                self._emit('\r\n+CMT: ,{}\r\n{}\r\n'.format(len(pdu) // 2 - 1, pdu))
+            else:
+                stamp = time.strftime('%y/%m/%d,%H:%M:%S+00', time.gmtime(timestamp))
+                self._emit('\r\n+CMT: "{}","","{}"\r\n{}\r\n'.format(sender, stamp, ucs2_hex(text)))
+            self.stats['delivered'] += 1
+            return
+        for index in range(1, self.options['storage'] + 1):
+            if index not in self.storage:
+                self.storage[index] = ['REC UNREAD', sender, timestamp, text, concat]
+                self.stats['delivered'] += 1
+                if self.cnmi_mt == 1:
+                    self._emit('\r\n+CMTI: "SM",{}\r\n'.format(index))
+                return
+        self.stats['overflow'] += 1
+        if self.logger:
+            self.logger.warning('SMS storage full, message from {} lost'.format(sender))
+
+
+# simple client test
+if __name__ == '__main__':
+    import sys
+    s = Serial('gsm://?latency=0.2&jitter=0')
+    sys.stdout.write('{}\n'.format(s))
+    s.timeout = 0.5
+    for command in (b'AT\r', b'AT+CMGF=1\r', b'AT+CNMI=1,1,0,0,0\r', b'AT+CMGS="+60123456789"\r'):
+        s.write(command)
+        sys.stdout.write('{!r}\n'.format(s.read(100)))
+    s.write(b'WHERE#\x1a')
+    sys.stdout.write('{!r}\n'.format(s.read(100)))
+    time.sleep(0.5)
+    s.write(b'AT+CMGL="REC UNREAD"\r')
+    sys.stdout.write('{!r}\n'.format(s.read(2000)))
+    s.close()
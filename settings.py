@@ -1,4 +1,30 @@
 serialport = "/dev/ttyUSB0"
 baudrate = 9600
-pollinterval = 10
-polltimeout = 12
+polltimeout = 90
+atcmdtimeout = 5
+smssendtimeout = 30
+maxoutstandingpoll = 10
+modempool = [
+    {'port' : serialport, 'baudrate' : baudrate},
+    # GSM modem emulator with simulated GPS trackers, for testing without a modem
+    #{'port' : 'gsm://?latency=5&jitter=2&loss=0.01', 'baudrate' : baudrate},
+]
+smspdumode = False
+smsbatchdelete = True
+historydb = "/sources/common/sourcecode/GSM-Gateway/gpshistory.db"
+gzipresponse = True
+minpollinterval = 30
+maxpollinterval = 600
+trackerlistfile = "/sources/common/sourcecode/GSM-Gateway/gpstracker.list"
+countrycode = "60"
+trackerlistwatch = 5
+logqueuesize = 10000
+lograte = 20
+logburst = 100
+modemfaillimit = 3
+modemidleprobe = 60
+reinitbackoffmin = 1
+reinitbackoffmax = 60
+smsqueuesize = 10000
+smssendrate = 0
+smssendburst = 5
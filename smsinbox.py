@@ -0,0 +1,106 @@
+# SMS inbox reader
+#
+# Parse the SMS message read back from the modem storage, every unread
+# message at once with AT+CMGL, in text mode (AT+CMGF=1) or PDU mode
+# (AT+CMGF=0).
+#
+# AT+CMGL lists the message by storage index, and a storage index freed by
+# AT+CMGD is taken again by the next message, so the list is not in arrival
+# order. Text mode message parts carry no sequence no., they are put back in
+# order of service centre time stamp, then +CMTI arrival.
+
+import binascii
+
+from smspdu import decode_deliver_pdu
+from smspdu import SmsDeliver
+from smspdu import SmsPduError
+
+# List every unread SMS message in one command
+CMGL_UNREAD_TEXT = b'AT+CMGL="REC UNREAD"'
+CMGL_UNREAD_PDU = b'AT+CMGL=0'
+
+# Command listing every unread SMS message for the SMS message format
+def list_unread_command(pduMode):
+    if pduMode == True:
+        return CMGL_UNREAD_PDU
+
+    return CMGL_UNREAD_TEXT
+
+# Decode ASCII hex SMS message contents, skip the '00' UCS2 padding
+def decode_hex_message(hexMsg):
+    hexMsg = hexMsg.strip()
+    asciiHex = ''
+
+    for a in range(0, len(hexMsg) - 1, 2):
+        hexVal = hexMsg[a:a + 2]
+        if hexVal != '00':
+            asciiHex += hexVal
+
+    # Only process the ASCII hex data
+    try:
+        return binascii.unhexlify(asciiHex)
+    # None ASCII hex data
+    except (TypeError, ValueError, binascii.Error):
+        return None
+
+# Decode one stored SMS message from its header and contents line, None when invalid
+# Text mode header: "REC UNREAD","+60123456789","","19/03/11,13:14:07+32"
+# PDU mode header:  0,,24
+def decode_stored_message(msgHeader, msgContent, pduMode):
+    if pduMode == True:
+        try:
+            return decode_deliver_pdu(msgContent)
+        # Malformed PDU
+        except SmsPduError:
+            return None
+
+    headerField = msgHeader.split('"')
+    if len(headerField) < 8:
+        return None
+    decodedMsg = decode_hex_message(msgContent)
+    if decodedMsg == None:
+        return None
+
+    # No user data header in text mode
+    return SmsDeliver(headerField[3], headerField[7], decodedMsg, None, None, None)
+
+# Extract every SMS message from AT+CMGL reply
+# Return list of (storage index, SmsDeliver), SmsDeliver is None for invalid message
+def parse_cmgl_reply(gsmReply, pduMode):
+    inboxList = []
+    replyLines = gsmReply.splitlines()
+
+    for a in range(0, len(replyLines) - 1):
+        # Text mode: +CMGL: 1,"REC UNREAD","+60123456789","","19/03/11,13:14:07+32"
+        # PDU mode:  +CMGL: 1,0,,24
+        if replyLines[a].startswith('+CMGL:'):
+            msgHeader = replyLines[a][6:]
+            try:
+                msgIndx = int(msgHeader.split(',')[0])
+                # Only keep the message status onward
+                msgHeader = msgHeader[msgHeader.index(',') + 1:]
+            # Malformed entry without storage index
+            except ValueError:
+                continue
+
+            inboxList.append((msgIndx, decode_stored_message(msgHeader, replyLines[a + 1], pduMode)))
+
+    return inboxList
+
+# Put the AT+CMGL entries back in arrival order, by service centre time stamp then +CMTI arrival
+# cmtiIndexList holds the +CMTI storage indices in arrival order, the last one of a reused index counts
+def arrival_order(inboxList, cmtiIndexList):
+    arrivalPos = {}
+    for a in range(0, len(cmtiIndexList)):
+        arrivalPos[cmtiIndexList[a]] = a
+
+    def arrival_key(inboxEntry):
+        msgIndx, smsDeliver = inboxEntry
+        # Time stamp e.g. 19/03/11,13:14:07+32, the time zone left out
+        msgTime = ''
+        if smsDeliver != None and smsDeliver.timestamp:
+            msgTime = smsDeliver.timestamp[:17]
+
+        return (msgTime, arrivalPos.get(msgIndx, len(cmtiIndexList)), msgIndx)
+
+    return sorted(inboxList, key=arrival_key)
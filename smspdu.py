@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+# SMS PDU codec
+#
+# Decode SMS-DELIVER PDUs received in PDU mode (AT+CMGF=0), including the
+# user data header of concatenated SMS messages, and encode the SMS-SUBMIT
+# PDU used to send the poll request. Multipart messages are reassembled by
+# their UDH reference and sequence number, so a message completes the moment
+# its last part arrives, whichever order the parts come in.
+
+import binascii
+import collections
+
+# Monotonic clock for the multipart message age
+from monoclock import monotonic
+
+# GSM 03.38 default alphabet, basic character set
+GSM_BASIC_CHARSET = (u'@£$¥èéùìòÇ\nØø\rÅå'
+                     u'Δ_ΦΓΛΩΠΨΣΘΞ\x1bÆæßÉ'
+                     u' !"#¤%&\'()*+,-./0123456789:;<=>?'
+                     u'¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§'
+                     u'¿abcdefghijklmnopqrstuvwxyzäöñüà')
+
+# GSM 03.38 default alphabet, extension table after the escape character
+GSM_EXTENSION_CHARSET = {
+    0x0A : u'\x0c',
+    0x14 : u'^',
+    0x28 : u'{',
+    0x29 : u'}',
+    0x2F : u'\\',
+    0x3C : u'[',
+    0x3D : u'~',
+    0x3E : u']',
+    0x40 : u'|',
+    0x65 : u'€',
+}
+
+GSM_ESCAPE = 0x1B
+
+# User data alphabet from the data coding scheme
+ALPHABET_7BIT = 0
+ALPHABET_8BIT = 1
+ALPHABET_UCS2 = 2
+
+# Information element identifier for concatenated SMS message
+IEI_CONCAT_8BIT_REF = 0x00
+IEI_CONCAT_16BIT_REF = 0x08
+
+# Incomplete multipart message are dropped after this time (seconds)
+CONCAT_MAX_AGE = 300
+
+# Decoded SMS-DELIVER message, concatRef is None for single part message
+SmsDeliver = collections.namedtuple('SmsDeliver', ['sender', 'timestamp', 'text', 'concatRef', 'concatTotal', 'concatSeq'])
+
+# Malformed or unsupported SMS PDU
+class SmsPduError(ValueError):
+    pass
+
+# Unpack GSM 7-bit packed septets, skip the fill bits in front of the first septet
+def unpack_septets(octetData, septetCnt, fillBits=0):
+    septetList = []
+    bitBuffer = 0
+    bitCnt = 0
+
+    for octet in bytearray(octetData):
+        bitBuffer |= octet << bitCnt
+        bitCnt += 8
+        if fillBits > 0:
+            bitBuffer >>= fillBits
+            bitCnt -= fillBits
+            fillBits = 0
+        while bitCnt >= 7:
+            septetList.append(bitBuffer & 0x7F)
+            bitBuffer >>= 7
+            bitCnt -= 7
+
+    return septetList[:septetCnt]
+
+# Pack septets into GSM 7-bit octets
+def pack_septets(septetList):
+    octetData = bytearray()
+    bitBuffer = 0
+    bitCnt = 0
+
+    for septet in septetList:
+        bitBuffer |= septet << bitCnt
+        bitCnt += 7
+        while bitCnt >= 8:
+            octetData.append(bitBuffer & 0xFF)
+            bitBuffer >>= 8
+            bitCnt -= 8
+
+    if bitCnt > 0:
+        octetData.append(bitBuffer & 0xFF)
+
+    return bytes(octetData)
+
+# Convert septets to text with GSM 03.38 default alphabet
+def decode_gsm_alphabet(septetList):
+    smsText = u''
+    escape = False
+
+    for septet in septetList:
+        if escape:
+            smsText += GSM_EXTENSION_CHARSET.get(septet, u' ')
+            escape = False
+        elif septet == GSM_ESCAPE:
+            escape = True
+        else:
+            smsText += GSM_BASIC_CHARSET[septet]
+
+    return smsText
+
+# Convert text to septets with GSM 03.38 default alphabet
+def encode_gsm_alphabet(smsText):
+    septetList = []
+
+    for oneChar in smsText:
+        septet = GSM_BASIC_CHARSET.find(oneChar)
+        if septet != -1 and septet != GSM_ESCAPE:
+            septetList.append(septet)
+            continue
+
+        for extSeptet, extChar in GSM_EXTENSION_CHARSET.items():
+            if extChar == oneChar:
+                septetList.extend([GSM_ESCAPE, extSeptet])
+                break
+        else:
+            raise SmsPduError("Character %r not in GSM default alphabet" % (oneChar))
+
+    return septetList
+
+# Decode semi-octet digits, e.g. phone number and time stamp
+def decode_semi_octets(octetData):
+    digitList = ''
+
+    for octet in bytearray(octetData):
+        digitList += '%X%X' % (octet & 0x0F, octet >> 4)
+
+    return digitList.rstrip('F')
+
+# Encode digits into semi-octets, padded with 'F'
+def encode_semi_octets(digitList):
+    if len(digitList) % 2:
+        digitList += 'F'
+
+    return ''.join([digitList[a + 1] + digitList[a] for a in range(0, len(digitList), 2)])
+
+# User data alphabet from the data coding scheme
+def dcs_alphabet(dataCoding):
+    # General data coding and automatic deletion group
+    if dataCoding & 0x80 == 0:
+        return (dataCoding >> 2) & 0x03
+    # Message waiting group, UCS2
+    if dataCoding & 0xF0 == 0xE0:
+        return ALPHABET_UCS2
+    # Data coding / message class
+    if dataCoding & 0xF0 == 0xF0:
+        if dataCoding & 0x04:
+            return ALPHABET_8BIT
+        return ALPHABET_7BIT
+
+    return ALPHABET_7BIT
+
+# Get the concatenated SMS reference, total and sequence from user data header
+def parse_concat_header(udhData):
+    udhData = bytearray(udhData)
+    a = 0
+
+    while a + 1 < len(udhData):
+        ieId = udhData[a]
+        ieLen = udhData[a + 1]
+        ieData = udhData[a + 2:a + 2 + ieLen]
+        if len(ieData) != ieLen:
+            raise SmsPduError("Truncated user data header")
+
+        if ieId == IEI_CONCAT_8BIT_REF and ieLen == 3:
+            return ieData[0], ieData[1], ieData[2]
+        if ieId == IEI_CONCAT_16BIT_REF and ieLen == 4:
+            return (ieData[0] << 8) | ieData[1], ieData[2], ieData[3]
+
+        a += 2 + ieLen
+
+    return None, None, None
+
+# Decode SMS-DELIVER PDU in hex, as received with +CMT, +CMGR or +CMGL
+def decode_deliver_pdu(pduHex):
+    try:
+        pduData = bytearray(binascii.unhexlify(pduHex.strip()))
+    except (TypeError, ValueError, binascii.Error):
+        raise SmsPduError("PDU is not hex data: %r" % (pduHex))
+
+    try:
+        # Skip the service center address
+        a = pduData[0] + 1
+
+        firstOctet = pduData[a]
+        a += 1
+        # Only SMS-DELIVER message carry the tracker reply
+        if firstOctet & 0x03 != 0x00:
+            raise SmsPduError("Not an SMS-DELIVER PDU")
+        udhPresent = (firstOctet & 0x40) != 0
+
+        # Originating address, length in digits
+        addrLen = pduData[a]
+        addrType = pduData[a + 1]
+        addrData = pduData[a + 2:a + 2 + (addrLen + 1) // 2]
+        a += 2 + (addrLen + 1) // 2
+        # Alphanumeric sender
+        if addrType & 0x70 == 0x50:
+            sender = decode_gsm_alphabet(unpack_septets(addrData, addrLen * 4 // 7))
+        else:
+            sender = decode_semi_octets(addrData)
+            # International number
+            if addrType & 0x70 == 0x10:
+                sender = '+' + sender
+
+        dataCoding = pduData[a + 1]
+        a += 2
+
+        # Service center time stamp, e.g. 19/03/11,13:14:07+32
+        stampDigits = decode_semi_octets(pduData[a:a + 7])
+        timestamp = '%s/%s/%s,%s:%s:%s+%s' % (stampDigits[0:2], stampDigits[2:4], stampDigits[4:6],
+                                             stampDigits[6:8], stampDigits[8:10], stampDigits[10:12],
+                                             stampDigits[12:14])
+        a += 7
+
+        userDataLen = pduData[a]
+        userData = pduData[a + 1:]
+    except IndexError:
+        raise SmsPduError("Truncated SMS-DELIVER PDU")
+
+    alphabet = dcs_alphabet(dataCoding)
+
+    # User data header in front of the message text
+    concatRef, concatTotal, concatSeq = None, None, None
+    udhOctetCnt = 0
+    if udhPresent:
+        if len(userData) == 0:
+            raise SmsPduError("Missing user data header")
+        udhOctetCnt = userData[0] + 1
+        concatRef, concatTotal, concatSeq = parse_concat_header(userData[1:udhOctetCnt])
+
+    if alphabet == ALPHABET_7BIT:
+        # Header are padded up to the septet boundary
+        udhSeptetCnt = (udhOctetCnt * 8 + 6) // 7
+        fillBits = udhSeptetCnt * 7 - udhOctetCnt * 8
+        septetList = unpack_septets(userData[udhOctetCnt:], userDataLen - udhSeptetCnt, fillBits)
+        if len(septetList) != userDataLen - udhSeptetCnt:
+            raise SmsPduError("Truncated user data")
+        smsText = decode_gsm_alphabet(septetList)
+    else:
+        textData = userData[udhOctetCnt:userDataLen]
+        if len(textData) != userDataLen - udhOctetCnt:
+            raise SmsPduError("Truncated user data")
+        if alphabet == ALPHABET_UCS2:
+            smsText = bytes(textData).decode('utf-16-be', 'replace')
+        else:
+            smsText = bytes(textData).decode('latin-1')
+
+    return SmsDeliver(sender, timestamp, smsText, concatRef, concatTotal, concatSeq)
+
+# Encode SMS-SUBMIT PDU in GSM 7-bit, return the PDU hex and the TPDU length for AT+CMGS
+def encode_submit_pdu(cellPhoneNo, smsText):
+    # International or national number
+    if cellPhoneNo.startswith('+'):
+        addrType = '91'
+        addrDigits = cellPhoneNo[1:]
+    else:
+        addrType = '81'
+        addrDigits = cellPhoneNo
+
+    septetList = encode_gsm_alphabet(smsText)
+    userData = binascii.hexlify(pack_septets(septetList)).decode('ascii').upper()
+
+    tpduHex = '0100%02X%s%s0000%02X%s' % (len(addrDigits), addrType, encode_semi_octets(addrDigits),
+                                          len(septetList), userData)
+
+    # Default service center from the SIM card, not part of the TPDU length
+    return str("00" + tpduHex), len(tpduHex) // 2
+
+# Reassemble concatenated SMS message by sender, reference and sequence number
+class ConcatReassembler(object):
+
+    def __init__(self, maxAge=CONCAT_MAX_AGE):
+        self.maxAge = maxAge
+        # (sender, reference) -> [total part, {sequence : text}, first part time]
+        self.pending = {}
+
+    # Add one message part, return the complete message text once every part arrived
+    def add(self, sender, concatRef, concatTotal, concatSeq, smsText):
+        # Single part message
+        if concatRef is None or concatTotal is None or concatTotal <= 1:
+            return smsText
+
+        return self.add_part((sender, concatRef), concatTotal, concatSeq, smsText)
+
+    # Add message part without user data header, numbered in order of arrival
+    def add_in_order(self, sender, concatTotal, smsText):
+        if concatTotal <= 1:
+            return smsText
+
+        concatMsg = self.pending.get((sender, None))
+        if concatMsg is None:
+            concatSeq = 1
+        else:
+            concatSeq = len(concatMsg[1]) + 1
+
+        return self.add_part((sender, None), concatTotal, concatSeq, smsText)
+
+    # Store message part, join every part in sequence order once complete
+    def add_part(self, concatKey, concatTotal, concatSeq, smsText):
+        concatMsg = self.pending.get(concatKey)
+        if concatMsg is None:
+            concatMsg = [concatTotal, {}, monotonic()]
+            self.pending[concatKey] = concatMsg
+        concatMsg[1][concatSeq] = smsText
+
+        # Waiting for the other message parts
+        if len(concatMsg[1]) < concatMsg[0]:
+            return None
+
+        del self.pending[concatKey]
+        return u''.join([concatMsg[1][seq] for seq in sorted(concatMsg[1])])
+
+    # Drop every incomplete message from the sender
+    def discard(self, sender):
+        for concatKey in list(self.pending):
+            if concatKey[0] == sender:
+                del self.pending[concatKey]
+
+    # Drop incomplete message older than the maximum age, return the senders
+    def expire(self, now=None):
+        if now is None:
+            now = monotonic()
+
+        expiredList = []
+        for concatKey in list(self.pending):
+            if now - self.pending[concatKey][2] >= self.maxAge:
+                del self.pending[concatKey]
+                expiredList.append(concatKey[0])
+
+        return expiredList
+
+    # Drop every incomplete message
+    def reset(self):
+        self.pending = {}
@@ -0,0 +1,246 @@
+# Outbound SMS message queue
+#
+# Operators push SMS messages, e.g. configuration commands to the trackers,
+# through POST /sms. Each message waits in the queue of the modem its
+# destination is assigned to, the same modem polling that tracker, ordered by
+# priority then arrival, and is drained by the modem coroutine in between the
+# GPS location poll requests. A message with the same text already waiting
+# for the same destination is coalesced into it instead of being sent twice.
+#
+# Every SMS message the modem sends, poll request or queued message, takes a
+# token from the modem send rate limit. A queued message more urgent than the
+# polling goes first, one of the same priority takes turn with the poll
+# requests, and a less urgent one is only sent while no poll is due, so a
+# bulk push never stops the polling and the polling never monopolise the
+# modem.
+
+import heapq
+import threading
+
+# Monotonic clock for the send rate limit
+from monoclock import monotonic
+
+# Priority of a queued SMS message, lower value is sent first
+SMS_PRIORITY = {'high' : 0, 'normal' : 1, 'low' : 2}
+
+# GPS location poll request take turn with the queued message of this priority
+POLL_PRIORITY = SMS_PRIORITY['normal']
+
+# Queued SMS message waiting to be sent, over every modem
+SMS_QUEUE_SIZE = 10000
+
+# Send attempt before a queued SMS message is given up
+SMS_MAX_ATTEMPT = 3
+
+# Longest text of a queued SMS message, single message only (GSM 7-bit characters)
+SMS_MAX_SEPTET = 160
+
+# SMS message waiting in the outbound queue
+class OutboundSms(object):
+
+    __slots__ = ('smsId', 'destination', 'smsText', 'priority', 'attemptCnt', 'heapSeq')
+
+    def __init__(self, smsId, destination, smsText, priority):
+        self.smsId = smsId
+        self.destination = destination
+        self.smsText = smsText
+        self.priority = priority
+        self.attemptCnt = 0
+        # Sequence no. of its valid heap entry, older entries are stale
+        self.heapSeq = 0
+
+    def __repr__(self):
+        return 'OutboundSms(%d, %r, %r, %d)' % (self.smsId, self.destination, self.smsText, self.priority)
+
+# Outbound SMS message queue per modem, filled by the REST API threads and drained by the modem event loop
+class SmsOutbox(object):
+
+    def __init__(self, modemCnt, maxSize=SMS_QUEUE_SIZE):
+        self.maxSize = maxSize
+        self.lock = threading.Lock()
+        self.smsSeq = 0
+        self.heapSeq = 0
+        # Sequence no. of the message put back in front, counting down
+        self.frontSeq = 0
+        # (priority, heap sequence no., message) per modem, entry not matching the message heapSeq are stale
+        self.heapList = [[] for modemId in range(modemCnt)]
+        # Waiting message per modem, (destination, text) -> message
+        self.pendingList = [{} for modemId in range(modemCnt)]
+        self.pendingCnt = 0
+
+    # Add the heap entry of the message, called with the lock held
+    def push(self, modemId, outboundSms):
+        self.heapSeq += 1
+        outboundSms.heapSeq = self.heapSeq
+        heapq.heappush(self.heapList[modemId], (outboundSms.priority, self.heapSeq, outboundSms))
+
+    # Queue SMS message for the modem, return (message, coalesced), None when the queue is full
+    def put(self, modemId, destination, smsText, priority=POLL_PRIORITY):
+        smsKey = (destination, smsText)
+
+        with self.lock:
+            outboundSms = self.pendingList[modemId].get(smsKey)
+            # Same message already waiting, send it once at the most urgent priority
+            if outboundSms is not None:
+                if priority < outboundSms.priority:
+                    outboundSms.priority = priority
+                    self.push(modemId, outboundSms)
+                return outboundSms, True
+
+            if self.pendingCnt >= self.maxSize:
+                return None
+
+            self.smsSeq += 1
+            outboundSms = OutboundSms(self.smsSeq, destination, smsText, priority)
+            self.pendingList[modemId][smsKey] = outboundSms
+            self.pendingCnt += 1
+            self.push(modemId, outboundSms)
+
+        return outboundSms, False
+
+    # Drop the stale heap entries on top, called with the lock held
+    def head_entry(self, modemId):
+        modemHeap = self.heapList[modemId]
+        while len(modemHeap) > 0:
+            outboundSms = modemHeap[0][2]
+            if outboundSms.heapSeq == modemHeap[0][1] and \
+               self.pendingList[modemId].get((outboundSms.destination, outboundSms.smsText)) is outboundSms:
+                return modemHeap[0]
+            heapq.heappop(modemHeap)
+
+        return None
+
+    # Priority of the next message for the modem, None when nothing waiting
+    def head_priority(self, modemId):
+        with self.lock:
+            headEntry = self.head_entry(modemId)
+
+        if headEntry is None:
+            return None
+
+        return headEntry[0]
+
+    # Take the next message for the modem, None when nothing waiting
+    def pop(self, modemId):
+        with self.lock:
+            headEntry = self.head_entry(modemId)
+            if headEntry is None:
+                return None
+
+            heapq.heappop(self.heapList[modemId])
+            outboundSms = headEntry[2]
+            del self.pendingList[modemId][(outboundSms.destination, outboundSms.smsText)]
+            self.pendingCnt -= 1
+
+        return outboundSms
+
+    # Send failed, queue the message again unless it used up its attempts, return True when queued again
+    def send_failed(self, modemId, outboundSms, maxAttempt=SMS_MAX_ATTEMPT):
+        outboundSms.attemptCnt += 1
+        if outboundSms.attemptCnt >= maxAttempt:
+            return False
+
+        smsKey = (outboundSms.destination, outboundSms.smsText)
+        with self.lock:
+            # Same message queued again meanwhile, that one is sent instead
+            if smsKey in self.pendingList[modemId]:
+                return True
+
+            self.pendingList[modemId][smsKey] = outboundSms
+            self.pendingCnt += 1
+            self.push(modemId, outboundSms)
+
+        return True
+
+    # Send did not complete, e.g. serial communication lost, put the message back in front of its priority
+    # The attempt is not counted, the modem failed and not the message
+    def put_back(self, modemId, outboundSms):
+        smsKey = (outboundSms.destination, outboundSms.smsText)
+        with self.lock:
+            # Same message queued again meanwhile, that one is sent instead
+            if smsKey in self.pendingList[modemId]:
+                return
+
+            self.pendingList[modemId][smsKey] = outboundSms
+            self.pendingCnt += 1
+            self.frontSeq -= 1
+            outboundSms.heapSeq = self.frontSeq
+            heapq.heappush(self.heapList[modemId], (outboundSms.priority, self.frontSeq, outboundSms))
+
+    # Move the waiting message of the modem to the modem now assigned to its destination
+    # Return the modems given any message
+    def reroute(self, modemId, assign):
+        movedSet = set()
+
+        with self.lock:
+            pendingDict = self.pendingList[modemId]
+            self.pendingList[modemId] = {}
+            self.heapList[modemId] = []
+
+            # Keep the waiting order, message put back in front first
+            for outboundSms in sorted(pendingDict.values(), key=lambda outboundSms: outboundSms.heapSeq):
+                smsKey = (outboundSms.destination, outboundSms.smsText)
+                toModemId = assign(outboundSms.destination)
+                # No other modem alive, keep it
+                if toModemId is None:
+                    toModemId = modemId
+
+                # Same message already waiting at the other modem
+                if smsKey in self.pendingList[toModemId]:
+                    self.pendingCnt -= 1
+                    continue
+
+                self.pendingList[toModemId][smsKey] = outboundSms
+                self.push(toModemId, outboundSms)
+                if toModemId != modemId:
+                    movedSet.add(toModemId)
+
+        return movedSet
+
+    # Waiting message count of the modem
+    def modem_pending(self, modemId):
+        with self.lock:
+            return len(self.pendingList[modemId])
+
+# Token bucket send rate limit of one modem, used from the modem event loop thread only
+class SendRateLimit(object):
+
+    # sendRate in SMS message per minute, 0 for no limit
+    def __init__(self, sendRate, sendBurst=1, clock=monotonic):
+        self.sendRate = sendRate / 60.0
+        self.sendBurst = float(max(sendBurst, 1))
+        self.clock = clock
+        self.token = self.sendBurst
+        self.lastTime = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.token = min(self.sendBurst, self.token + (now - self.lastTime) * self.sendRate)
+        self.lastTime = now
+
+    # Check whether a SMS message can be sent now
+    def ready(self):
+        if self.sendRate <= 0:
+            return True
+
+        self.refill()
+        return self.token >= 1.0
+
+    # SMS message sent, take its token
+    def take(self):
+        if self.sendRate <= 0:
+            return
+
+        self.refill()
+        self.token -= 1.0
+
+    # Time the next SMS message can be sent (monotonic clock)
+    def next_time(self):
+        if self.sendRate <= 0:
+            return self.clock()
+
+        self.refill()
+        if self.token >= 1.0:
+            return self.lastTime
+
+        return self.lastTime + (1.0 - self.token) / self.sendRate
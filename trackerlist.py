@@ -0,0 +1,106 @@
+# GPS tracker list loader
+#
+# Stream the GPS vehicle tracker list file one line at a time, any number of
+# trackers. Blank lines and '#' comments are skipped, and every cell phone
+# no. is normalised to E.164 format (+<country code><number>), so the same
+# tracker written in different ways is loaded only once.
+#
+# The file is watched by its modification time, so the tracker list can be
+# edited while the gateway is running.
+
+import os
+import threading
+import time
+
+# Separator characters allowed inside a cell phone no.
+NUMBER_SEPARATOR = ' -().\t'
+
+# Longest E.164 number, without the '+'
+E164_MAX_DIGIT = 15
+
+# Normalise cell phone no. to E.164 format, None when not a valid number
+# +60 12-345 6789, 0060123456789, 0123456789 and 60123456789 all become +60123456789
+def normalize_number(cellPhoneNo, countryCode):
+    for sepChar in NUMBER_SEPARATOR:
+        cellPhoneNo = cellPhoneNo.replace(sepChar, '')
+
+    # International number
+    if cellPhoneNo.startswith('+'):
+        numberDigit = cellPhoneNo[1:]
+    # International call prefix
+    elif cellPhoneNo.startswith('00'):
+        numberDigit = cellPhoneNo[2:]
+    # National number, trunk prefix replaced by the country code
+    elif cellPhoneNo.startswith('0'):
+        numberDigit = countryCode + cellPhoneNo[1:]
+    # Already start with the country code
+    else:
+        numberDigit = cellPhoneNo
+
+    if not numberDigit.isdigit() or len(numberDigit) > E164_MAX_DIGIT:
+        return None
+
+    return '+' + numberDigit
+
+# Normalised cell phone no. from the tracker list file, in file order
+# Invalid line are appended to invalidList, duplicate are left to the caller
+def read_tracker_list(listPath, countryCode, invalidList=None):
+    with open(listPath, 'r') as listFile:
+        for listLine in listFile:
+            listLine = listLine.split('#', 1)[0].strip()
+            if listLine == '':
+                continue
+
+            gpsid = normalize_number(listLine, countryCode)
+            if gpsid is None:
+                if invalidList is not None:
+                    invalidList.append(listLine)
+                continue
+
+            yield gpsid
+
+# Watch the tracker list file for change by its modification time and size
+class TrackerListWatcher(object):
+
+    # onChange is called from the watcher thread after the file changed
+    def __init__(self, listPath, onChange, checkInterval):
+        self.listPath = listPath
+        self.onChange = onChange
+        self.checkInterval = checkInterval
+        self.fileStamp = self.file_stamp()
+        self.watchThread = None
+
+    # File modification time and size, None when the file does not exist
+    def file_stamp(self):
+        try:
+            fileStat = os.stat(self.listPath)
+        except OSError:
+            return None
+
+        return fileStat.st_mtime, fileStat.st_size
+
+    # Check once, call onChange when the file changed since the last check
+    def check(self):
+        fileStamp = self.file_stamp()
+        # File being replaced, check again later
+        if fileStamp is None or fileStamp == self.fileStamp:
+            return False
+
+        self.fileStamp = fileStamp
+        self.onChange()
+        return True
+
+    # Start the watcher thread
+    def start(self):
+        self.watchThread = threading.Thread(target=self.watch_loop, name='trackerlistwatcher')
+        self.watchThread.daemon = True
+        self.watchThread.start()
+
+    # Watcher thread, keep running even when onChange failed
+    def watch_loop(self):
+        while True:
+            time.sleep(self.checkInterval)
+            try:
+                self.check()
+            except Exception:
+                pass
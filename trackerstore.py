@@ -0,0 +1,197 @@
+# GPS tracker data store
+#
+# Keep the GPS tracker records in the order returned by /gpsinfo, together
+# with a dictionary index from the tracker cell phone no. (gpsid) to its
+# record, so a reply is matched to its tracker without scanning the list.
+# Every change goes through the store, which keeps both in sync and bumps
+# the store version. The changed record is stamped with that version as its
+# sequence number and moved to the end of the change index, so the records
+# changed after a given sequence number are found without scanning the list.
+#
+# A record only holds the tracker cell phone no., its sequence number and
+# the typed GPS location last decoded, it is turned into the JSON shape of
+# the REST API when read out of the store.
+
+import collections
+import threading
+
+# GPS location record and its JSON field
+from gpsparser import empty_json
+
+# GPS tracker record, GPS location None until the first reply
+class TrackerRecord(object):
+
+    __slots__ = ('gpsid', 'seq', 'gpsFix')
+
+    def __init__(self, gpsid, seq=0, gpsFix=None):
+        self.gpsid = gpsid
+        self.seq = seq
+        self.gpsFix = gpsFix
+
+    # Record in the REST API JSON shape, every field as text
+    def as_json(self):
+        if self.gpsFix is None:
+            recordJson = empty_json()
+        else:
+            recordJson = self.gpsFix.as_json()
+        recordJson['gpsid'] = self.gpsid
+        recordJson['seq'] = self.seq
+
+        return recordJson
+
+# Construct new tracker record without any GPS location
+def new_record(gpsid, seq=0):
+    return TrackerRecord(gpsid, seq)
+
+# GPS tracker list data with lookup index by gpsid
+class TrackerStore(object):
+
+    def __init__(self, gpsidList=()):
+        # Shared by the REST API and the modem event loop
+        self.lock = threading.RLock()
+        self.trackerList = []
+        self.trackerIndex = {}
+        # Incremented on every change
+        self.version = 0
+        # gpsid -> tracker record, ordered by sequence number
+        self.changeIndex = collections.OrderedDict()
+        # Store version of the last reset, older sequence number can not get the delta
+        self.resetSeq = 0
+
+        self.reset(gpsidList)
+
+    # Check whether the tracker exist in the store
+    def contains(self, gpsid):
+        return gpsid in self.trackerIndex
+
+    # Tracker cell phone no. in list order
+    def gpsid_list(self):
+        with self.lock:
+            return [trackerRecord.gpsid for trackerRecord in self.trackerList]
+
+    # Add new tracker without GPS location, existing tracker are kept as it is
+    def insert(self, gpsid):
+        with self.lock:
+            if gpsid in self.trackerIndex:
+                return False
+
+            trackerRecord = new_record(gpsid)
+            self.trackerList.append(trackerRecord)
+            self.trackerIndex[gpsid] = trackerRecord
+            self.stamp(trackerRecord)
+            return True
+
+    # Update tracker GPS location, add the tracker when not exist yet
+    # Return the updated record in the REST API JSON shape
+    def update(self, gpsid, gpsFix):
+        with self.lock:
+            trackerRecord = self.trackerIndex.get(gpsid)
+            if trackerRecord is None:
+                self.insert(gpsid)
+                trackerRecord = self.trackerIndex[gpsid]
+
+            trackerRecord.gpsFix = gpsFix
+            self.stamp(trackerRecord)
+
+            return trackerRecord.as_json()
+
+    # Bump the store version and move the changed record to the end of the change index
+    def stamp(self, trackerRecord):
+        self.version += 1
+        trackerRecord.seq = self.version
+        self.changeIndex.pop(trackerRecord.gpsid, None)
+        self.changeIndex[trackerRecord.gpsid] = trackerRecord
+
+    # Replace every tracker, all GPS location are cleared
+    def reset(self, gpsidList):
+        trackerList = []
+        trackerIndex = {}
+        changeIndex = collections.OrderedDict()
+
+        for gpsid in gpsidList:
+            if gpsid not in trackerIndex:
+                trackerRecord = new_record(gpsid)
+                trackerList.append(trackerRecord)
+                trackerIndex[gpsid] = trackerRecord
+                changeIndex[gpsid] = trackerRecord
+
+        with self.lock:
+            self.version += 1
+            for trackerRecord in trackerList:
+                trackerRecord.seq = self.version
+            self.trackerList = trackerList
+            self.trackerIndex = trackerIndex
+            self.changeIndex = changeIndex
+            self.resetSeq = self.version
+
+    # Snapshot of every tracker record in list order
+    def as_list(self):
+        with self.lock:
+            return [trackerRecord.as_json() for trackerRecord in self.trackerList]
+
+    # Bring the trackers in line with the given list, GPS location of the unchanged tracker are kept
+    # Return (added, removed) cell phone no.
+    def sync(self, gpsidList):
+        gpsidList = list(gpsidList)
+        trackerList = []
+        trackerIndex = {}
+        addedList = []
+
+        with self.lock:
+            for gpsid in gpsidList:
+                if gpsid in trackerIndex:
+                    continue
+
+                trackerRecord = self.trackerIndex.get(gpsid)
+                if trackerRecord is None:
+                    trackerRecord = new_record(gpsid)
+                    addedList.append(trackerRecord)
+                trackerList.append(trackerRecord)
+                trackerIndex[gpsid] = trackerRecord
+
+            removedList = [gpsid for gpsid in self.trackerIndex if gpsid not in trackerIndex]
+            # Only the list order changed, the full list reader have to see it
+            if len(addedList) == 0 and len(removedList) == 0 and \
+               any([oldRecord is not trackerRecord for oldRecord, trackerRecord in zip(self.trackerList, trackerList)]):
+                self.version += 1
+
+            self.trackerList = trackerList
+            self.trackerIndex = trackerIndex
+            for trackerRecord in addedList:
+                self.stamp(trackerRecord)
+            for gpsid in removedList:
+                del self.changeIndex[gpsid]
+            # Removed tracker can not be told by the delta, client have to get every record
+            if len(removedList) > 0:
+                self.version += 1
+                self.resetSeq = self.version
+
+            return [trackerRecord.gpsid for trackerRecord in addedList], removedList
+
+    # Store version together with the snapshot of every tracker record
+    def snapshot(self):
+        with self.lock:
+            return self.version, self.as_list()
+
+    # Tracker record changed after the given sequence number, oldest change first
+    # Return (store version, records, full), full is True when every record are returned
+    # because the trackers were replaced after that sequence number
+    def changed_since(self, seq):
+        with self.lock:
+            if seq < self.resetSeq or seq > self.version:
+                return self.version, self.as_list(), True
+
+            changedList = []
+            # Walk back from the latest change, stop at the first record not changed
+            for gpsid in reversed(self.changeIndex):
+                trackerRecord = self.changeIndex[gpsid]
+                if trackerRecord.seq <= seq:
+                    break
+                changedList.append(trackerRecord.as_json())
+            changedList.reverse()
+
+            return self.version, changedList, False
+
+    # Number of tracker in the store
+    def __len__(self):
+        return len(self.trackerList)